@@ -0,0 +1,106 @@
+"""Measure the command throughput of the simulator under multi-client load.
+
+Run with e.g.::
+
+    $ python benchmarks/bench_adapter.py --clients 4 --depth 32
+
+Each client keeps ``depth`` pipelined queries in flight. The same load is run with
+and without the adapter's fast path interpreter, and results are printed as JSON.
+"""
+import asyncio
+import json
+import sys
+import time
+from argparse import ArgumentParser
+
+from fastcs.connections import IPConnectionSettings
+
+from demo_fast_cs.connections import PipelinedIPConnection
+from demo_fast_cs.simulation.device import TempController
+from demo_fast_cs.simulation.runner import LocalSimulation
+
+QUERIES = ["T{:02d}?\r\n", "N{:02d}?\r\n", "S{:02d}?\r\n", "E{:02d}?\r\n"]
+
+
+async def client_load(port: int, channels: int, depth: int, deadline: float) -> int:
+    conn = PipelinedIPConnection()
+    await conn.connect(IPConnectionSettings("127.0.0.1", port))
+    messages = [
+        QUERIES[index % len(QUERIES)].format(index % channels + 1)
+        for index in range(depth)
+    ]
+
+    sent = 0
+    while time.perf_counter() < deadline:
+        await asyncio.gather(*[conn.send_query(message) for message in messages])
+        sent += depth
+
+    await conn.close()
+    return sent
+
+
+async def bench_load(
+    fast_path: bool, clients: int, channels: int, depth: int, duration: float
+) -> dict:
+    simulation = LocalSimulation(
+        TempController(
+            name="tempcont",
+            inputs={},
+            num_ramp_controllers=channels,
+            port=0,
+            fast_path=fast_path,
+        )
+    )
+    await simulation.start()
+
+    start = time.perf_counter()
+    sent = await asyncio.gather(
+        *[
+            client_load(simulation.port, channels, depth, start + duration)
+            for _ in range(clients)
+        ]
+    )
+    elapsed = time.perf_counter() - start
+
+    await simulation.stop()
+    return {
+        "fast_path": fast_path,
+        "clients": clients,
+        "depth": depth,
+        "commands": sum(sent),
+        "commands_per_s": sum(sent) / elapsed,
+    }
+
+
+def main(args=None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=64)
+    parser.add_argument("--depth", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("-o", "--output", help="Write JSON here instead of stdout")
+    parsed = parser.parse_args(args)
+
+    results = [
+        asyncio.run(
+            bench_load(
+                fast_path,
+                parsed.clients,
+                parsed.channels,
+                parsed.depth,
+                parsed.duration,
+            )
+        )
+        for fast_path in (False, True)
+    ]
+    result = {"benchmark": "adapter_load", "results": results}
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Measure the cost of a `TempControllerDevice` simulation tick.
+
+Run with e.g.::
+
+    $ python benchmarks/bench_device.py --channels 1000 100000 --enabled 0.5
+
+Results are printed as JSON so that runs from different commits can be compared.
+"""
+import json
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+import numpy as np
+from tickit.core.typedefs import SimTime
+
+from demo_fast_cs.simulation.device import TempControllerDevice
+
+TICK_NS = int(1e8)
+
+
+def bench_tick(num_channels: int, enabled_fraction: float, ticks: int) -> dict:
+    device = TempControllerDevice(num_channels, 0, 10**9)
+    enabled = np.arange(int(num_channels * enabled_fraction))
+    for index in enabled:
+        device.set_enabled(int(index), 1)
+
+    inputs = {"flux": 0.0}
+    device.update(SimTime(0), inputs)  # type: ignore
+
+    start = time.perf_counter_ns()
+    for tick in range(1, ticks + 1):
+        device.update(SimTime(tick * TICK_NS), inputs)  # type: ignore
+    elapsed = time.perf_counter_ns() - start
+
+    tracemalloc.start()
+    device.update(SimTime((ticks + 1) * TICK_NS), inputs)  # type: ignore
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "channels": num_channels,
+        "enabled": len(enabled),
+        "ticks": ticks,
+        "tick_us": elapsed / ticks / 1e3,
+        "tick_peak_alloc_bytes": peak,
+    }
+
+
+def main(args=None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, nargs="+", default=[100, 100_000])
+    parser.add_argument("--enabled", type=float, default=1.0, help="Fraction enabled")
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("-o", "--output", help="Write JSON here instead of stdout")
+    parsed = parser.parse_args(args)
+
+    results = [
+        bench_tick(num_channels, parsed.enabled, parsed.ticks)
+        for num_channels in parsed.channels
+    ]
+    result = {"benchmark": "device_tick", "results": results}
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Measure the memory and poll throughput of a TempControllerGroup per device.
+
+Run with e.g.::
+
+    $ python benchmarks/bench_group.py --devices 1 10 100 --channels 4
+
+For each number of devices, a ``SimulatorFarm`` of that many simulated devices is run
+in other processes, so that the simulators do not compete with the controllers for
+this one. A ``TempControllerGroup`` of the devices is created and connected, with the
+memory allocated meanwhile measured with tracemalloc, and every channel is enabled so
+that the ramp attributes are polled at the fastest rate. Then every attribute of every
+device is updated over and over for ``--duration`` s, as the backend's scan tasks
+would with no period, and the attribute polls per second of wall clock and of CPU time
+in this process are emitted as JSON.
+
+With ``--workers``, the ramp attribute columns are polled from that many worker
+processes, so the polls per CPU-second of this process are of requesting and
+publishing them alone.
+"""
+import asyncio
+import json
+import signal
+import subprocess
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from fastcs.attributes import AttrR
+from fastcs.connections import IPConnectionSettings
+
+from demo_fast_cs import __version__
+from demo_fast_cs.controllers import TempControllerSettings
+from demo_fast_cs.group import TempControllerGroup
+from demo_fast_cs.mapping import TempControllerMapping
+
+
+async def wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            await writer.wait_closed()
+            return
+
+
+async def bench_group(
+    devices: int, channels: int, base_port: int, duration: float, workers: int
+) -> dict:
+    farm = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "demo_fast_cs.simulation.farm",
+            f"--devices={devices}",
+            f"--channels={channels}",
+            f"--base-port={base_port}",
+            "--stats-port=0",
+        ]
+    )
+    try:
+        for index in range(devices):
+            await wait_for_port(base_port + index)
+        return await drive_group(devices, channels, base_port, duration, workers)
+    finally:
+        # Interrupted rather than terminated, so that it stops its worker processes
+        farm.send_signal(signal.SIGINT)
+        farm.wait()
+
+
+async def drive_group(
+    devices: int, channels: int, base_port: int, duration: float, workers: int
+) -> dict:
+    settings = [
+        TempControllerSettings(
+            channels,
+            IPConnectionSettings("127.0.0.1", base_port + index),
+            name=f"tc{index:03d}",
+            diagnostics=True,
+            workers=workers,
+        )
+        for index in range(devices)
+    ]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    group = TempControllerGroup(settings)
+    mapping = TempControllerMapping(group)
+    await group.connect()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    for device in group.devices:
+        await device.conn.send_command(device.protocol.broadcast("N", 1))
+    updates = [
+        (attr.updater.update, single_mapping.controller, attr)
+        for single_mapping in mapping.get_controller_mappings()
+        for attr in single_mapping.attributes.values()
+        if isinstance(attr, AttrR) and attr.updater is not None
+    ]
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    while time.perf_counter() < start + duration:
+        await asyncio.gather(
+            *[update(controller, attr) for update, controller, attr in updates],
+            return_exceptions=True,
+        )
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    polls = 0
+    for device in group.devices:
+        assert device.diagnostics is not None
+        polls += device.diagnostics.latency("poll:").total
+    await group.close()
+    return {
+        "devices": devices,
+        "channels": channels,
+        "workers": workers,
+        "memory_per_device_kib": allocated / devices / 1024,
+        "polls": polls,
+        "polls_per_s": polls / elapsed,
+        "polls_per_cpu_s": polls / cpu,
+    }
+
+
+def main(args=None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--base-port", type=int, default=31000)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument(
+        "--workers", type=int, default=0, help="Processes to poll ramp columns from"
+    )
+    parser.add_argument("-o", "--output", help="Write JSON here instead of stdout")
+    parsed = parser.parse_args(args)
+
+    result = {
+        "benchmark": "group",
+        "version": __version__,
+        "results": [
+            asyncio.run(
+                bench_group(
+                    devices,
+                    parsed.channels,
+                    parsed.base_port,
+                    parsed.duration,
+                    parsed.workers,
+                )
+            )
+            for devices in parsed.devices
+        ],
+    }
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
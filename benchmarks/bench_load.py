@@ -0,0 +1,173 @@
+"""Drive the simulator with TempController clients and report latency and throughput.
+
+Run with e.g.::
+
+    $ python benchmarks/bench_load.py --controllers 4 --channels 64 -o results.json
+
+A ``TempController`` simulation is started in-process on a loopback port and each
+client ``TempController`` repeatedly sends the ``--commands`` for every one of its
+ramp channels, where ``##`` in a command is replaced by the channel index. Commands
+without ``##`` are sent once per client per cycle. The p50/p99 latency of each command,
+the total command rate and the cost of the simulation ticks are emitted as JSON, so
+that results from different commits can be compared with ``compare.py``.
+
+Commands which do not expect a reply (``=``) only time how long it takes to write
+them.
+"""
+import asyncio
+import json
+import sys
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+
+import numpy as np
+from fastcs.connections import IPConnectionSettings
+
+from demo_fast_cs import __version__
+from demo_fast_cs.controllers import TempController, TempControllerSettings
+from demo_fast_cs.simulation.device import TempController as TempControllerSim
+from demo_fast_cs.simulation.runner import LocalSimulation
+
+DEFAULT_COMMANDS = ["T##?", "N##?", "S##?", "E##?", "T*?", "R?", "E##=50"]
+
+
+class LatencyRecorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[int]] = defaultdict(list)
+
+    async def send(self, conn, command: str, message: str) -> None:
+        start = time.perf_counter_ns()
+        if "?" in message:
+            await conn.send_query(message)
+        else:
+            await conn.send_command(message)
+        self.latencies[command].append(time.perf_counter_ns() - start)
+
+
+async def drive(
+    controller: TempController,
+    commands: list[str],
+    recorder: LatencyRecorder,
+    deadline: float,
+    period: float,
+) -> None:
+    requests = []
+    for command in commands:
+        if "##" in command:
+            requests += [
+                (rc.conn, command, command.replace("##", rc.suffix) + "\r\n")
+                for rc in controller.get_sub_controllers()
+            ]
+        else:
+            requests.append((controller.conn, command, command + "\r\n"))
+
+    while time.perf_counter() < deadline:
+        await asyncio.gather(*[recorder.send(*request) for request in requests])
+        await asyncio.sleep(period)
+
+
+def percentiles(samples_ns, scale: float = 1e3) -> dict:
+    samples = np.asarray(samples_ns) / scale
+    return {
+        "count": len(samples),
+        "p50_us": float(np.percentile(samples, 50)),
+        "p99_us": float(np.percentile(samples, 99)),
+    }
+
+
+async def bench_load(
+    controllers: int,
+    channels: int,
+    connections: int,
+    pipelined: bool,
+    commands: list[str],
+    duration: float,
+    period: float,
+) -> dict:
+    assert channels <= 99, "Channel commands only support indices 01 to 99"
+    simulation = LocalSimulation(
+        TempControllerSim(
+            name="tempcont", inputs={}, num_ramp_controllers=channels, port=0
+        )
+    )
+    await simulation.start()
+
+    settings = TempControllerSettings(
+        channels,
+        IPConnectionSettings("127.0.0.1", simulation.port),
+        pipelined=pipelined,
+        num_connections=connections,
+    )
+    clients = [TempController(settings) for _ in range(controllers)]
+    await asyncio.gather(*[client.connect() for client in clients])
+
+    recorder = LatencyRecorder()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            drive(client, commands, recorder, start + duration, period)
+            for client in clients
+        ]
+    )
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*[client.close() for client in clients])
+    await simulation.stop()
+
+    total = sum(len(latencies) for latencies in recorder.latencies.values())
+    ticks = percentiles(simulation.tick_costs)
+    ticks["mean_us"] = float(np.mean(simulation.tick_costs) / 1e3)
+    return {
+        "benchmark": "load",
+        "version": __version__,
+        "config": {
+            "controllers": controllers,
+            "channels": channels,
+            "connections": connections,
+            "pipelined": pipelined,
+            "duration": duration,
+            "period": period,
+        },
+        "commands_per_s": total / elapsed,
+        "commands": {
+            command: percentiles(latencies)
+            for command, latencies in recorder.latencies.items()
+        },
+        "ticks": ticks,
+    }
+
+
+def main(args=None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--controllers", type=int, default=1)
+    parser.add_argument("--channels", type=int, default=16)
+    parser.add_argument("--connections", type=int, default=1)
+    parser.add_argument("--lockstep", action="store_true", help="Don't pipeline")
+    parser.add_argument("--commands", nargs="+", default=DEFAULT_COMMANDS)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--period", type=float, default=0.0, help="Sleep per cycle")
+    parser.add_argument("-o", "--output", help="Write JSON here instead of stdout")
+    parsed = parser.parse_args(args)
+
+    result = asyncio.run(
+        bench_load(
+            parsed.controllers,
+            parsed.channels,
+            parsed.connections,
+            not parsed.lockstep,
+            parsed.commands,
+            parsed.duration,
+            parsed.period,
+        )
+    )
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
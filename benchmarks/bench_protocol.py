@@ -0,0 +1,115 @@
+"""Compare the command rate of the ASCII and binary protocols of the simulator.
+
+Run with e.g.::
+
+    $ python benchmarks/bench_protocol.py --clients 4 --channels 64 --depth 32
+
+Each client keeps ``depth`` pipelined per-channel queries and one column query in
+flight, over a `PipelinedIPConnection` to the ASCII port or a `BinaryIPConnection`
+to the binary port. Replies are decoded to values as the ``TempController`` handlers
+would, and results are printed as JSON.
+"""
+import asyncio
+import json
+import sys
+import time
+from argparse import ArgumentParser
+
+from fastcs.connections import IPConnectionSettings
+
+from demo_fast_cs.connections import BinaryIPConnection, PipelinedIPConnection
+from demo_fast_cs.protocol import AsciiProtocol, BinaryProtocol
+from demo_fast_cs.simulation.device import TempController
+from demo_fast_cs.simulation.runner import LocalSimulation
+
+
+async def client_load(
+    binary: bool, port: int, channels: int, depth: int, deadline: float
+) -> int:
+    conn = BinaryIPConnection() if binary else PipelinedIPConnection()
+    protocol = BinaryProtocol() if binary else AsciiProtocol()
+    await conn.connect(IPConnectionSettings("127.0.0.1", port))
+    messages = [protocol.query("T", index % channels + 1) for index in range(depth)]
+
+    sent = 0
+    while time.perf_counter() < deadline:
+        column, *responses = await asyncio.gather(
+            conn.send_query(protocol.column_query("T")),
+            *[conn.send_query(message) for message in messages],
+        )
+        [float(value) for value in protocol.parse_column(column)]
+        [float(response) for response in responses]
+        sent += depth + 1
+
+    await conn.close()
+    return sent
+
+
+async def bench_protocol(
+    binary: bool, clients: int, channels: int, depth: int, duration: float
+) -> dict:
+    assert binary or channels <= 99, "ASCII commands only support indices 01 to 99"
+    simulation = LocalSimulation(
+        TempController(
+            name="tempcont",
+            inputs={},
+            num_ramp_controllers=channels,
+            port=0,
+            binary_port=0,
+        )
+    )
+    await simulation.start()
+    port = simulation.binary_port if binary else simulation.port
+
+    start = time.perf_counter()
+    sent = await asyncio.gather(
+        *[
+            client_load(binary, port, channels, depth, start + duration)
+            for _ in range(clients)
+        ]
+    )
+    elapsed = time.perf_counter() - start
+
+    await simulation.stop()
+    return {
+        "protocol": "binary" if binary else "ascii",
+        "clients": clients,
+        "channels": channels,
+        "depth": depth,
+        "commands": sum(sent),
+        "commands_per_s": sum(sent) / elapsed,
+    }
+
+
+def main(args=None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=64)
+    parser.add_argument("--depth", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("-o", "--output", help="Write JSON here instead of stdout")
+    parsed = parser.parse_args(args)
+
+    results = [
+        asyncio.run(
+            bench_protocol(
+                binary,
+                parsed.clients,
+                parsed.channels,
+                parsed.depth,
+                parsed.duration,
+            )
+        )
+        for binary in (False, True)
+    ]
+    result = {"benchmark": "protocol", "results": results}
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
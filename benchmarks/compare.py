@@ -0,0 +1,46 @@
+"""Compare the JSON results of two benchmark runs, e.g. from different commits.
+
+Run with e.g.::
+
+    $ python benchmarks/compare.py before.json after.json
+
+Every numeric value found in both files is printed with its relative change.
+"""
+import json
+from argparse import ArgumentParser
+from typing import Any, Iterator
+
+
+def flatten(result: Any, prefix: str = "") -> Iterator[tuple[str, float]]:
+    if isinstance(result, dict):
+        for key, value in result.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(result, list):
+        for index, value in enumerate(result):
+            yield from flatten(value, f"{prefix}[{index}]")
+    elif isinstance(result, (int, float)) and not isinstance(result, bool):
+        yield prefix, float(result)
+
+
+def main(args=None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parsed = parser.parse_args(args)
+
+    with open(parsed.before) as f:
+        before = dict(flatten(json.load(f)))
+    with open(parsed.after) as f:
+        after = dict(flatten(json.load(f)))
+
+    width = max(len(key) for key in before)
+    for key, old in before.items():
+        if key not in after:
+            continue
+        new = after[key]
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        print(f"{key:<{width}}  {old:>14.3f}  {new:>14.3f}  {change:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,289 @@
-from argparse import ArgumentParser
+import asyncio
+from argparse import ArgumentParser, Namespace
 
 from . import __version__
 
 __all__ = ["main"]
 
+# The controller, simulation and fastcs backends are only imported by the commands
+# that use them, so that e.g. starting the simulator does not import EPICS
+
 
 def main(args=None):
     parser = ArgumentParser()
     parser.add_argument("-v", "--version", action="version", version=__version__)
-    args = parser.parse_args(args)
+    parser.add_argument(
+        "--uvloop", action="store_true", help="Run the event loop with uvloop"
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    for name, help in [
+        ("ioc", "Run the controller as an EPICS IOC"),
+        ("asyncio", "Run the controller in an interactive asyncio session"),
+        ("gui", "Create the controller's GUI"),
+    ]:
+        add_controller_arguments(subparsers.add_parser(name, help=help))
+
+    sim = subparsers.add_parser("sim", help="Run a simulated temperature controller")
+    add_simulation_arguments(sim)
+    replay = subparsers.add_parser(
+        "replay", help="Replay a capture of a controller's requests to a simulator"
+    )
+    add_replay_arguments(replay)
+    # The farm parses its own arguments, including --help
+    subparsers.add_parser(
+        "farm", help="Run many simulated temperature controllers", add_help=False
+    )
+
+    parsed, farm_args = parser.parse_known_args(args)
+    if farm_args and parsed.command != "farm":
+        parser.error(f"unrecognized arguments: {' '.join(farm_args)}")
+    if parsed.uvloop:
+        try:
+            import uvloop
+        except ImportError:
+            parser.error(
+                "--uvloop requires uvloop, e.g. pip install demo-fast-cs[uvloop]"
+            )
+
+        # Event loops created from now on in this process, including that of the
+        # fastcs dispatcher, are uvloop loops
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    match parsed.command:
+        case "ioc" | "asyncio" | "gui":
+            run_controller(parsed)
+        case "sim":
+            run_simulation(parsed)
+        case "replay":
+            run_replay(parsed)
+        case "farm":
+            from demo_fast_cs.simulation.farm import main as farm_main
+
+            farm_main(farm_args)
+
+
+def add_controller_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument(
+        "--poll-period", type=float, help="Fastest period to poll attributes at in s"
+    )
+    parser.add_argument(
+        "--connections", type=int, default=1, help="Size of the connection pool"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=1.0, help="Seconds to wait for each reply"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=2, help="Times to retry failed queries"
+    )
+    parser.add_argument(
+        "--no-pipelining",
+        dest="pipelined",
+        action="store_false",
+        help="Wait for each reply before sending the next request",
+    )
+    parser.add_argument(
+        "--binary", action="store_true", help="Use the simulator's binary protocol"
+    )
+    parser.add_argument(
+        "--push", action="store_true", help="Subscribe to pushed temperatures"
+    )
+    parser.add_argument(
+        "--diagnostics", action="store_true", help="Record latencies and errors"
+    )
+    parser.add_argument(
+        "--devices",
+        metavar="PATH",
+        help="Serve every device in a YAML or JSON list, taking other options as "
+        "their defaults",
+    )
+    parser.add_argument(
+        "--capture", metavar="PATH", help="Append every request and reply to a file"
+    )
+    parser.add_argument(
+        "--history-samples",
+        type=int,
+        default=0,
+        help="Samples of each ramp temperature to keep for trends",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Processes to poll ramp attributes from, or 0 for none. Not supported "
+        "with --capture",
+    )
+
+
+def add_simulation_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument("--binary-port", type=int, help="Also serve binary requests")
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument(
+        "--tick-period", type=float, default=0.1, help="0 to only tick on events"
+    )
+    parser.add_argument(
+        "--jump-to-events",
+        action="store_true",
+        help="Jump simulation time to each update rather than waiting for it",
+    )
+    parser.add_argument(
+        "--diagnostics", action="store_true", help="Record command latencies"
+    )
+    parser.add_argument(
+        "--fault-delay", type=float, default=0.0, help="Seconds to stall each request"
+    )
+    parser.add_argument(
+        "--fault-drop-rate", type=float, default=0.0, help="Fraction of replies to drop"
+    )
+    parser.add_argument(
+        "--max-clients", type=int, help="Most clients to accept on each port at once"
+    )
+
+
+def controller_settings(parsed: Namespace):
+    from fastcs.connections import IPConnectionSettings
+
+    from demo_fast_cs.controllers import TempControllerSettings
+
+    return TempControllerSettings(
+        parsed.channels,
+        IPConnectionSettings(parsed.host, parsed.port),
+        pipelined=parsed.pipelined,
+        num_connections=parsed.connections,
+        diagnostics=parsed.diagnostics,
+        binary=parsed.binary,
+        push=parsed.push,
+        timeout=parsed.timeout,
+        retries=parsed.retries,
+        capture=parsed.capture,
+        history_samples=parsed.history_samples,
+        workers=parsed.workers,
+    )
+
+
+def run_controller(parsed: Namespace) -> None:
+    from fastcs.backends import AsyncioBackend, EpicsBackend
+
+    from demo_fast_cs.controllers import set_poll_period
+    from demo_fast_cs.demo import create_gui
+    from demo_fast_cs.mapping import get_mapping
+
+    settings = controller_settings(parsed)
+    if parsed.devices is not None:
+        from demo_fast_cs.group import load_devices
+
+        settings = load_devices(parsed.devices, settings)
+    if parsed.poll_period is not None:
+        set_poll_period(parsed.poll_period)
+
+    match parsed.command:
+        case "ioc":
+            create_gui(settings=settings)
+            EpicsBackend(get_mapping(settings)).get_ioc().run()
+        case "asyncio":
+            AsyncioBackend(get_mapping(settings)).run_interactive_session()
+        case "gui":
+            create_gui(settings=settings)
+
+
+def simulation_config(parsed: Namespace):
+    from demo_fast_cs.simulation.device import TempController
+
+    return TempController(
+        name="tempcont",
+        inputs={},
+        num_ramp_controllers=parsed.channels,
+        host=parsed.host,
+        port=parsed.port,
+        diagnostics=parsed.diagnostics,
+        binary_port=parsed.binary_port,
+        time_scale=parsed.time_scale,
+        tick_period=parsed.tick_period or None,
+        jump_to_events=parsed.jump_to_events,
+        fault_delay=parsed.fault_delay,
+        fault_drop_rate=parsed.fault_drop_rate,
+        max_clients=parsed.max_clients,
+    )
+
+
+def run_simulation(parsed: Namespace) -> None:
+    from demo_fast_cs.simulation.runner import LocalSimulation
+
+    simulation = LocalSimulation(simulation_config(parsed))
+    try:
+        asyncio.run(simulation.run_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def add_replay_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument("path", help="The capture to replay")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Times faster than captured to send requests, or 0 for flat out",
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument(
+        "--port", type=int, help="A running simulator, rather than starting one"
+    )
+    parser.add_argument("--binary-port", type=int)
+    parser.add_argument(
+        "--channels", type=int, default=4, help="Channels of the simulator to start"
+    )
+
+
+def run_replay(parsed: Namespace) -> None:
+    import json
+    import sys
+
+    from fastcs.connections import IPConnectionSettings
+
+    from demo_fast_cs.capture import CaptureReader, Replay
+    from demo_fast_cs.simulation.device import TempController
+    from demo_fast_cs.simulation.runner import LocalSimulation
+
+    async def replay() -> dict:
+        simulation = None
+        host, port, binary_port = parsed.host, parsed.port, parsed.binary_port
+        if port is None:
+            simulation = LocalSimulation(
+                TempController(
+                    name="tempcont",
+                    inputs={},
+                    num_ramp_controllers=parsed.channels,
+                    host=host,
+                    port=0,
+                    binary_port=0,
+                )
+            )
+            await simulation.start()
+            port, binary_port = simulation.port, simulation.binary_port
+
+        try:
+            with CaptureReader(parsed.path) as reader:
+                return await Replay(
+                    IPConnectionSettings(host, port),
+                    (
+                        None
+                        if binary_port is None
+                        else IPConnectionSettings(host, binary_port)
+                    ),
+                    speed=parsed.speed,
+                ).run(reader)
+        finally:
+            if simulation is not None:
+                await simulation.stop()
+
+    json.dump(asyncio.run(replay()), sys.stdout, indent=2)
+    print()
 
 
 # test with: python -m demo_fast_cs
@@ -0,0 +1,416 @@
+"""Capture of the requests a `TempController` sends, and replay of them to a device.
+
+A capture is an append-only binary log, starting with a `HEADER` of `MAGIC` and the
+time the capture was started in ns since the epoch. It is followed by a `RECORD` for
+each request of:
+
+- its `Kind`, whether the request is a binary frame and the `Encoding` of its response
+- when it was sent in ns since the start of the capture, and how long it took in ns
+- the sizes of the request and encoded response, which follow the record
+
+Records are written as requests complete, so they are ordered by completion rather
+than by when they were sent. A record truncated by e.g. a crash ends the capture.
+
+Replay with e.g.::
+
+    $ python -m demo_fast_cs replay capture.bin --speed 10
+"""
+
+from __future__ import annotations
+
+import asyncio
+import mmap
+import os
+import struct
+from collections import Counter, deque
+from enum import IntEnum
+from time import perf_counter_ns, time_ns
+from types import TracebackType
+from typing import Any, BinaryIO, Iterable, Iterator, NamedTuple, Optional, Union
+
+from fastcs.connections import IPConnectionSettings
+
+from demo_fast_cs.connections import (
+    BinaryIPConnection,
+    IPConnectionPool,
+    PipelinedIPConnection,
+    PooledConnection,
+)
+from demo_fast_cs.diagnostics import LatencyHistogram
+from demo_fast_cs.protocol import Opcode, Response
+
+#: Magic number, capture start time in ns since the epoch
+HEADER = struct.Struct("<8sq")
+MAGIC = b"DFCSCAP1"
+
+#: Kind, binary request, response encoding, sent at, latency, request and response size
+RECORD = struct.Struct("<BBBxqqII")
+
+VALUE = struct.Struct("<d")
+
+
+class Kind(IntEnum):
+    COMMAND = 1
+    QUERY = 2
+
+
+class Encoding(IntEnum):
+    #: A command with no reply
+    NONE = 0
+    #: An ASCII reply
+    TEXT = 1
+    #: A binary reply value, as a float64
+    VALUE = 2
+    #: A binary column reply, as its memoryview format followed by its bytes
+    COLUMN = 3
+    #: The request failed, and the error is stored as text
+    ERROR = 4
+
+
+class Record(NamedTuple):
+    kind: Kind
+    #: ns since the start of the capture
+    sent_at: int
+    latency: int
+    request: Union[str, bytes]
+    response: Optional[Response]
+    #: Set instead of the response if the request failed
+    error: Optional[str] = None
+
+
+Connection = Union[IPConnectionPool, PooledConnection]
+
+
+def encode_response(
+    response: Optional[Response | BaseException],
+) -> tuple[Encoding, bytes]:
+    if response is None:
+        return Encoding.NONE, b""
+    if isinstance(response, BaseException):
+        return Encoding.ERROR, f"{type(response).__name__}: {response}".encode()
+    if isinstance(response, str):
+        return Encoding.TEXT, response.encode("utf-8")
+    if isinstance(response, memoryview):
+        return Encoding.COLUMN, response.format.encode("ascii") + response.tobytes()
+    return Encoding.VALUE, VALUE.pack(response)
+
+
+def decode_response(
+    encoding: Encoding, data: bytes
+) -> tuple[Optional[Response], Optional[str]]:
+    match encoding:
+        case Encoding.NONE:
+            return None, None
+        case Encoding.TEXT:
+            return data.decode("utf-8"), None
+        case Encoding.VALUE:
+            return VALUE.unpack(data)[0], None
+        case Encoding.COLUMN:
+            column = memoryview(data[1:]).cast(chr(data[0]))  # type: ignore
+            return column, None
+        case Encoding.ERROR:
+            return None, data.decode("utf-8")
+    raise ValueError(f"Unknown response encoding {encoding}")
+
+
+class TrafficCapture:
+    """Appends the requests sent through it and their responses to a capture file.
+
+    Records are buffered in memory, up to ``buffer_size`` bytes, and only written to
+    the file when the buffer is full or the capture is closed. Capturing to an existing
+    file appends to it, keeping the start time in its header, and so does recording
+    more after the capture is closed. A record left truncated at the end of an
+    existing file, e.g. by a crash, is removed first, as it would otherwise end the
+    capture before everything appended after it.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 2**20) -> None:
+        self.path = path
+        self.buffer_size = buffer_size
+        self.start_time = time_ns()
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with CaptureReader(path) as reader:
+                self.start_time = reader.start_time
+                end = reader.end
+            os.truncate(path, end)
+        self._file = self._open()
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, self.start_time))
+        #: The number of requests recorded
+        self.records = 0
+
+    async def send_command(self, conn: Connection, message: str | bytes) -> None:
+        sent_at, start = time_ns(), perf_counter_ns()
+        try:
+            await conn.send_command(message)
+        except Exception as error:
+            self.record(Kind.COMMAND, sent_at, start, message, error)
+            raise
+        self.record(Kind.COMMAND, sent_at, start, message, None)
+
+    async def send_query(self, conn: Connection, message: str | bytes) -> Response:
+        sent_at, start = time_ns(), perf_counter_ns()
+        try:
+            response = await conn.send_query(message)
+        except Exception as error:
+            self.record(Kind.QUERY, sent_at, start, message, error)
+            raise
+        self.record(Kind.QUERY, sent_at, start, message, response)
+        return response
+
+    def record(
+        self,
+        kind: Kind,
+        sent_at: int,
+        start: int,
+        request: str | bytes,
+        response: Optional[Response | BaseException],
+    ) -> None:
+        """Append a request sent at ``sent_at`` ns since the epoch.
+
+        ``start`` is the `time.perf_counter_ns` when it was sent, and it is taken to
+        have completed now.
+        """
+        latency = perf_counter_ns() - start
+        binary = isinstance(request, bytes)
+        data = request if isinstance(request, bytes) else request.encode("utf-8")
+        encoding, payload = encode_response(response)
+        header = RECORD.pack(
+            kind,
+            binary,
+            encoding,
+            sent_at - self.start_time,
+            latency,
+            len(data),
+            len(payload),
+        )
+        if self._file.closed:
+            self._file = self._open()
+        self._file.write(header + data + payload)
+        self.records += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _open(self) -> BinaryIO:
+        return open(self.path, "ab", buffering=self.buffer_size)
+
+
+class CaptureReader:
+    """Reads the records of a capture file, memory mapped so it is paged in lazily.
+
+    Only the records being read need to be in memory, so captures larger than the
+    available memory can be scanned.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is empty, not a capture") from None
+        magic, self.start_time = (
+            HEADER.unpack_from(self._map) if len(self._map) >= HEADER.size else (b"", 0)
+        )
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a capture")
+
+    @property
+    def end(self) -> int:
+        """The offset just past the last complete record."""
+        data = self._map
+        offset, size = HEADER.size, len(data)
+        while offset + RECORD.size <= size:
+            *_, request_size, response_size = RECORD.unpack_from(data, offset)
+            next_offset = offset + RECORD.size + request_size + response_size
+            if next_offset > size:
+                break
+            offset = next_offset
+        return offset
+
+    def __iter__(self) -> Iterator[Record]:
+        data = self._map
+        offset, end = HEADER.size, len(data)
+        while offset + RECORD.size <= end:
+            kind, binary, encoding, sent_at, latency, request_size, response_size = (
+                RECORD.unpack_from(data, offset)
+            )
+            offset += RECORD.size
+            if offset + request_size + response_size > end:
+                return
+            request = data[offset : offset + request_size]
+            offset += request_size
+            response, error = decode_response(
+                Encoding(encoding), data[offset : offset + response_size]
+            )
+            offset += response_size
+            yield Record(
+                Kind(kind),
+                sent_at,
+                latency,
+                request if binary else request.decode("utf-8"),
+                response,
+                error,
+            )
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> CaptureReader:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+
+def request_name(request: str | bytes) -> str:
+    """Name a request by its command, e.g. ``T?`` for ``T01?`` and ``T*?``."""
+    if isinstance(request, bytes):
+        return Opcode(request[0]).name
+    request = request.strip()
+    column = "*" if request[1:2] == "*" else ""
+    return request[:1] + column + ("?" if request.endswith("?") else "=")
+
+
+def same_response(captured: Optional[Response], replayed: Optional[Response]) -> bool:
+    if isinstance(captured, memoryview) and isinstance(replayed, memoryview):
+        return captured.tolist() == replayed.tolist()
+    return captured == replayed
+
+
+class Replay:
+    """Sends the requests of a capture to a device, comparing it with the capture.
+
+    Requests are sent at their offsets in the capture divided by ``speed``, or as fast
+    as they can be if it is 0, with at most ``window`` queries in flight. ASCII and
+    binary requests are sent over their own pipelined connection, each opened on first
+    use. Responses which differ from those captured, or requests which fail only in
+    one of the two, are counted as divergences by `request_name`.
+    """
+
+    def __init__(
+        self,
+        ascii_settings: Optional[IPConnectionSettings],
+        binary_settings: Optional[IPConnectionSettings] = None,
+        speed: float = 1.0,
+        window: int = 1024,
+        timeout: Optional[float] = 5.0,
+    ) -> None:
+        self.speed = speed
+        self.window = window
+        self.timeout = timeout
+        self._settings = {False: ascii_settings, True: binary_settings}
+        self._connections: dict[bool, PipelinedIPConnection] = {}
+        self._pending: deque[tuple[Record, asyncio.Future[Any]]] = deque()
+        self.captured = LatencyHistogram()
+        self.replayed = LatencyHistogram()
+        self.requests = 0
+        self.divergences: Counter[str] = Counter()
+        #: The first few divergences, as the request and both responses
+        self.examples: list[dict] = []
+
+    async def run(self, records: Iterable[Record]) -> dict:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first: Optional[int] = None
+        last: Optional[int] = None
+        try:
+            for record in records:
+                if first is None:
+                    first = record.sent_at
+                last = record.sent_at
+                if self.speed:
+                    due = start + (record.sent_at - first) / 1e9 / self.speed
+                    if due > loop.time():
+                        await asyncio.sleep(due - loop.time())
+                await self._send(record)
+                while self._pending and (
+                    self._pending[0][1].done() or len(self._pending) > self.window
+                ):
+                    await self._complete()
+            while self._pending:
+                await self._complete()
+        finally:
+            for conn in self._connections.values():
+                await conn.close()
+        return self.report(loop.time() - start, first, last)
+
+    def report(
+        self, elapsed: float, first: Optional[int] = None, last: Optional[int] = None
+    ) -> dict:
+        return {
+            "requests": self.requests,
+            "captured_duration_s": (
+                (last - first) / 1e9 if first is not None and last is not None else 0.0
+            ),
+            "replayed_duration_s": elapsed,
+            "captured_latency_p50_ms": self.captured.percentile(50) * 1e3,
+            "captured_latency_p99_ms": self.captured.percentile(99) * 1e3,
+            "replayed_latency_p50_ms": self.replayed.percentile(50) * 1e3,
+            "replayed_latency_p99_ms": self.replayed.percentile(99) * 1e3,
+            "divergent": sum(self.divergences.values()),
+            "divergences": dict(self.divergences),
+            "examples": self.examples,
+        }
+
+    async def _connection(self, binary: bool) -> PipelinedIPConnection:
+        conn = self._connections.get(binary)
+        if conn is None:
+            settings = self._settings[binary]
+            protocol = "binary" if binary else "ASCII"
+            assert settings is not None, f"No port to replay {protocol} requests to"
+            factory = BinaryIPConnection if binary else PipelinedIPConnection
+            conn = factory(self.timeout)
+            await conn.connect(settings)
+            self._connections[binary] = conn
+        return conn
+
+    async def _send(self, record: Record) -> None:
+        binary = isinstance(record.request, bytes)
+        conn = await self._connection(binary)
+        self.requests += 1
+        if record.kind == Kind.COMMAND and not binary:
+            # ASCII commands are not replied to
+            await conn.send_command(record.request)
+            return
+
+        sent = perf_counter_ns()
+        response = await conn.submit_query(record.request)
+        response.add_done_callback(
+            lambda _: self.replayed.record(perf_counter_ns() - sent)
+        )
+        self._pending.append((record, response))
+
+    async def _complete(self) -> None:
+        record, future = self._pending.popleft()
+        error: Optional[str] = None
+        response: Optional[Response] = None
+        try:
+            response = await future
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if record.kind == Kind.COMMAND:
+            # Binary commands are replied to by the device, but not captured
+            response = None
+
+        self.captured.record(record.latency)
+        if (error is None) != (record.error is None) or not same_response(
+            record.response, response
+        ):
+            self.divergences[request_name(record.request)] += 1
+            if len(self.examples) < 10:
+                self.examples.append(
+                    {
+                        "request": repr(record.request),
+                        "captured": repr(record.error or record.response),
+                        "replayed": repr(error or response),
+                    }
+                )
@@ -0,0 +1,486 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import struct
+from collections import deque
+from contextlib import suppress
+from typing import Awaitable, Callable, TypeVar, Union
+
+from fastcs.connections import DisconnectedError, IPConnection, IPConnectionSettings
+
+from demo_fast_cs.protocol import (
+    COLUMN_FORMATS,
+    FRAME,
+    REJECTED,
+    BinaryProtocolError,
+    Opcode,
+    Response,
+    Status,
+)
+
+
+class RejectedRequestError(DisconnectedError):
+    """The device rejected a request, so later replies can not be matched to queries."""
+
+
+class PipelinedIPConnection:
+    """An IP connection which allows many queries to be in flight at once.
+
+    Requests are written without waiting for the replies to earlier queries, and all
+    requests sent in the same iteration of the event loop are coalesced into a single
+    write, e.g. the puts of a `asyncio.gather`. Replies are read by a background task
+    and matched to queries in FIFO order, which relies on the device answering
+    requests in the order it receives them and only replying to queries.
+
+    The device also replies to commands it rejects, e.g. ``S01=-5``, and there is no
+    telling whether such a reply is to a command or to a query. So once one arrives,
+    every pending query fails with `RejectedRequestError` and the connection is
+    closed, rather than matching every later reply to the wrong query. Requests should
+    be validated before they are sent to avoid that.
+
+    Lines containing ``=`` are not replies but notifications pushed by the device, e.g.
+    ``T01=1.5``, and are passed to ``on_notification`` instead.
+
+    If a ``timeout`` is given, a watchdog fails every pending query with
+    `asyncio.TimeoutError` and closes the connection once the oldest has waited
+    longer than that, as later replies could no longer be matched to their queries.
+    Replies arrive in order, so only the oldest query needs to be watched, rather
+    than setting a timer for each one.
+    """
+
+    def __init__(self, timeout=None):
+        self._reader, self._writer = (None, None)
+        self._drain_lock = asyncio.Lock()
+        self._write_buffer: list[bytes] = []
+        # Futures for the responses to queries, and the times they were sent
+        self._responses: deque[asyncio.Future[str]] = deque()
+        self._sent_at: deque[float] = deque()
+        self._receiver: asyncio.Task | None = None
+        self._watchdog: asyncio.Task | None = None
+        self.timeout: float | None = timeout
+        self.on_notification: Callable[[str], Awaitable[None]] | None = None
+
+    async def connect(self, settings: IPConnectionSettings):
+        self._reader, self._writer = await asyncio.open_connection(
+            settings.ip, settings.port
+        )
+        self._receiver = asyncio.create_task(self._receive_responses())
+        if self.timeout is not None:
+            self._watchdog = asyncio.create_task(self._watch(self.timeout))
+
+    def ensure_connected(self):
+        if self._reader is None or self._writer is None:
+            raise DisconnectedError(
+                "Need to call connect() before using PipelinedIPConnection."
+            )
+        if self._receiver is not None and self._receiver.done():
+            raise DisconnectedError("Connection closed")
+
+    @property
+    def in_flight(self) -> int:
+        """The number of queries waiting for a response."""
+        return len(self._responses)
+
+    @property
+    def connected(self) -> bool:
+        """Whether the connection is open and has not been closed by the device."""
+        return self._receiver is not None and not self._receiver.done()
+
+    async def send_command(self, message) -> None:
+        self.ensure_connected()
+        self._write(self._encode(message))
+        await self._drain()
+
+    async def send_query(self, message) -> str:
+        response = await self.submit_query(message)
+        return await response
+
+    async def submit_query(self, message) -> asyncio.Future[str]:
+        """Write a query and return a future for its response without waiting for it.
+
+        Args:
+            message: The query to send.
+
+        Returns:
+            asyncio.Future[str]: Resolved with the response once it is received.
+        """
+        self.ensure_connected()
+        loop = asyncio.get_running_loop()
+        response = loop.create_future()
+        self._responses.append(response)
+        self._sent_at.append(loop.time())
+        self._write(self._encode(message))
+        try:
+            await self._drain()
+        except BaseException:
+            # Keep the future queued so later replies still line up with their queries
+            response.cancel()
+            raise
+        return response
+
+    async def close(self):
+        if self._reader is None or self._writer is None:
+            raise DisconnectedError("PipelinedIPConnection is not connected")
+        self._flush()
+        for task in (self._receiver, self._watchdog):
+            if task is not None:
+                task.cancel()
+        self._receiver, self._watchdog = None, None
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._reader, self._writer = (None, None)
+        self._fail_pending(DisconnectedError("Connection closed"))
+
+    def _write(self, data: bytes) -> None:
+        # Buffered until the next iteration of the event loop. Flow control still
+        # applies, as the buffer is flushed before the next request is drained.
+        if not self._write_buffer:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._write_buffer.append(data)
+
+    def _flush(self) -> None:
+        if self._write_buffer and self._writer is not None:
+            self._writer.write(b"".join(self._write_buffer))
+        self._write_buffer.clear()
+
+    async def _drain(self) -> None:
+        # Concurrent calls to drain() are not supported by all python versions
+        async with self._drain_lock:
+            await self._writer.drain()
+
+    def _encode(self, message) -> bytes:
+        return message.encode("utf-8")
+
+    async def _read_response(self):
+        """Read the next response, or raise EOFError if the device has hung up."""
+        while True:
+            data = await self._reader.readline()
+            if not data:
+                raise EOFError
+            message = data.decode("utf-8")
+            if message.startswith(REJECTED):
+                raise RejectedRequestError(f"Device rejected a request: {message!r}")
+            if "=" not in message:
+                return message
+            if self.on_notification is not None:
+                await self.on_notification(message)
+
+    async def _receive_responses(self) -> None:
+        while True:
+            try:
+                result = await self._read_response()
+            except EOFError:
+                break
+            except RejectedRequestError as error:
+                self._fail_pending(error)
+                if self._watchdog is not None:
+                    self._watchdog.cancel()
+                self._writer.close()
+                return
+            if not self._responses:
+                continue
+            response = self._responses.popleft()
+            self._sent_at.popleft()
+            if response.done():
+                # The query was cancelled before its reply arrived
+                continue
+            if isinstance(result, Exception):
+                response.set_exception(result)
+            else:
+                response.set_result(result)
+
+        self._fail_pending(DisconnectedError("Connection closed by device"))
+
+    async def _watch(self, timeout: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(timeout / 4)
+            if self._sent_at and loop.time() - self._sent_at[0] > timeout:
+                self._fail_pending(asyncio.TimeoutError("No reply from device"))
+                if self._receiver is not None:
+                    self._receiver.cancel()
+                self._writer.close()
+                return
+
+    def _fail_pending(self, error: Exception) -> None:
+        self._sent_at.clear()
+        while self._responses:
+            response = self._responses.popleft()
+            if not response.done():
+                response.set_exception(error)
+
+
+class BinaryIPConnection(PipelinedIPConnection):
+    """A pipelined connection to the simulator's binary protocol port.
+
+    Messages are `demo_fast_cs.protocol.FRAME` s, e.g. from `BinaryProtocol`, and
+    replies are decoded straight from the received bytes: values as floats and column
+    payloads as memoryviews cast to their `COLUMN_FORMATS`. Every frame is answered, so
+    commands wait for their reply and raise `BinaryProtocolError` if they fail.
+    """
+
+    async def send_command(self, message) -> None:
+        await self.send_query(message)
+
+    async def send_batch(self, messages: list[bytes]) -> list[Response]:
+        """Send many frames in one write and return their responses in order."""
+        self.ensure_connected()
+        loop = asyncio.get_running_loop()
+        responses = [loop.create_future() for _ in messages]
+        self._responses.extend(responses)
+        self._sent_at.extend([loop.time()] * len(messages))
+        self._write(b"".join(messages))
+        try:
+            await self._drain()
+        except BaseException:
+            for response in responses:
+                response.cancel()
+            raise
+        return list(await asyncio.gather(*responses))
+
+    def _encode(self, message) -> bytes:
+        return message
+
+    async def _read_response(self):
+        header = await self._reader.readexactly(FRAME.size)
+        opcode, status, channel, value = FRAME.unpack(header)
+        if status != Status.OK:
+            return BinaryProtocolError(
+                f"Request {Opcode(opcode).name} for channel {channel} failed"
+            )
+
+        column_format = COLUMN_FORMATS.get(opcode)
+        if column_format is None:
+            return value
+        size = int(value) * struct.calcsize(column_format)
+        payload = await self._reader.readexactly(size)
+        return memoryview(payload).cast(column_format)
+
+
+Connection = Union[IPConnection, PipelinedIPConnection]
+
+T = TypeVar("T")
+
+#: Errors which indicate that a connection needs to be re-established
+CONNECTION_ERRORS = (OSError, EOFError, DisconnectedError)
+
+
+async def with_deadline(awaitable: Awaitable[T], timeout: float | None) -> T:
+    """Await ``awaitable``, raising `asyncio.TimeoutError` if it takes over ``timeout``.
+
+    Equivalent to `asyncio.wait_for` in the current task, which saves creating a task
+    for every request.
+    """
+    if timeout is None:
+        return await awaitable
+
+    task = asyncio.current_task()
+    assert task is not None, "with_deadline must be awaited in a task"
+    expired = False
+
+    def expire() -> None:
+        nonlocal expired
+        expired = True
+        task.cancel()
+
+    handle = asyncio.get_running_loop().call_later(timeout, expire)
+    try:
+        return await awaitable
+    except asyncio.CancelledError:
+        if not expired:
+            raise
+        if hasattr(task, "uncancel"):
+            task.uncancel()
+        raise asyncio.TimeoutError from None
+    finally:
+        handle.cancel()
+
+
+class PooledConnection:
+    """A member of an `IPConnectionPool` which re-establishes itself when it fails.
+
+    Any failure of the underlying connection is raised as a `DisconnectedError`.
+    Requests sent while the member is reconnecting fail immediately rather than
+    waiting, so that a broken member does not hold up its callers.
+
+    Queries which get no reply within ``timeout`` raise `asyncio.TimeoutError`, and
+    the member reconnects, as later replies could no longer be matched to their
+    queries. Failed queries are retried up to ``retries`` times, after a backoff that
+    doubles each attempt from ``retry_backoff`` with up to 50% random jitter, so the
+    longest a query can take is bounded.
+    """
+
+    def __init__(
+        self,
+        connection_factory: Callable[[], Connection],
+        reconnect_period: float = 1.0,
+        timeout: float | None = None,
+        retries: int = 0,
+        retry_backoff: float = 0.05,
+    ):
+        self._connection_factory = connection_factory
+        self._reconnect_period = reconnect_period
+        self._timeout = timeout
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._conn = self._new_connection()
+        self._settings: IPConnectionSettings | None = None
+        self._reconnecting: asyncio.Task | None = None
+        self.healthy = False
+
+    @property
+    def in_flight(self) -> int:
+        return getattr(self._conn, "in_flight", 0)
+
+    async def connect(self, settings: IPConnectionSettings):
+        self._settings = settings
+        await self._conn.connect(settings)
+        self.healthy = True
+
+    async def send_command(self, message) -> None:
+        self._ensure_healthy()
+        try:
+            await self._conn.send_command(message)
+        except CONNECTION_ERRORS as e:
+            self.mark_failed()
+            raise DisconnectedError(f"Pooled connection failed: {e}") from e
+
+    async def send_query(self, message) -> Response:
+        # Pipelined connections time out their own queries
+        pipelined = isinstance(self._conn, PipelinedIPConnection)
+        timeout = None if pipelined else self._timeout
+        for attempt in range(self._retries):
+            try:
+                return await self._query(message, timeout)
+            except (DisconnectedError, asyncio.TimeoutError):
+                backoff = self._retry_backoff * 2**attempt
+                await asyncio.sleep(backoff * random.uniform(1.0, 1.5))
+        return await self._query(message, timeout)
+
+    async def _query(self, message, timeout: float | None) -> Response:
+        self._ensure_healthy()
+        try:
+            response = await with_deadline(self._conn.send_query(message), timeout)
+        except asyncio.TimeoutError:
+            self.mark_failed()
+            raise
+        except CONNECTION_ERRORS as e:
+            self.mark_failed()
+            raise DisconnectedError(f"Pooled connection failed: {e}") from e
+        if response == "":
+            # IPConnection returns an empty string once the device has hung up
+            self.mark_failed()
+            raise DisconnectedError("Connection closed by device")
+        return response
+
+    async def check_health(self, query: str | bytes, timeout: float) -> bool:
+        """Send ``query`` and start reconnecting if no reply arrives in ``timeout``."""
+        if self.healthy:
+            with suppress(DisconnectedError, asyncio.TimeoutError):
+                await self._query(query, timeout)
+        return self.healthy
+
+    def mark_failed(self) -> None:
+        """Mark the connection as unhealthy and reconnect it in the background."""
+        self.healthy = False
+        if self._reconnecting is None and self._settings is not None:
+            self._reconnecting = asyncio.create_task(self._reconnect(self._settings))
+
+    async def close(self):
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+            self._reconnecting = None
+        if self.healthy:
+            self.healthy = False
+            await self._conn.close()
+
+    def _new_connection(self) -> Connection:
+        conn = self._connection_factory()
+        if isinstance(conn, PipelinedIPConnection):
+            conn.timeout = self._timeout
+        return conn
+
+    def _ensure_healthy(self) -> None:
+        if not self.healthy:
+            raise DisconnectedError("Pooled connection is reconnecting")
+
+    async def _reconnect(self, settings: IPConnectionSettings) -> None:
+        with suppress(*CONNECTION_ERRORS):
+            await self._conn.close()
+
+        while True:
+            self._conn = self._new_connection()
+            try:
+                await self._conn.connect(settings)
+            except OSError:
+                await asyncio.sleep(self._reconnect_period)
+            else:
+                break
+
+        self.healthy = True
+        self._reconnecting = None
+
+
+class IPConnectionPool:
+    """A fixed size pool of connections to the same device.
+
+    Callers that need a stable connection, e.g. one per channel, can be sharded
+    across the members with `shard`. Requests sent to the pool itself go to the next
+    healthy member in turn. ``timeout`` and ``retries`` apply to the queries of every
+    member, as in `PooledConnection`.
+    """
+
+    def __init__(
+        self,
+        num_connections: int,
+        connection_factory: Callable[[], Connection] = PipelinedIPConnection,
+        timeout: float | None = None,
+        retries: int = 0,
+    ):
+        assert num_connections > 0, "Connection pool needs at least one connection"
+        self.members = [
+            PooledConnection(connection_factory, timeout=timeout, retries=retries)
+            for _ in range(num_connections)
+        ]
+        self._next = 0
+
+    @property
+    def in_flight(self) -> int:
+        return sum(member.in_flight for member in self.members)
+
+    def shard(self, key: int) -> PooledConnection:
+        return self.members[key % len(self.members)]
+
+    async def connect(self, settings: IPConnectionSettings):
+        await asyncio.gather(*[member.connect(settings) for member in self.members])
+
+    async def send_command(self, message) -> None:
+        await self._next_member().send_command(message)
+
+    async def send_query(self, message) -> Response:
+        return await self._next_member().send_query(message)
+
+    async def check_health(self, query: str | bytes, timeout: float) -> list[bool]:
+        """Check every member, reconnecting any that do not reply in ``timeout``."""
+        return await asyncio.gather(
+            *[member.check_health(query, timeout) for member in self.members]
+        )
+
+    def reconnect(self) -> None:
+        """Start reconnecting every member which is not connected, in the background."""
+        for member in self.members:
+            if not member.healthy:
+                member.mark_failed()
+
+    async def close(self):
+        await asyncio.gather(*[member.close() for member in self.members])
+
+    def _next_member(self) -> PooledConnection:
+        for _ in range(len(self.members)):
+            member = self.members[self._next]
+            self._next = (self._next + 1) % len(self.members)
+            if member.healthy:
+                return member
+
+        raise DisconnectedError("No healthy connections in pool")
@@ -1,87 +1,799 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Any
+import asyncio
+import logging
+from contextlib import suppress
+from copy import copy
+from dataclasses import dataclass, field
+from functools import cache
+from typing import TYPE_CHECKING, Any, Callable, ClassVar, Sequence
 
-from fastcs.attributes import AttrR, AttrRW, AttrW
+from fastcs.attributes import Attribute, AttrR, AttrRW, AttrW
 from fastcs.connections import IPConnection, IPConnectionSettings
 from fastcs.controller import Controller, SubController
-from fastcs.datatypes import Bool, Float, Int
-from fastcs.wrappers import command
+from fastcs.datatypes import Bool, DataType, Float, Int, String
+from fastcs.wrappers import command, scan
+
+from demo_fast_cs.capture import Connection, TrafficCapture
+from demo_fast_cs.connections import (
+    CONNECTION_ERRORS,
+    BinaryIPConnection,
+    IPConnectionPool,
+    PipelinedIPConnection,
+    PooledConnection,
+)
+from demo_fast_cs.diagnostics import Diagnostics
+from demo_fast_cs.protocol import (
+    PRECISION,
+    RECIPE,
+    AsciiProtocol,
+    BinaryProtocol,
+    Response,
+)
+from demo_fast_cs.scheduling import CircuitBreaker, PollSchedule
+
+if TYPE_CHECKING:
+    from demo_fast_cs.workers import ColumnPoller
+
+#: Errors which count as a failed request to the device
+REQUEST_ERRORS = CONNECTION_ERRORS + (asyncio.TimeoutError,)
+
+
+#: Converts a response to the value of an attribute, raising ValueError if invalid
+Decoder = Callable[[Response], Any]
+
+_BOOLS: dict[Any, bool] = {"0": False, "1": True, 0: False, 1: True}
+
+
+def decode_bool(response: Response) -> bool:
+    key = response.strip() if isinstance(response, str) else response
+    try:
+        return _BOOLS[key]
+    except (KeyError, TypeError):
+        raise ValueError(f"Invalid bool response {response!r}") from None
+
+
+def decode_int(response: Response) -> int:
+    # Binary replies carry every value as a float
+    if isinstance(response, float) and not response.is_integer():
+        raise ValueError(f"Invalid int response {response!r}")
+    return int(response)
+
+
+def decode_float(response: Response) -> float:
+    return float(response)
+
+
+def decode_string(response: Response) -> str:
+    if not isinstance(response, str):
+        raise ValueError(f"Invalid string response {response!r}")
+    return response.strip()
+
+
+def decoder(datatype: DataType) -> Decoder:
+    """Return the decoder for responses to attributes of ``datatype``."""
+    match datatype:
+        case Bool():
+            return decode_bool
+        case Int():
+            return decode_int
+        case Float():
+            return decode_float
+        case String():
+            return decode_string
+        case _:
+            raise ValueError(f"No decoder for {datatype}")
 
 
 @dataclass
 class TempControllerSettings:
     num_ramp_controllers: int
     ip_settings: IPConnectionSettings
+    #: Prefix of the PVs of the controller and its ramps, to tell apart the devices
+    #: of a `demo_fast_cs.group.TempControllerGroup`
+    name: str = ""
+    pipelined: bool = True
+    num_connections: int = 1
+    diagnostics: bool = False
+    #: Whether ip_settings are for the simulator's binary protocol port. Recipes can
+    #: only be loaded over the ASCII protocol.
+    binary: bool = False
+    #: Whether ramp temperatures are pushed by the device rather than polled. Only
+    #: supported by the ASCII protocol.
+    push: bool = False
+    #: Seconds to wait for each reply, and how many times to retry failed queries
+    timeout: float | None = 1.0
+    retries: int = 2
+    #: Consecutive failed requests after which the controller is degraded, and how
+    #: long in seconds to only poll essential attributes for when it is
+    failure_threshold: int = 5
+    recovery_period: float = 5.0
+    #: A file to append a capture of every request and response to, for replay
+    capture: str | None = None
+    #: Samples of every ramp temperature to keep, or 0 to not record any. Ramp
+    #: controllers publish the last ``history_length`` of them, and the min, max and
+    #: mean of ``history_bins`` bins of all of them. Both are published as strings of
+    #: at most 255 characters, which limits them to `history.MAX_SAMPLES` and
+    #: `history.MAX_BINS`.
+    history_samples: int = 0
+    history_length: int = 25
+    history_bins: int = 8
+    #: Processes to poll the columns of ramp attributes from, each with its own
+    #: connections, or 0 to poll them from the event loop. Their requests are not
+    #: captured, so they can not be used with a capture.
+    workers: int = 0
+
+    def __post_init__(self) -> None:
+        if self.workers and self.capture:
+            raise ValueError("A capture can not be taken of the requests of workers")
+        if self.history_samples:
+            from demo_fast_cs.history import MAX_BINS, MAX_SAMPLES
+
+            if not 0 < self.history_length <= MAX_SAMPLES:
+                raise ValueError(
+                    f"history_length must be from 1 to {MAX_SAMPLES} to fit in a "
+                    f"String attribute, not {self.history_length}"
+                )
+            if not 0 < self.history_bins <= MAX_BINS:
+                raise ValueError(
+                    f"history_bins must be from 1 to {MAX_BINS} to fit in a String "
+                    f"attribute, not {self.history_bins}"
+                )
+
+
+async def send_command(
+    controller: TempController | TempRampController,
+    message: str | bytes,
+    conn: Connection | None = None,
+) -> None:
+    """Send a command to the controller's device, capturing it if enabled.
+
+    It is sent on ``conn`` if given, or else the connection of the controller.
+    """
+    conn = controller.conn if conn is None else conn
+    if controller.capture is None:
+        await conn.send_command(message)
+    else:
+        await controller.capture.send_command(conn, message)
+
+
+async def send_query(
+    controller: TempController | TempRampController,
+    message: str | bytes,
+    conn: Connection | None = None,
+) -> Response:
+    """Send a query to the controller's device, capturing it if enabled.
+
+    It is sent on ``conn`` if given, or else the connection of the controller.
+    """
+    conn = controller.conn if conn is None else conn
+    if controller.capture is None:
+        return await conn.send_query(message)
+    return await controller.capture.send_query(conn, message)
 
 
 @dataclass
 class TempControllerHandler:
+    """Handler for a TempController command.
+
+    Attributes are polled every ``update_period`` while their value is changing,
+    backing off to ``max_update_period`` while it is not. With ``fast_while_enabled``
+    the attribute is always polled at the fastest rate while its controller is
+    enabled. Writing an attribute reads it straight back.
+
+    Polled values are only published when the response changes and the new value
+    differs from the published one by more than the larger of ``deadband`` and
+    ``relative_deadband`` times its magnitude. By default the deadband of a `Float`
+    attribute is half a unit in the last digit of its precision, so that values are
+    only published when their displayed value would change.
+
+    With ``pushed``, the attribute is not polled while its controller is subscribed
+    to updates pushed by the device, which are passed to `publish` instead.
+
+    While the controller's circuit breaker is shedding load, only ``essential``
+    attributes are polled, and only while their controller is enabled. Failed polls
+    are recorded on the breaker and logged rather than raised, so that the backend
+    keeps polling.
+    """
+
+    #: Whether requests are recorded on the breaker by what sends them, rather than
+    #: by each update, e.g. as they are shared between controllers
+    records_requests: ClassVar[bool] = False
+
     name: str
     update_period: float = 0.2
+    max_update_period: float = 5.0
+    fast_while_enabled: bool = False
+    pushed: bool = False
+    essential: bool = False
+    deadband: float | None = None
+    relative_deadband: float = 0.0
+    _schedules: dict[AttrR, PollSchedule] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _responses: dict[AttrR, Response] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _decoders: dict[AttrR, Decoder] = field(
+        default_factory=dict, init=False, repr=False
+    )
 
     async def put(
         self,
         controller: TempController | TempRampController,
         attr: AttrW,
         value: Any,
+    ) -> None:
+        if controller.diagnostics is None:
+            await self._put(controller, attr, value)
+        else:
+            with controller.diagnostics.measure(f"put:{self.name}"):
+                await self._put(controller, attr, value)
+
+    async def _put(
+        self,
+        controller: TempController | TempRampController,
+        attr: AttrW,
+        value: Any,
     ) -> None:
         if attr.dtype is bool:
             value = int(value)
-        await controller.conn.send_command(
-            f"{self.name}{controller.suffix}={value}\r\n"
-        )
+        breaker = controller.breaker
+        # Both on the same member of the pool, so the reply reflects the write
+        conn = controller.channel_conn
+        try:
+            await send_command(
+                controller,
+                controller.protocol.command(self.name, controller.index, value),
+                conn,
+            )
+            response = None
+            if isinstance(attr, AttrR):
+                self._schedule(attr).reset()
+                response = await self._query_channel(controller, conn)
+        except REQUEST_ERRORS:
+            breaker.failed(asyncio.get_running_loop().time())
+            raise
+        breaker.succeeded()
+
+        if response is not None:
+            self._responses[attr] = response
+            await attr.set(self._parse(attr, response))
 
     async def update(
         self,
         controller: TempController | TempRampController,
         attr: AttrR,
     ) -> None:
-        response = await controller.conn.send_query(
-            f"{self.name}{controller.suffix}?\r\n"
+        if self.pushed and controller.subscribed():
+            return
+
+        now = asyncio.get_running_loop().time()
+        if controller.breaker.shedding(now):
+            if not (self.essential and self._enabled(controller)):
+                return
+
+        schedule = self._schedule(attr)
+        if not (schedule.due(now) or self._enabled(controller)):
+            return
+
+        try:
+            if controller.diagnostics is None:
+                response = await self._query(controller)
+            else:
+                with controller.diagnostics.measure(f"poll:{self.name}"):
+                    response = await self._query(controller)
+        except REQUEST_ERRORS as error:
+            # Not raised, as that would end the backend's scan task for every
+            # attribute polled at this period, on every device of a group
+            if not self.records_requests:
+                controller.breaker.failed(now)
+            self._log_failure(controller, error)
+            return
+        except ValueError as error:
+            # An invalid reply, already counted by the diagnostics
+            self._log_failure(controller, error)
+            return
+        if not self.records_requests:
+            controller.breaker.succeeded()
+
+        try:
+            changed = await self.publish(attr, response)
+        except ValueError as error:
+            if controller.diagnostics is not None:
+                controller.diagnostics.errors[f"poll:{self.name}"] += 1
+            self._log_failure(controller, error)
+            return
+        schedule.polled(now, changed=changed)
+
+    def _log_failure(
+        self, controller: TempController | TempRampController, error: Exception
+    ) -> None:
+        # Only the first failure of an outage is worth a warning, not every poll
+        log = logging.warning if controller.breaker.failures <= 1 else logging.debug
+        log("Polling %s of %r failed: %r", self.name, controller.path, error)
+
+    async def publish(self, attr: AttrR, response: Response) -> bool:
+        """Set the attribute from a response if it is outside the deadband.
+
+        Returns:
+            bool: Whether the response differs from the previous one.
+        """
+        if response == self._responses.get(attr):
+            return False
+
+        first = attr not in self._responses
+        self._responses[attr] = response
+        value = self._parse(attr, response)
+        if first or self._exceeds_deadband(attr, value):
+            await attr.set(value)
+        return True
+
+    async def _query(self, controller: TempController | TempRampController) -> Response:
+        return await self._query_channel(controller)
+
+    async def _query_channel(
+        self,
+        controller: TempController | TempRampController,
+        conn: Connection | None = None,
+    ) -> Response:
+        return await send_query(
+            controller, controller.protocol.query(self.name, controller.index), conn
         )
-        if attr.dtype is bool:
-            await attr.set(int(response))
+
+    def _parse(self, attr: AttrR, response: Response) -> Any:
+        # The decoder is chosen once per attribute, not on every response
+        decode = self._decoders.get(attr)
+        if decode is None:
+            decode = self._decoders[attr] = decoder(attr.datatype)
+        return decode(response)
+
+    def _exceeds_deadband(self, attr: AttrR, value: Any) -> bool:
+        if not isinstance(value, float):
+            return value != attr.get()
+
+        deadband = self.deadband
+        if deadband is None and isinstance(attr.datatype, Float):
+            deadband = 0.5 * 10**-attr.datatype.prec
+        published = attr.get()
+        deadband = max(deadband or 0.0, self.relative_deadband * abs(published))
+        return abs(value - published) > deadband
+
+    def _schedule(self, attr: AttrR) -> PollSchedule:
+        # Handlers are shared by every instance of a controller class
+        if attr not in self._schedules:
+            self._schedules[attr] = PollSchedule(
+                self.update_period, self.max_update_period
+            )
+        return self._schedules[attr]
+
+    def _enabled(self, controller: TempController | TempRampController) -> bool:
+        return self.fast_while_enabled and bool(controller.enabled.get())
+
+
+@dataclass
+class TempRampBulkHandler(TempControllerHandler):
+    """Handler that polls a ramp attribute of every channel in one query.
+
+    Updates from all ramp controllers in a scan share a single ``<name>*?`` query
+    on the parent ``TempController`` and pick their own value out of the reply, which
+    records the query on the breaker once rather than for each of them.
+    """
+
+    records_requests = True
+
+    async def _query(self, controller: TempRampController) -> Response:
+        column = await controller.parent.query_column(self.name)
+        return column[controller.index - 1]
+
+
+@dataclass
+class TempRampRecipeHandler(TempControllerHandler):
+    """Handler for the recipe of a ramp controller, only served over ASCII."""
+
+    async def put(
+        self, controller: TempRampController, attr: AttrW, value: Any
+    ) -> None:
+        if not isinstance(controller.protocol, AsciiProtocol):
+            raise ValueError("Recipes can only be loaded over the ASCII protocol")
+        # The device would reply with an error to a command, which has no reply
+        if not RECIPE.fullmatch(value):
+            raise ValueError(f"Invalid recipe {value!r}, expected start:end:dwell,...")
+        await super().put(controller, attr, value)
+
+    async def update(self, controller: TempRampController, attr: AttrR) -> None:
+        if isinstance(controller.protocol, AsciiProtocol):
+            await super().update(controller, attr)
+
+
+@dataclass
+class DiagnosticsHandler:
+    """Handler publishing a summary of a TempController's diagnostics."""
+
+    name: str
+    update_period: float = 1.0
+
+    async def update(self, controller: TempController, attr: AttrR) -> None:
+        if controller.diagnostics is not None:
+            await attr.set(controller.read_diagnostic(self.name))
+
+
+@dataclass
+class HistoryHandler:
+    """Handler publishing the recent temperatures of a ramp controller, if recorded.
+
+    Without ``trend``, the last samples are published as comma separated values, and
+    with it the min, max and mean of bins of every sample as ``min:max:mean,...``.
+    """
+
+    trend: bool = False
+    update_period: float = 1.0
+    _published: dict[AttrR, int] = field(default_factory=dict, init=False, repr=False)
+
+    async def update(self, controller: TempRampController, attr: AttrR) -> None:
+        history = controller.parent.temperature_history
+        # Only formatted again once a sample has been taken since the last time
+        if history is None or self._published.get(attr) == history.count:
+            return
+        self._published[attr] = history.count
+
+        from demo_fast_cs.history import format_samples, format_trend
+
+        settings = controller.parent._settings
+        channel = controller.index - 1
+        if self.trend:
+            trend = history.decimate(channel, settings.history_bins)
+            value = format_trend(trend, PRECISION)
         else:
-            await attr.set(response)
+            samples = history.last(channel, settings.history_length)
+            value = format_samples(samples, PRECISION)
+        await attr.set(value)
+
+
+@cache
+def attribute_names(controller_class: type) -> tuple[str, ...]:
+    """The names of the Attributes of a controller class, found once per class."""
+    return tuple(
+        name
+        for name in dir(controller_class)
+        if isinstance(getattr(controller_class, name), Attribute)
+    )
+
+
+def bind_attributes(controller: Controller | SubController) -> None:
+    """Give a controller its own copy of each Attribute of its class.
+
+    Equivalent to ``BaseController._bind_attrs``, without searching every member of
+    each instance, which dominates creating hundreds of ramp controllers.
+    """
+    controller_class: type = type(controller)
+    for name in attribute_names(controller_class):
+        setattr(controller, name, copy(getattr(controller_class, name)))
+
+
+def bulk_handlers() -> list[TempRampBulkHandler]:
+    """The handlers of the ramp attributes which are polled a column at a time."""
+    handlers = []
+    for name in attribute_names(TempRampController):
+        attr = getattr(TempRampController, name)
+        if isinstance(attr, AttrR) and isinstance(attr.updater, TempRampBulkHandler):
+            handlers.append(attr.updater)
+    return handlers
+
+
+def start_poller(
+    devices: Sequence[TempControllerSettings], num_workers: int
+) -> ColumnPoller:
+    """Start polling the ramp attribute columns of devices from worker processes."""
+    # NumPy is only imported once workers are enabled
+    from demo_fast_cs.workers import ColumnPoller
+
+    handlers = bulk_handlers()
+    poller = ColumnPoller(devices, [handler.name for handler in handlers], num_workers)
+    poller.start()
+    return poller
+
+
+def poll_handlers() -> list[TempControllerHandler]:
+    """The handlers polling the attributes of TempController and TempRampController."""
+    handlers = []
+    for controller_class in (TempController, TempRampController):
+        for name in attribute_names(controller_class):
+            attr = getattr(controller_class, name)
+            if isinstance(attr, AttrR) and isinstance(
+                attr.updater, TempControllerHandler
+            ):
+                handlers.append(attr.updater)
+    return handlers
+
+
+def set_poll_period(period: float) -> None:
+    """Set the fastest period in s that TempController attributes are polled at.
+
+    Handlers which poll more slowly, e.g. the recipe's, keep their period relative to
+    the fastest. Attributes which have already been polled switch to the new periods
+    from their next poll. Handlers are shared by every instance of a controller class,
+    so this applies to every TempController and TempRampController in the process.
+
+    Raises:
+        ValueError: If the period is not positive, or would make any handler poll
+            more slowly than its ``max_update_period``.
+    """
+    handlers = poll_handlers()
+    fastest = min(handler.update_period for handler in handlers)
+    scale = period / fastest
+    if period <= 0:
+        raise ValueError(f"Poll period must be positive, not {period}")
+    for handler in handlers:
+        if handler.update_period * scale > handler.max_update_period:
+            raise ValueError(
+                f"Poll period {period} s would poll {handler.name} more slowly than "
+                f"its maximum period of {handler.max_update_period} s"
+            )
+
+    for handler in handlers:
+        handler.update_period = (
+            period
+            if handler.update_period == fastest
+            else handler.update_period * scale
+        )
+        for schedule in handler._schedules.values():
+            schedule.min_period = handler.update_period
+            schedule.reset()
+
+
+@dataclass
+class DegradedHandler:
+    """Handler publishing whether a TempController's circuit breaker is open."""
+
+    update_period: float = 0.2
+
+    async def update(self, controller: TempController, attr: AttrR) -> None:
+        if attr.get() != controller.breaker.degraded:
+            await attr.set(controller.breaker.degraded)
 
 
 class TempController(Controller):
     ramp_rate = AttrRW(Float(), handler=TempControllerHandler("R"))
+    degraded = AttrR(Bool(znam="Healthy", onam="Degraded"), handler=DegradedHandler())
+
+    # Only updated if diagnostics are enabled in the settings. Latencies are in ms.
+    diag_poll_latency_p50 = AttrR(
+        Float(prec=3), handler=DiagnosticsHandler("poll_latency_p50")
+    )
+    diag_poll_latency_p99 = AttrR(
+        Float(prec=3), handler=DiagnosticsHandler("poll_latency_p99")
+    )
+    diag_put_latency_p99 = AttrR(
+        Float(prec=3), handler=DiagnosticsHandler("put_latency_p99")
+    )
+    diag_errors = AttrR(Int(), handler=DiagnosticsHandler("errors"))
+    diag_timeouts = AttrR(Int(), handler=DiagnosticsHandler("timeouts"))
+    diag_queue_depth = AttrR(Int(), handler=DiagnosticsHandler("queue_depth"))
 
     def __init__(self, settings: TempControllerSettings) -> None:
         super().__init__()
+        assert not (settings.push and settings.binary), "Push requires ASCII protocol"
+        # Controller has no path of its own, as it is normally the root
+        self._path = settings.name
 
+        # Channel 0 addresses the controller itself
+        self.index = 0
         self.suffix = ""
         self._settings = settings
-        self.conn = IPConnection()
+        self.protocol: AsciiProtocol | BinaryProtocol
+        if settings.binary:
+            self.protocol = BinaryProtocol()
+            connection_factory: type = BinaryIPConnection
+        else:
+            self.protocol = AsciiProtocol()
+            connection_factory = (
+                PipelinedIPConnection if settings.pipelined else IPConnection
+            )
+        self.conn = IPConnectionPool(
+            settings.num_connections,
+            connection_factory,
+            timeout=settings.timeout,
+            retries=settings.retries,
+        )
+        self.breaker = CircuitBreaker(
+            settings.failure_threshold, settings.recovery_period
+        )
+        self._column_queries: dict[str, asyncio.Future[Sequence[Any]]] = {}
+        self._listener: PipelinedIPConnection | None = None
+        self.diagnostics = Diagnostics() if settings.diagnostics else None
+        #: Polls ramp attribute columns in other processes, if workers are enabled.
+        #: A group shares one between its devices, as device ``poller_index``.
+        self.poller: ColumnPoller | None = None
+        self.poller_index = 0
+        self._owns_poller = False
+        self.capture = TrafficCapture(settings.capture) if settings.capture else None
+        history: TemperatureHistory | None = None
+        if settings.history_samples:
+            # NumPy is only imported once a history is kept
+            from demo_fast_cs.history import TemperatureHistory
+
+            history = TemperatureHistory(
+                settings.num_ramp_controllers, settings.history_samples
+            )
+        self.temperature_history = history
 
         self._ramp_controllers: list[TempRampController] = []
         for index in range(1, settings.num_ramp_controllers + 1):
-            controller = TempRampController(index, self.conn)
+            controller = TempRampController(index, self)
             self._ramp_controllers.append(controller)
             self.register_sub_controller(controller)
 
+    @property
+    def channel_conn(self) -> PooledConnection:
+        """The member of the pool which requests to channel 0 need to share."""
+        return self.conn.shard(0)
+
+    def _bind_attrs(self) -> None:
+        bind_attributes(self)
+
     @command
     async def cancel_all(self) -> None:
+        await send_command(self, self.protocol.broadcast("N", 0))
         for rc in self._ramp_controllers:
-            await rc.enabled.process(False)
+            await rc.enabled.set(False)
+
+    @scan(0.2)
+    async def sample_history(self) -> None:
+        """Record the latest temperature of every ramp in the history, if kept."""
+        if self.temperature_history is not None:
+            self.temperature_history.sample()
+
+    @scan(1.0)
+    async def check_connections(self) -> None:
+        await self.conn.check_health(self.protocol.query("R", 0), timeout=1.0)
+        if self._settings.push and not self.subscribed():
+            with suppress(*CONNECTION_ERRORS):
+                await self.subscribe()
+
+    def subscribed(self) -> bool:
+        """Whether the device is pushing ramp temperatures to the controller."""
+        return self._listener is not None and self._listener.connected
+
+    async def subscribe(self) -> None:
+        """Open a connection on which the device pushes every ramp temperature."""
+        if self._listener is not None:
+            with suppress(*CONNECTION_ERRORS):
+                await self._listener.close()
+            self._listener = None
+
+        listener = PipelinedIPConnection()
+        listener.on_notification = self._handle_notification
+        await listener.connect(self._settings.ip_settings)
+        await listener.send_command("M*=1\r\n")
+        self._listener = listener
+
+    async def _handle_notification(self, message: str) -> None:
+        name, _, value = message.strip().partition("=")
+        index = int(name[1:]) - 1 if name[:1] == "T" else -1
+        if 0 <= index < len(self._ramp_controllers):
+            ramp = self._ramp_controllers[index]
+            handler = ramp.current.updater
+            assert isinstance(handler, TempControllerHandler)
+            await handler.publish(ramp.current, value)
+            if self.temperature_history is not None:
+                self.temperature_history.update(index, float(value))
+
+    def read_diagnostic(self, name: str) -> float:
+        assert self.diagnostics is not None, "Diagnostics are not enabled"
+        match name:
+            case "poll_latency_p50":
+                return self.diagnostics.latency("poll:").percentile(50) * 1e3
+            case "poll_latency_p99":
+                return self.diagnostics.latency("poll:").percentile(99) * 1e3
+            case "put_latency_p99":
+                return self.diagnostics.latency("put:").percentile(99) * 1e3
+            case "errors":
+                return sum(self.diagnostics.errors.values())
+            case "timeouts":
+                return sum(self.diagnostics.timeouts.values())
+            case "queue_depth":
+                return self.conn.in_flight
+            case _:
+                raise ValueError(f"Unknown diagnostic {name}")
+
+    async def query_column(self, name: str) -> Sequence[Any]:
+        """Query the value of ``name`` for all ramp controllers at once.
+
+        Concurrent callers share the same in-flight query.
+        """
+        query = self._column_queries.get(name)
+        if query is None:
+            query = asyncio.ensure_future(self._query_column(name))
+            self._column_queries[name] = query
+            query.add_done_callback(lambda _: self._column_queries.pop(name))
+        return await asyncio.shield(query)
+
+    async def _query_column(self, name: str) -> Sequence[Any]:
+        try:
+            if self.poller is not None:
+                column: Sequence[Any] = await self.poller.column(
+                    self.poller_index, name
+                )
+            else:
+                response = await send_query(self, self.protocol.column_query(name))
+                column = self.protocol.parse_column(response)
+        except REQUEST_ERRORS:
+            self.breaker.failed(asyncio.get_running_loop().time())
+            raise
+        self.breaker.succeeded()
+        if len(column) != len(self._ramp_controllers):
+            # e.g. configured with more ramp controllers than the device has
+            raise ValueError(
+                f"Expected {len(self._ramp_controllers)} values of {name}, "
+                f"got {len(column)}"
+            )
+        if name == "T" and self.temperature_history is not None:
+            self.temperature_history.update_all(column)
+        return column
 
     async def connect(self) -> None:
         await self.conn.connect(self._settings.ip_settings)
+        if self._settings.push:
+            await self.subscribe()
+        if self._settings.workers and self.poller is None:
+            self.poller = start_poller([self._settings], self._settings.workers)
+            self._owns_poller = True
 
     async def close(self) -> None:
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
         await self.conn.close()
+        if self.capture is not None:
+            self.capture.close()
+        if self._owns_poller and self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+            self._owns_poller = False
 
 
 class TempRampController(SubController):
-    start = AttrRW(Int(), handler=TempControllerHandler("S"))
-    end = AttrRW(Int(), handler=TempControllerHandler("E"))
-    current = AttrR(Float(prec=3), handler=TempControllerHandler("T"))
-    enabled = AttrRW(Bool(znam="Off", onam="On"), handler=TempControllerHandler("N"))
+    start = AttrRW(Int(), handler=TempRampBulkHandler("S"))
+    end = AttrRW(Int(), handler=TempRampBulkHandler("E"))
+    current = AttrR(
+        Float(prec=3),
+        handler=TempRampBulkHandler(
+            "T", fast_while_enabled=True, pushed=True, essential=True
+        ),
+    )
+    enabled = AttrRW(Bool(znam="Off", onam="On"), handler=TempRampBulkHandler("N"))
+    # Segments of start:end:dwell, e.g. "10:20:5,20:40:0", run by the device when
+    # enabled. "-" clears it.
+    recipe = AttrRW(String(), handler=TempRampRecipeHandler("P", update_period=1.0))
+    segment = AttrR(Int(), handler=TempRampBulkHandler("G", fast_while_enabled=True))
+    segment_remaining = AttrR(
+        Float(prec=1), handler=TempRampBulkHandler("L", fast_while_enabled=True)
+    )
+    # Only updated if the history is kept in the settings. Recent temperatures, and
+    # the min:max:mean of bins of the whole history, oldest first.
+    history = AttrR(String(), handler=HistoryHandler())
+    history_trend = AttrR(String(), handler=HistoryHandler(trend=True))
 
-    def __init__(self, index: int, conn: IPConnection) -> None:
+    def __init__(self, index: int, parent: TempController) -> None:
+        self.index = index
         self.suffix = f"{index:02d}"
-        super().__init__(f"ramp{self.suffix}")
-        self.conn = conn
+        super().__init__(
+            f"{parent.path}:ramp{self.suffix}" if parent.path else f"ramp{self.suffix}"
+        )
+        self.parent = parent
+        self.conn = parent.conn.shard(index - 1)
+        self.protocol = parent.protocol
+        self.diagnostics = parent.diagnostics
+        self.capture = parent.capture
+        self.breaker = parent.breaker
+
+    @property
+    def channel_conn(self) -> PooledConnection:
+        return self.conn
+
+    def _bind_attrs(self) -> None:
+        bind_attributes(self)
+
+    def subscribed(self) -> bool:
+        return self.parent.subscribed()
@@ -1,17 +1,25 @@
-from fastcs.backends import AsyncioBackend, EpicsBackend
-from fastcs.mapping import Mapping
+from pathlib import Path
+from typing import Sequence
 
 from demo_fast_cs.controllers import (
     IPConnectionSettings,
     TempController,
     TempControllerSettings,
 )
+from demo_fast_cs.mapping import get_mapping
 
+# fastcs.backends imports the EPICS and PVI libraries, which take most of the time to
+# start up, so it is only imported by the functions that need a backend
 
-def get_controller() -> TempController:
+
+def get_settings() -> TempControllerSettings:
     ip_settings = IPConnectionSettings()
-    settings = TempControllerSettings(4, ip_settings)
-    tcont = TempController(settings)
+    return TempControllerSettings(4, ip_settings)
+
+
+def get_controller() -> TempController:
+    tcont = get_mapping(get_settings()).controller
+    assert isinstance(tcont, TempController)
     return tcont
 
 
@@ -39,29 +47,35 @@ async def run_controller() -> None:
 
 
 def test_mapping() -> None:
-    tcont = get_controller()
-    m = Mapping(tcont)
+    m = get_mapping(get_settings())
 
     print(str(m))
 
 
 def create_docs() -> None:
-    tcont = get_controller()
-    m = Mapping(tcont)
+    from fastcs.backends import EpicsBackend
+
+    m = get_mapping(get_settings())
     backend = EpicsBackend(m)
     backend.create_docs()
 
 
-def create_gui() -> None:
-    tcont = get_controller()
-    m = Mapping(tcont)
-    backend = EpicsBackend(m)
-    backend.create_gui()
+def create_gui(
+    output_path: Path | None = None,
+    settings: TempControllerSettings | Sequence[TempControllerSettings] | None = None,
+) -> None:
+    from fastcs.backends import EpicsBackend
+    from fastcs.backends.epics.gui import EpicsGUIOptions
+
+    options = EpicsGUIOptions() if output_path is None else EpicsGUIOptions(output_path)
+    backend = EpicsBackend(get_mapping(settings or get_settings()))
+    backend.create_gui(options)
 
 
 def test_ioc() -> None:
-    tcont = get_controller()
-    m = Mapping(tcont)
+    from fastcs.backends import EpicsBackend
+
+    m = get_mapping(get_settings())
     backend = EpicsBackend(m)
     ioc = backend.get_ioc()
 
@@ -69,8 +83,9 @@ def test_ioc() -> None:
 
 
 def test_asyncio_backend() -> None:
-    tcont = get_controller()
-    m = Mapping(tcont)
+    from fastcs.backends import AsyncioBackend
+
+    m = get_mapping(get_settings())
     backend = AsyncioBackend(m)
     backend.run_interactive_session()
 
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, fields, replace
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Sequence
+
+import yaml
+from fastcs.attributes import AttrR
+from fastcs.connections import IPConnectionSettings
+from fastcs.controller import Controller
+from fastcs.datatypes import Int
+
+from demo_fast_cs.connections import CONNECTION_ERRORS
+from demo_fast_cs.controllers import (
+    TempController,
+    TempControllerSettings,
+    bind_attributes,
+    start_poller,
+)
+
+if TYPE_CHECKING:
+    from demo_fast_cs.workers import ColumnPoller
+
+
+@dataclass
+class GroupHandler:
+    """Handler publishing a summary of the devices of a TempControllerGroup."""
+
+    name: str
+    update_period: float = 1.0
+
+    async def update(self, controller: TempControllerGroup, attr: AttrR) -> None:
+        value = controller.read_summary(self.name)
+        if attr.get() != value:
+            await attr.set(value)
+
+
+class TempControllerGroup(Controller):
+    """Serves a `TempController` for each of many devices from one process.
+
+    Each device has its own connections, and its PVs are prefixed with its name, e.g.
+    ``TC01:RampRate`` and ``TC01:RAMP01:Current`` for the device named ``tc01``.
+    A fastcs `Mapping` only includes the sub-controllers of its controller, not theirs,
+    so the devices and all of their ramp controllers are registered directly with the
+    group.
+
+    The backend polls every attribute with the same update period from one scan task,
+    so the attributes of all the devices share the same poll scheduling rather than
+    each device running its own. A device which can not be reached when the group
+    connects is reconnected in the background, rather than stopping the others, and
+    its failed polls are recorded by its circuit breaker rather than raised into the
+    shared scan tasks, so the other devices keep being polled while it is down.
+
+    If any device has workers enabled, the ramp attribute columns of every device are
+    polled from one pool of the most workers of any of them, dealt between them, so
+    none of them can take a capture.
+    """
+
+    num_devices = AttrR(Int(), handler=GroupHandler("devices"))
+    num_disconnected = AttrR(Int(), handler=GroupHandler("disconnected"))
+    num_degraded = AttrR(Int(), handler=GroupHandler("degraded"))
+
+    def __init__(self, devices: Sequence[TempControllerSettings]) -> None:
+        super().__init__()
+        names = [settings.name for settings in devices]
+        assert all(names), "Every device of a group needs a name"
+        assert len(set(names)) == len(names), f"Device names are not unique: {names}"
+        # The workers of any device poll every device
+        if any(d.workers for d in devices) and any(d.capture for d in devices):
+            raise ValueError("A capture can not be taken of the requests of workers")
+
+        self._settings = list(devices)
+        self.devices = [TempController(settings) for settings in devices]
+        self.poller: ColumnPoller | None = None
+        for device in self.devices:
+            # The Mapping only needs a BaseController, which a TempController is
+            self.register_sub_controller(device)  # type: ignore[arg-type]
+            for ramp in device.get_sub_controllers():
+                self.register_sub_controller(ramp)
+
+    def _bind_attrs(self) -> None:
+        bind_attributes(self)
+
+    def read_summary(self, name: str) -> int:
+        match name:
+            case "devices":
+                return len(self.devices)
+            case "disconnected":
+                return sum(
+                    not any(member.healthy for member in device.conn.members)
+                    for device in self.devices
+                )
+            case "degraded":
+                return sum(device.breaker.degraded for device in self.devices)
+            case _:
+                raise ValueError(f"Unknown summary {name}")
+
+    async def connect(self) -> None:
+        workers = max(settings.workers for settings in self._settings)
+        if workers and self.poller is None:
+            self.poller = start_poller(self._settings, workers)
+            for index, device in enumerate(self.devices):
+                device.poller = self.poller
+                device.poller_index = index
+        results = await asyncio.gather(
+            *[device.connect() for device in self.devices], return_exceptions=True
+        )
+        for device, result in zip(self.devices, results):
+            if isinstance(result, CONNECTION_ERRORS):
+                logging.warning("Could not connect to %s: %s", device.path, result)
+                device.conn.reconnect()
+            elif isinstance(result, BaseException):
+                raise result
+
+    async def close(self) -> None:
+        await asyncio.gather(*[device.close() for device in self.devices])
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+
+
+def load_devices(
+    path: str | Path, defaults: TempControllerSettings
+) -> list[TempControllerSettings]:
+    """Read the settings of the devices of a group from a YAML or JSON file, e.g.::
+
+        devices:
+          - name: tc01
+            host: 10.0.0.1
+            port: 25565
+          - name: tc02
+            host: 10.0.0.2
+            port: 25565
+            num_ramp_controllers: 16
+
+    Devices take any of the fields of `TempControllerSettings`, with ``host`` and
+    ``port`` in place of ``ip_settings``, and those not given are taken from
+    ``defaults``.
+    """
+    with open(path) as f:
+        config = yaml.safe_load(f)
+
+    names = {field.name for field in fields(TempControllerSettings)}
+    devices = []
+    for device in config["devices"]:
+        overrides: dict[str, Any] = dict(device)
+        ip = IPConnectionSettings(
+            overrides.pop("host", defaults.ip_settings.ip),
+            overrides.pop("port", defaults.ip_settings.port),
+        )
+        unknown = set(overrides) - names
+        if unknown:
+            raise ValueError(f"Unknown settings {sorted(unknown)} in {device}")
+        devices.append(replace(defaults, ip_settings=ip, **overrides))
+    return devices
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+#: The longest value of a fastcs String attribute, served as an EPICS long string of
+#: 256 bytes including its terminating null
+MAX_STRING_LENGTH = 255
+
+#: The most samples and trend bins that always fit in a String attribute, for
+#: temperatures of up to 8 characters at the protocol's precision, e.g. ``-100.125``
+MAX_SAMPLES = MAX_STRING_LENGTH // len("-100.125,")
+MAX_BINS = MAX_STRING_LENGTH // len("-100.125:-100.125:-100.125,")
+
+
+class TemperatureHistory:
+    """A fixed size history of the temperature of every channel.
+
+    The latest temperature of each channel is kept up to date with `update` and
+    `update_all` as replies arrive, and `sample` appends all of them at once to a ring
+    buffer of the last ``capacity`` samples. Memory use is fixed at ``capacity`` times
+    the number of channels float32s, and each sample is stored as one contiguous row
+    so recording it is a single copy. Channels with no temperature yet are NaN.
+    """
+
+    def __init__(self, num_channels: int, capacity: int) -> None:
+        assert capacity > 0, "History must hold at least one sample"
+        self.capacity = capacity
+        #: The latest temperature of each channel
+        self.latest = np.full(num_channels, np.nan)
+        #: The number of samples taken, including those since overwritten
+        self.count = 0
+        self._samples = np.full((capacity, num_channels), np.nan, dtype=np.float32)
+
+    @property
+    def size(self) -> int:
+        """The number of samples held."""
+        return min(self.count, self.capacity)
+
+    def update(self, channel: int, value: float) -> None:
+        self.latest[channel] = value
+
+    def update_all(self, values: Sequence) -> None:
+        """Set the latest temperature of every channel, e.g. from a column reply."""
+        self.latest[:] = np.asarray(values, dtype=float)
+
+    def sample(self) -> None:
+        """Append the latest temperature of every channel to the history."""
+        self._samples[self.count % self.capacity] = self.latest
+        self.count += 1
+
+    def last(self, channel: int, num_samples: int) -> npt.NDArray[np.float32]:
+        """The last ``num_samples`` samples of a channel, oldest first."""
+        num_samples = min(num_samples, self.size)
+        rows = np.arange(self.count - num_samples, self.count) % self.capacity
+        return self._samples[rows, channel]
+
+    def decimate(self, channel: int, num_bins: int) -> npt.NDArray[np.float64]:
+        """Reduce every sample of a channel to the min, max and mean of each bin.
+
+        Returns:
+            An array of shape (bins, 3) of the min, max and mean of equal numbers of
+            consecutive samples, oldest first. Samples older than fit into whole bins
+            are left out, and there are fewer bins than ``num_bins`` while there are
+            fewer samples than that. NaN samples are ignored.
+        """
+        num_bins = min(num_bins, self.size)
+        if num_bins == 0:
+            return np.empty((0, 3))
+        per_bin = self.size // num_bins
+        bins = self.last(channel, num_bins * per_bin).reshape(num_bins, per_bin)
+
+        valid = ~np.isnan(bins)
+        counts = valid.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(valid, bins, 0).sum(axis=1, dtype=np.float64) / counts
+        # fmin and fmax ignore NaNs, where min and max would propagate them
+        return np.column_stack(
+            (np.fmin.reduce(bins, axis=1), np.fmax.reduce(bins, axis=1), means)
+        )
+
+
+def format_samples(
+    samples: npt.NDArray, prec: int, max_length: int = MAX_STRING_LENGTH
+) -> str:
+    """Format samples as comma separated values, rounded to ``prec`` decimal places.
+
+    Only the newest samples that fit in ``max_length`` characters are included.
+    """
+    values = np.round(samples.astype(float), prec).tolist()
+    return _join_newest(list(map(repr, values)), max_length)
+
+
+def format_trend(
+    trend: npt.NDArray, prec: int, max_length: int = MAX_STRING_LENGTH
+) -> str:
+    """Format the bins of `TemperatureHistory.decimate` as ``min:max:mean,...``.
+
+    Only the newest bins that fit in ``max_length`` characters are included.
+    """
+    rows = np.round(trend, prec).tolist()
+    return _join_newest([":".join(map(repr, row)) for row in rows], max_length)
+
+
+def _join_newest(items: list[str], max_length: int) -> str:
+    # Join as many items from the end as fit, with a comma between each
+    length = -1
+    start = len(items)
+    while start > 0 and length + len(items[start - 1]) + 1 <= max_length:
+        start -= 1
+        length += len(items[start]) + 1
+    return ",".join(items[start:])
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from functools import cache
+from typing import Sequence
+
+from fastcs.attributes import Attribute
+from fastcs.controller import BaseController, Controller
+from fastcs.cs_methods import Command, Put, Scan
+from fastcs.mapping import Mapping, SingleMapping
+
+from demo_fast_cs.controllers import TempController, TempControllerSettings
+
+
+class TempControllerMapping(Mapping):
+    """A `Mapping` which finds the members of each controller class only once.
+
+    ``Mapping`` checks every member of every controller against a runtime checkable
+    protocol, which is slow enough to dominate startup with hundreds of ramp
+    controllers. Every instance of a class has the same members, so they are looked
+    up once and then read from each instance by name.
+    """
+
+    @staticmethod
+    def _get_single_mapping(controller: BaseController) -> SingleMapping:
+        controller_class: type = type(controller)
+        methods, attributes = _members(controller_class)
+        scan_methods: dict[str, Scan] = {}
+        put_methods: dict[str, Put] = {}
+        command_methods: dict[str, Command] = {}
+        for name, method in methods.items():
+            match method:
+                case Put():
+                    put_methods[name] = method
+                case Scan():
+                    scan_methods[name] = method
+                case Command():
+                    command_methods[name] = method
+
+        return SingleMapping(
+            controller,
+            scan_methods,
+            put_methods,
+            command_methods,
+            {name: getattr(controller, name) for name in attributes},
+        )
+
+
+@cache
+def _members(controller_class: type) -> tuple[dict[str, object], tuple[str, ...]]:
+    # The fastcs methods by name, and the names of the attributes, in dir() order
+    methods: dict[str, object] = {}
+    attributes: list[str] = []
+    for name in dir(controller_class):
+        member = getattr(controller_class, name)
+        if isinstance(member, Attribute):
+            attributes.append(name)
+        elif hasattr(member, "fastcs_method"):
+            methods[name] = member.fastcs_method
+    return methods, tuple(attributes)
+
+
+_mappings: dict[str, TempControllerMapping] = {}
+
+
+def get_mapping(
+    settings: TempControllerSettings | Sequence[TempControllerSettings],
+) -> TempControllerMapping:
+    """Return the mapping of a `TempController`, created once for given settings.
+
+    Given the settings of many devices, the mapping is of a `TempControllerGroup`.
+    """
+    key = repr(settings)
+    if key not in _mappings:
+        controller: Controller
+        if isinstance(settings, TempControllerSettings):
+            controller = TempController(settings)
+        else:
+            # Groups need yaml, which a single device does not
+            from demo_fast_cs.group import TempControllerGroup
+
+            controller = TempControllerGroup(settings)
+        _mappings[key] = TempControllerMapping(controller)
+    return _mappings[key]
@@ -0,0 +1,164 @@
+"""Encodings of the temperature controller's requests.
+
+The controller speaks ASCII commands like ``T01?``, replying with text terminated by
+``\\r\\n``. The simulator can also serve a binary protocol, where every request and
+reply is a fixed size `FRAME` of an opcode, a status, a channel and a float64 value,
+packed little endian. Channel 0 addresses the controller itself and channels from 1
+address its ramp controllers. Every request gets a reply frame echoing its opcode
+and channel, with the requested value for queries. Column queries are followed by a
+payload of one value per channel, packed as in `COLUMN_FORMATS`.
+
+Any number of frames can be sent in one write and they are replied to in order.
+"""
+
+from __future__ import annotations
+
+import re
+import struct
+from enum import IntEnum
+from typing import Any, Sequence, Union
+
+#: A reply from the device, decoded by the connection it was received on
+Response = Union[str, float, memoryview]
+
+#: Opcode, status, channel, value
+FRAME = struct.Struct("<BBHd")
+
+#: Decimal places that the ASCII protocol sends floats to
+PRECISION = 3
+
+#: The reply of the device to any ASCII request it does not accept, even a command
+REJECTED = "Request does not match any known command"
+
+#: A recipe the device accepts, of ``start:end:dwell`` segments or ``-`` for none
+RECIPE = re.compile(r"-|\d+:\d+:\d+\.?\d*(?:,\d+:\d+:\d+\.?\d*)*")
+
+
+class Opcode(IntEnum):
+    GET_TEMPERATURE = 1
+    GET_ENABLED = 2
+    SET_ENABLED = 3
+    GET_START = 4
+    SET_START = 5
+    GET_END = 6
+    SET_END = 7
+    GET_RAMP_RATE = 8
+    SET_RAMP_RATE = 9
+    GET_ALL_TEMPERATURES = 10
+    GET_ALL_ENABLED = 11
+    GET_ALL_START = 12
+    GET_ALL_END = 13
+    SET_ALL_ENABLED = 14
+    GET_SEGMENT = 15
+    GET_SEGMENT_REMAINING = 16
+    GET_ALL_SEGMENTS = 17
+    GET_ALL_SEGMENT_REMAINING = 18
+
+
+class Status(IntEnum):
+    OK = 0
+    ERROR = 1
+
+
+#: The memoryview format of the payload of each column query. Payloads are cast in
+#: place, so clients must be little endian.
+COLUMN_FORMATS = {
+    Opcode.GET_ALL_TEMPERATURES: "d",
+    Opcode.GET_ALL_ENABLED: "i",
+    Opcode.GET_ALL_START: "i",
+    Opcode.GET_ALL_END: "i",
+    Opcode.GET_ALL_SEGMENTS: "i",
+    Opcode.GET_ALL_SEGMENT_REMAINING: "d",
+}
+
+#: Opcodes by the letter of the equivalent ASCII command
+GET_OPCODES = {
+    "T": Opcode.GET_TEMPERATURE,
+    "N": Opcode.GET_ENABLED,
+    "S": Opcode.GET_START,
+    "E": Opcode.GET_END,
+    "R": Opcode.GET_RAMP_RATE,
+    "G": Opcode.GET_SEGMENT,
+    "L": Opcode.GET_SEGMENT_REMAINING,
+}
+SET_OPCODES = {
+    "N": Opcode.SET_ENABLED,
+    "S": Opcode.SET_START,
+    "E": Opcode.SET_END,
+    "R": Opcode.SET_RAMP_RATE,
+}
+GET_ALL_OPCODES = {
+    "T": Opcode.GET_ALL_TEMPERATURES,
+    "N": Opcode.GET_ALL_ENABLED,
+    "S": Opcode.GET_ALL_START,
+    "E": Opcode.GET_ALL_END,
+    "G": Opcode.GET_ALL_SEGMENTS,
+    "L": Opcode.GET_ALL_SEGMENT_REMAINING,
+}
+
+SET_ALL_OPCODES = {
+    "N": Opcode.SET_ALL_ENABLED,
+}
+
+
+def format_value(value: Any) -> str:
+    """Format a number for the ASCII protocol, in as few characters as possible.
+
+    Floats are rounded to `PRECISION` and written as the shortest string that reads
+    back as the rounded value, e.g. ``10.3`` rather than ``10.300000000000002``, and
+    NumPy scalars are converted first so the format does not depend on NumPy's.
+    """
+    if isinstance(value, float):
+        return repr(round(float(value), PRECISION))
+    return str(int(value))
+
+
+class BinaryProtocolError(Exception):
+    """The device replied to a binary request with an error status."""
+
+
+class AsciiProtocol:
+    """Encodes requests as ASCII commands, e.g. ``T01?``."""
+
+    def query(self, name: str, channel: int) -> str:
+        return f"{name}{self._suffix(channel)}?\r\n"
+
+    def command(self, name: str, channel: int, value: int | float) -> str:
+        return f"{name}{self._suffix(channel)}={value}\r\n"
+
+    def column_query(self, name: str) -> str:
+        return f"{name}*?\r\n"
+
+    def broadcast(self, name: str, value: int | float) -> str:
+        return f"{name}*={value}\r\n"
+
+    def parse_column(self, response: Response) -> list[str]:
+        assert isinstance(response, str), f"Expected a str, got {response!r}"
+        return response.strip().split(",")
+
+    def _suffix(self, channel: int) -> str:
+        return f"{channel:02d}" if channel else ""
+
+
+class BinaryProtocol:
+    """Encodes requests as binary `FRAME` s.
+
+    Replies are decoded by `demo_fast_cs.connections.BinaryIPConnection`.
+    Recipes can not be loaded over the binary protocol, only with the ASCII command.
+    """
+
+    def query(self, name: str, channel: int) -> bytes:
+        return FRAME.pack(GET_OPCODES[name], Status.OK, channel, 0.0)
+
+    def command(self, name: str, channel: int, value: int | float) -> bytes:
+        return FRAME.pack(SET_OPCODES[name], Status.OK, channel, value)
+
+    def column_query(self, name: str) -> bytes:
+        return FRAME.pack(GET_ALL_OPCODES[name], Status.OK, 0, 0.0)
+
+    def broadcast(self, name: str, value: int | float) -> bytes:
+        return FRAME.pack(SET_ALL_OPCODES[name], Status.OK, 0, value)
+
+    def parse_column(self, response: Response) -> Sequence[float]:
+        assert isinstance(response, memoryview), f"Expected a column, got {response!r}"
+        return response
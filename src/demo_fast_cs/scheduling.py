@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+
+@dataclass
+class PollSchedule:
+    """Tracks when an attribute is next due to be polled.
+
+    The poll period is multiplied by ``backoff`` each time a poll finds the value
+    unchanged, up to ``max_period``, and drops back to ``min_period`` as soon as the
+    value changes.
+    """
+
+    min_period: float
+    max_period: float
+    backoff: float = 2.0
+    period: float = field(init=False)
+    next_poll: float = field(default=0.0, init=False)
+
+    def __post_init__(self) -> None:
+        self.period = self.min_period
+
+    def due(self, now: float) -> bool:
+        return now >= self.next_poll
+
+    def polled(self, now: float, changed: bool) -> None:
+        if changed:
+            self.period = self.min_period
+        else:
+            self.period = min(self.period * self.backoff, self.max_period)
+        self.next_poll = now + self.period
+
+    def reset(self) -> None:
+        """Return to the fastest rate, starting with the next poll."""
+        self.period = self.min_period
+        self.next_poll = 0.0
+
+
+@dataclass
+class CircuitBreaker:
+    """Tracks whether requests to a device are failing, to shed load while they are.
+
+    The breaker opens, marking the device degraded, after ``failure_threshold``
+    consecutive failed requests. While open, only essential polls should be made,
+    until ``recovery_period`` has passed and requests are let through to probe the
+    device again. It closes on the first request that succeeds, or opens again on the
+    next failure.
+    """
+
+    failure_threshold: int = 5
+    recovery_period: float = 5.0
+    failures: int = field(default=0, init=False)
+    opened_at: float | None = field(default=None, init=False)
+
+    @property
+    def degraded(self) -> bool:
+        return self.opened_at is not None
+
+    def shedding(self, now: float) -> bool:
+        """Whether non-essential requests should be skipped."""
+        return (
+            self.opened_at is not None and now < self.opened_at + self.recovery_period
+        )
+
+    def succeeded(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def failed(self, now: float) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = now
@@ -1,21 +1,39 @@
+import asyncio
 import logging
+import math
+import random
 import traceback
+from asyncio.streams import StreamReader, StreamWriter
+from contextvars import ContextVar
 from dataclasses import dataclass
 from os import _exit
+from typing import Any, AsyncIterable, Awaitable, Callable, Optional, Tuple
 
 import numpy as np
 import numpy.typing as npt
 from tickit.adapters.composed import ComposedAdapter
 from tickit.adapters.interpreters.command import CommandInterpreter
 from tickit.adapters.interpreters.command.regex_command import RegexCommand
+from tickit.adapters.interpreters.utils import wrap_as_async_iterable
 from tickit.adapters.interpreters.wrappers import SplittingInterpreter
 from tickit.adapters.servers.tcp import ByteFormat, TcpServer
+from tickit.core.adapter import Adapter, Interpreter
 from tickit.core.components.component import Component, ComponentConfig
 from tickit.core.components.device_simulation import DeviceSimulation
 from tickit.core.device import Device, DeviceUpdate
 from tickit.core.typedefs import SimTime
 from typing_extensions import TypedDict
 
+from demo_fast_cs.diagnostics import Diagnostics
+from demo_fast_cs.protocol import (
+    COLUMN_FORMATS,
+    FRAME,
+    PRECISION,
+    Opcode,
+    Status,
+    format_value,
+)
+
 
 def handle_exceptions(func):
     """Log and exit if the wrapped function raises an Exception.
@@ -34,7 +52,29 @@ def handle_exceptions(func):
     return wrapped_func
 
 
+#: Ticks work on every channel once more than 1 / DENSE_RAMP_FRACTION are enabled
+DENSE_RAMP_FRACTION = 4
+
+#: How close in seconds a dwell must be to being over for its segment to finish
+DWELL_TOLERANCE = 1e-9
+
+
 class TempControllerDevice(Device):
+    """A temperature controller whose channels ramp from their start to their end.
+
+    Each channel can be loaded with a recipe of segments, each ramping from a start
+    to an end and then dwelling there for some seconds. Enabling a channel with a
+    recipe runs through its segments in turn, without any further commands, and the
+    channel is disabled at the end of the last one. The segments of every channel are
+    stored in one array and advanced together in `ramp`.
+
+    Args:
+        time_scale: How many times faster than the simulation clock to ramp.
+        tick_period: How often in ns to update while ramping, or None to only update
+            when a channel finishes. Channels are always updated at the moment they
+            reach their end.
+    """
+
     Inputs: type = TypedDict("Inputs", {"flux": float})
     Outputs: type = TypedDict("Outputs", {"flux": float})
 
@@ -43,80 +83,841 @@ class TempControllerDevice(Device):
         num_ramp_controllers: int,
         default_start: float,
         default_end: float,
+        time_scale: float = 1.0,
+        tick_period: Optional[int] = int(1e8),
     ) -> None:
         self._num = num_ramp_controllers
         self._start = np.full(num_ramp_controllers, default_start, dtype=int)
         self._end = np.full(num_ramp_controllers, default_end, dtype=int)
         self._current = np.zeros(num_ramp_controllers, dtype=float)
         self._enabled = np.full(num_ramp_controllers, 0, dtype=int)
-        self._start_times = np.full(num_ramp_controllers, -1, dtype=int)
+        # Channels enabled since the last tick, which start ramping from the next one
+        self._fresh = np.zeros(num_ramp_controllers, dtype=bool)
+        self._last_tick: int | None = None
+
+        # The enabled channels, which are the only ones a tick needs to touch
+        self._active: set[int] = set()
+        self._active_mask = np.zeros(num_ramp_controllers, dtype=bool)
+        self._active_index: npt.NDArray[np.intp] | None = None
+        self._no_channels = np.zeros(0, dtype=np.intp)
+
+        # Scratch buffers so that ticks do not allocate, grown with the active set
+        self._allocate_scratch(16)
+
+        # The start, end and dwell of each recipe segment by channel, allocated
+        # with as many segments as the longest recipe loaded
+        self._recipes: npt.NDArray[np.float64] | None = None
+        self._num_segments = np.zeros(num_ramp_controllers, dtype=int)
+        # The segment each channel is running from 1, or 0 if it is not in a recipe
+        self._segment = np.zeros(num_ramp_controllers, dtype=int)
+        # The seconds left to dwell at the end of the segment, and whether it is
+        self._dwell = np.zeros(num_ramp_controllers, dtype=float)
+        self._holding = np.zeros(num_ramp_controllers, dtype=bool)
 
         self._ramp_rate: float = 1  # 1 unit/s
+        self._time_scale = time_scale
+        self._tick_period = tick_period
+
+    @property
+    def num_ramp_controllers(self) -> int:
+        return self._num
+
+    @property
+    def num_enabled(self) -> int:
+        return len(self._active)
 
     def get_temps(self, index: int):
         return self._current[index]
 
+    def get_all_temps(self) -> npt.NDArray:
+        return self._current
+
     def get_start(self, index: int):
         return self._start[index]
 
+    def get_all_start(self) -> npt.NDArray:
+        return self._start
+
     def set_start(self, index: int, value: int):
         self._start[index] = value
 
     def get_end(self, index: int):
         return self._end[index]
 
+    def get_all_end(self) -> npt.NDArray:
+        return self._end
+
     def set_end(self, index: int, value: int):
         self._end[index] = value
 
     def set_enabled(self, index: int, value: int):
+        index = int(index)
         if value:
+            if self._num_segments[index]:
+                self._load_segments(np.array([index]), np.array([1]))
             self._current[index] = float(self._start[index])
-            self._start_times[index] = -1
+            self._fresh[index] = True
             self._enabled[index] = 1
+            self._active_mask[index] = True
+            self._active.add(index)
         else:
+            self._fresh[index] = False
             self._enabled[index] = 0
+            self._active_mask[index] = False
+            self._active.discard(index)
+            self._segment[index] = 0
+            self._holding[index] = False
+        self._active_index = None
+
+    def set_enabled_where(self, mask: npt.NDArray[np.bool_], value: int):
+        """Enable or disable every channel in ``mask`` at once."""
+        if value:
+            channels = np.flatnonzero(mask)
+            recipes = channels[self._num_segments[channels] > 0]
+            if recipes.size:
+                self._load_segments(recipes, np.ones_like(recipes))
+            self._current[channels] = self._start[channels]
+            self._fresh[channels] = True
+            self._enabled[channels] = 1
+            self._active_mask[channels] = True
+            self._active.update(channels.tolist())
+        else:
+            # Only the enabled channels need to change
+            channels = np.flatnonzero(mask & self._active_mask)
+            self._fresh[channels] = False
+            self._enabled[channels] = 0
+            self._active_mask[channels] = False
+            self._active.difference_update(channels.tolist())
+            self._segment[channels] = 0
+            self._holding[channels] = False
+        self._active_index = None
 
     def get_enabled(self, index: int):
         return self._enabled[index]
 
+    def get_all_enabled(self) -> npt.NDArray:
+        return self._enabled
+
     def get_ramp_rate(self):
         return self._ramp_rate
 
     def set_ramp_rate(self, rate: float):
         self._ramp_rate = rate
 
-    def ramp(
-        self,
-        periods: npt.NDArray,
-    ):
-        can_ramp = np.logical_and(self._enabled, self._current < self._end)
-        max_temps = self._current.copy()
-        max_temps[can_ramp] += self._ramp_rate * (periods[can_ramp] / 1e9)
-        self._current = np.minimum(max_temps, self._end)
-        self._enabled[self._current >= self._end] = 0
+    def get_recipe(self, index: int) -> npt.NDArray:
+        if self._recipes is None:
+            return np.zeros((0, 3))
+        return self._recipes[index, : self._num_segments[index]]
+
+    def set_recipe(self, index: int, segments: npt.ArrayLike):
+        """Load rows of (start, end, dwell) to run the next time a channel is enabled.
+
+        A recipe with no segments clears it, so that the channel ramps from its start
+        to its end as usual.
+        """
+        rows = np.asarray(segments, dtype=float).reshape(-1, 3)
+        width = 0 if self._recipes is None else self._recipes.shape[1]
+        if len(rows) > width:
+            recipes = np.zeros((self._num, len(rows), 3))
+            if self._recipes is not None:
+                recipes[:, :width] = self._recipes
+            self._recipes = recipes
+        if len(rows):
+            assert self._recipes is not None
+            self._recipes[index, : len(rows)] = rows
+        self._num_segments[index] = len(rows)
+
+    def get_segment(self, index: int):
+        return self._segment[index]
+
+    def get_all_segments(self) -> npt.NDArray:
+        return self._segment
+
+    def get_segment_remaining(self, index: int):
+        return float(self._segment_remaining(index))
+
+    def get_all_segment_remaining(self) -> npt.NDArray:
+        return self._segment_remaining(slice(None))
+
+    def _segment_remaining(self, channels: int | slice) -> Any:
+        # In seconds of simulation time, so the dwell is scaled like the ramp
+        rate = self._step(int(1e9))
+        distance = np.maximum(self._end[channels] - self._current[channels], 0)
+        ramping = distance / rate if rate > 0 else np.where(distance > 0, np.inf, 0)
+        remaining = ramping + self._dwell[channels] / self._time_scale
+        return np.where(self._segment[channels] > 0, remaining, 0.0)
+
+    def ramp(self, period: int) -> float:
+        """Ramp every enabled channel by ``period`` ns at the current ramp rate.
+
+        Only the enabled channels are gathered into the scratch buffers and worked
+        on, so the cost of a tick scales with how many are enabled, not the total.
+        Once most channels are enabled it is cheaper to work on all of them in place.
+        Channels that reach their end are disabled, or move on through their recipe.
+
+        Returns:
+            float: How long in ns until the next enabled channel reaches its end or
+            finishes dwelling there.
+        """
+        if not self._active:
+            return np.inf
+        if len(self._active) * DENSE_RAMP_FRACTION > self._num:
+            distance, finished = self._ramp_all(period)
+        else:
+            distance, finished = self._ramp_active(period)
+
+        rate = self._step(1)
+        until = distance / rate if rate > 0 else np.inf
+        if finished.size:
+            until = min(until, self._finish(finished, period))
+        return until
+
+    def _ramp_active(self, period: int) -> tuple[float, npt.NDArray[np.intp]]:
+        active = self._active_channels()
+        count = len(active)
+        current = np.take(
+            self._current, active, out=self._current_buf[:count], mode="wrap"
+        )
+        end = np.take(self._end, active, out=self._end_buf[:count], mode="wrap")
+        fresh = np.take(self._fresh, active, out=self._fresh_buf[:count], mode="wrap")
+        can_ramp = np.less(current, end, out=self._can_ramp[:count])
+        steps = np.multiply(can_ramp, self._step(period), out=self._steps[:count])
+        np.copyto(steps, 0.0, where=fresh)
+        np.add(current, steps, out=current)
+        np.minimum(current, end, out=current)
+        np.put(self._current, active, current, mode="wrap")
+        np.put(self._fresh, active, False, mode="wrap")
+
+        finished = active[np.greater_equal(current, end, out=can_ramp)]
+        remaining = np.subtract(end, current, out=steps)
+        ramping = np.greater(remaining, 0, out=can_ramp)
+        return float(np.min(remaining, where=ramping, initial=np.inf)), finished
+
+    def _ramp_all(self, period: int) -> tuple[float, npt.NDArray[np.intp]]:
+        if len(self._steps) < self._num:
+            self._allocate_scratch(self._num)
+        can_ramp, steps = self._can_ramp[: self._num], self._steps[: self._num]
+        np.less(self._current, self._end, out=can_ramp)
+        np.logical_and(can_ramp, self._active_mask, out=can_ramp)
+        np.multiply(can_ramp, self._step(period), out=steps)
+        np.copyto(steps, 0.0, where=self._fresh)
+        np.add(self._current, steps, out=self._current)
+        np.minimum(self._current, self._end, out=self._current, where=self._active_mask)
+        self._fresh.fill(False)
+
+        finished = np.greater_equal(self._current, self._end, out=can_ramp)
+        np.logical_and(finished, self._active_mask, out=finished)
+        channels = np.flatnonzero(finished) if finished.any() else self._no_channels
+
+        # Finished channels have no distance left, so are left out with the inactive
+        np.subtract(self._end, self._current, out=steps)
+        np.logical_not(finished, out=finished)
+        np.logical_and(finished, self._active_mask, out=finished)
+        return float(np.min(steps, where=finished, initial=np.inf)), channels
+
+    def _step(self, period: int) -> float:
+        return self._ramp_rate * self._time_scale * period / 1e9
+
+    def _finish(self, channels: npt.NDArray[np.intp], period: int) -> float:
+        """Disable channels at their end, or dwell and move on through their recipe.
+
+        Returns:
+            float: How long in ns until the next recipe segment ends.
+        """
+        until = np.inf
+        in_recipe = self._segment[channels] > 0
+        if in_recipe.any():
+            until = self._advance(channels[in_recipe], period)
+            channels = channels[~in_recipe]
+        self._disable(channels)
+        return until
+
+    def _advance(self, channels: npt.NDArray[np.intp], period: int) -> float:
+        # Channels only start dwelling from the tick they arrive at their end
+        holding = channels[self._holding[channels]]
+        self._dwell[holding] -= self._time_scale * period / 1e9
+        self._holding[channels] = True
+
+        done = channels[self._dwell[channels] <= DWELL_TOLERANCE]
+        segments = self._segment[done] + 1
+        last = segments > self._num_segments[done]
+        self._segment[done[last]] = 0
+        self._holding[done[last]] = False
+        self._disable(done[last])
+        following = done[~last]
+        self._load_segments(following, segments[~last])
+        self._current[following] = self._start[following]
+
+        dwelling = self._dwell[channels[self._holding[channels]]]
+        until = float(np.min(dwelling, initial=np.inf)) * 1e9 / self._time_scale
+        distance = self._end[following] - self._current[following]
+        rate = self._step(1)
+        if rate > 0:
+            until = min(until, float(np.min(distance, initial=np.inf)) / rate)
+        return until
+
+    def _load_segments(
+        self, channels: npt.NDArray[np.intp], segments: npt.NDArray[np.intp]
+    ) -> None:
+        assert self._recipes is not None
+        rows = self._recipes[channels, segments - 1]
+        self._start[channels] = rows[:, 0]
+        self._end[channels] = rows[:, 1]
+        self._dwell[channels] = rows[:, 2]
+        self._segment[channels] = segments
+        self._holding[channels] = False
+
+    def _disable(self, channels: npt.NDArray[np.intp]) -> None:
+        self._enabled[channels] = 0
+        self._active_mask[channels] = False
+        self._active.difference_update(channels.tolist())
+        self._active_index = None
+
+    def _active_channels(self) -> npt.NDArray[np.intp]:
+        if self._active_index is None:
+            self._active_index = np.fromiter(
+                self._active, dtype=np.intp, count=len(self._active)
+            )
+            if len(self._active) > len(self._steps):
+                self._allocate_scratch(2 ** (len(self._active) - 1).bit_length())
+        return self._active_index
+
+    def _allocate_scratch(self, size: int) -> None:
+        self._current_buf = np.zeros(size, dtype=float)
+        self._end_buf = np.zeros(size, dtype=self._end.dtype)
+        self._fresh_buf = np.zeros(size, dtype=bool)
+        self._can_ramp = np.zeros(size, dtype=bool)
+        self._steps = np.zeros(size, dtype=float)
 
     @handle_exceptions
     def update(self, time: SimTime, inputs: Inputs) -> DeviceUpdate[Outputs]:
-        self._start_times[self._start_times == -1] = int(time)
-        periods = np.full(self._num, int(time)) - self._start_times
-        self.ramp(periods)
-        self._start_times = np.full(self._num, int(time))
-        call_at = SimTime(int(time) + int(1e8)) if np.any(self._enabled) else None
+        period = 0 if self._last_tick is None else int(time) - self._last_tick
+        until = self.ramp(period)
+        self._last_tick = int(time)
+        call_at = self._next_update(int(time), until)
         return DeviceUpdate(TempControllerDevice.Outputs(flux=inputs["flux"]), call_at)
 
+    def _next_update(self, now: int, until: float) -> Optional[SimTime]:
+        """Return the time of the next periodic tick or the next channel to finish."""
+        if not self._active:
+            return None
+
+        call_at = None if self._tick_period is None else now + self._tick_period
+        if until < np.inf:
+            finish = now + math.ceil(until)
+            call_at = finish if call_at is None else min(call_at, finish)
+        return None if call_at is None else SimTime(call_at)
+
+
+class ClientConnection:
+    """A client of a `TempControllerServer`, which adapters can push messages to.
+
+    Also counts the client's traffic, as reported by `stats`.
+    """
+
+    def __init__(
+        self,
+        replies: asyncio.Queue[AsyncIterable[Optional[bytes]] | None],
+        writer: Optional[StreamWriter] = None,
+        max_backlog: Optional[int] = None,
+    ) -> None:
+        self._replies = replies
+        self._writer = writer
+        self._max_backlog = max_backlog
+        #: Set whenever a reply is written or the client disconnects
+        self._progress = asyncio.Event()
+        #: Set once the client has disconnected and no more messages will be sent
+        self.closed = False
+        #: Set if the client was disconnected for not reading what was sent to it
+        self.dropped = False
+        self.peer = "" if writer is None else str(writer.get_extra_info("peername"))
+        self.messages = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        #: The number of times the client's requests were held back for it to catch up
+        self.throttled = 0
+
+    @property
+    def backlog(self) -> int:
+        """The number of replies and pushed messages waiting to be written."""
+        return self._replies.qsize()
+
+    def push(self, message: bytes) -> None:
+        """Send an unsolicited message, after any replies already queued.
+
+        Clients with more than ``max_backlog`` messages waiting are dropped.
+        """
+        if self.closed:
+            return
+        if self._max_backlog is not None and self.backlog >= self._max_backlog:
+            self.drop()
+        else:
+            self._replies.put_nowait(wrap_as_async_iterable(message))
+
+    def drop(self) -> None:
+        """Disconnect a client which is not keeping up with what is sent to it."""
+        self.dropped = True
+        self.close()
+
+    def close(self) -> None:
+        self.closed = True
+        self._progress.set()
+        if self._writer is not None:
+            self._writer.close()
+
+    def wrote(self, size: int) -> None:
+        self.bytes_sent += size
+        self._progress.set()
+
+    async def catch_up(self, backlog: int) -> None:
+        """Wait until fewer than ``backlog`` messages are waiting to be written."""
+        self.throttled += 1
+        while self.backlog >= backlog and not self.closed:
+            self._progress.clear()
+            await self._progress.wait()
+
+    def stats(self) -> dict:
+        return {
+            "peer": self.peer,
+            "messages": self.messages,
+            "bytes_received": self.bytes_received,
+            "bytes_sent": self.bytes_sent,
+            "backlog": self.backlog,
+            "throttled": self.throttled,
+        }
+
+
+#: The client whose messages are being handled by the current task
+CURRENT_CLIENT: ContextVar[ClientConnection] = ContextVar("CURRENT_CLIENT")
+
+
+class TempControllerServer(TcpServer):
+    """A TcpServer which lets clients pipeline requests.
+
+    Only complete lines are passed on to the handler, with any partial message at the
+    end of a read kept until the rest of it arrives, and replies are written back in
+    the order the messages were received. Each client connection keeps its own state,
+    so any number of clients can be connected at once. If the configured port is 0, it
+    is updated with the port picked by the OS once the server is listening.
+
+    While a client's messages are handled, `CURRENT_CLIENT` is set to a
+    `ClientConnection` which can be used to push messages to it later.
+
+    Clients are served fairly, so that one busy client can not starve the rest:
+
+    - Each read of up to ``read_size`` bytes is handled as one batch, after which the
+      client waits its turn behind every other client with a batch ready.
+    - At most ``buffer_size`` bytes of unread requests are buffered for each client,
+      beyond which TCP flow control stops it sending more.
+    - A client with ``max_pending`` batches of replies waiting to be written is not
+      read from again until it has caught up, and one with ``max_backlog`` messages
+      waiting, e.g. from pushes it is not reading, is disconnected.
+    - Connections beyond ``max_clients`` are closed as soon as they are accepted.
+    """
+
+    port: int
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 25565,
+        format: ByteFormat = ByteFormat(b"%b"),
+        max_clients: Optional[int] = None,
+        read_size: int = 1024,
+        buffer_size: int = 2**16,
+        max_pending: int = 16,
+        max_backlog: int = 1024,
+    ) -> None:
+        super().__init__(host, port, format)
+        self.max_clients = max_clients
+        self.read_size = read_size
+        self.buffer_size = buffer_size
+        self.max_pending = max_pending
+        self.max_backlog = max_backlog
+        self._clients: dict[ClientConnection, asyncio.Task] = {}
+        #: The number of connections closed for exceeding ``max_clients``
+        self.rejected = 0
+        #: The number of clients disconnected for not keeping up with their replies
+        self.dropped = 0
+        #: Whether the server is accepting connections
+        self.listening = False
+
+    @property
+    def num_clients(self) -> int:
+        return len(self._clients)
+
+    def client_stats(self) -> list[dict]:
+        """The counters of each connected client."""
+        return [client.stats() for client in self._clients]
+
+    async def run_forever(
+        self,
+        on_connect: Callable[[], AsyncIterable[Optional[bytes]]],
+        handler: Callable[[bytes], Awaitable[AsyncIterable[Optional[bytes]]]],
+    ) -> None:
+        handle = self._generate_handle_function(on_connect, handler)
+
+        server = await asyncio.start_server(
+            handle, self.host, self.port, limit=self.buffer_size
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self.listening = True
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.listening = False
+            # Hang up on clients so their handlers finish rather than being cancelled
+            for client in self._clients:
+                client.close()
+            await asyncio.gather(*self._clients.values(), return_exceptions=True)
+
+    def _generate_handle_function(
+        self,
+        on_connect: Callable[[], AsyncIterable[Optional[bytes]]],
+        handler: Callable[[bytes], Awaitable[AsyncIterable[Optional[bytes]]]],
+    ) -> Callable[[StreamReader, StreamWriter], Awaitable[None]]:
+        async def handle(reader: StreamReader, writer: StreamWriter) -> None:
+            if self.max_clients is not None and self.num_clients >= self.max_clients:
+                self.rejected += 1
+                writer.close()
+                return
+
+            replies: asyncio.Queue[AsyncIterable[Optional[bytes]] | None]
+            replies = asyncio.Queue()
+            # Each connection is handled in its own task, and so its own context
+            client = ClientConnection(replies, writer, self.max_backlog)
+            CURRENT_CLIENT.set(client)
+
+            async def reply() -> None:
+                try:
+                    while (responses := await replies.get()) is not None:
+                        async for response in responses:
+                            if response is None or writer.is_closing():
+                                continue
+                            data = self.format % response
+                            writer.write(data)
+                            await writer.drain()
+                            client.wrote(len(data))
+                finally:
+                    # Stop the handler waiting for replies which will not be sent
+                    client.close()
+
+            replies.put_nowait(on_connect())
+            replier = asyncio.create_task(reply())
+            self._clients[client] = asyncio.current_task()  # type: ignore
+
+            buffer = b""
+            try:
+                while not client.closed:
+                    data: bytes = await reader.read(self.read_size)
+                    if data == b"":
+                        break
+                    client.bytes_received += len(data)
+                    messages, buffer = self.split(buffer + data)
+                    if not messages:
+                        continue
+                    client.messages += self.count(messages)
+                    replies.put_nowait(await handler(messages))
+                    if client.backlog >= self.max_pending:
+                        await client.catch_up(self.max_pending)
+                    else:
+                        # Let other clients have a turn before reading any more
+                        await asyncio.sleep(0)
+
+                if not client.closed:
+                    replies.put_nowait(None)
+                    await replier
+            except ConnectionError:
+                # The client went away without closing the connection
+                pass
+            finally:
+                self.dropped += client.dropped
+                client.close()
+                replier.cancel()
+                del self._clients[client]
+
+        return handle
+
+    def count(self, messages: bytes) -> int:
+        """The number of messages in a batch passed to the handler."""
+        return messages.count(b"\n") + 1
+
+    def split(self, data: bytes) -> Tuple[bytes, bytes]:
+        """Split received data into complete messages and a trailing partial one."""
+        messages, _, partial = data.rpartition(b"\n")
+        return messages, partial
+
+
+class BinaryFrameServer(TempControllerServer):
+    """A TempControllerServer for the fixed size frames of `protocol.FRAME`.
+
+    Every complete frame in a read is passed to the handler as one batch.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 25566,
+        max_clients: Optional[int] = None,
+    ) -> None:
+        super().__init__(host, port, ByteFormat(b"%b"), max_clients)
+
+    def split(self, data: bytes) -> Tuple[bytes, bytes]:
+        end = len(data) - len(data) % FRAME.size
+        return data[:end], data[end:]
+
+    def count(self, messages: bytes) -> int:
+        return len(messages) // FRAME.size
+
+
+#: An adapter method, a parser for its value argument or None if it takes none, and
+#: whether it takes a channel index
+FastPathCommand = Tuple[
+    Callable[..., Awaitable[Optional[bytes]]], Optional[Callable], bool
+]
+
+
+def parse_flag(value: bytes) -> Optional[int]:
+    return int(value) if value in (b"0", b"1") else None
+
+
+def parse_number(value: bytes) -> Optional[str]:
+    # Equivalent to matching the regex \d+\.?\d*
+    if value[:1].isdigit() and value.replace(b".", b"", 1).isdigit():
+        return value.decode("utf-8")
+    return None
+
+
+class TimedCommandInterpreter(CommandInterpreter):
+    """A CommandInterpreter which matches every message against the regex commands.
+
+    If ``diagnostics`` are given, the time taken to handle each message is recorded as
+    ``"regex"``.
+    """
+
+    def __init__(self, diagnostics: Optional[Diagnostics] = None) -> None:
+        super().__init__()
+        self.diagnostics = diagnostics
+
+    async def handle(
+        self, adapter: Adapter, message: bytes
+    ) -> Tuple[AsyncIterable[bytes], bool]:
+        if self.diagnostics is None:
+            return await super().handle(adapter, message)
+        with self.diagnostics.measure("regex"):
+            return await super().handle(adapter, message)
+
+
+class FastPathInterpreter(TimedCommandInterpreter):
+    """A CommandInterpreter which dispatches known commands without regex matching.
+
+    Messages are looked up in a table of commands keyed by their command letter and
+    operator, e.g. ``b"T?"`` for ``T01?``, with the two digit channel index and any
+    value parsed directly. Messages which are not in the table, or have an invalid
+    value, or are missing an index or have one their command does not take, fall
+    back to being matched against the adapter's regex commands.
+
+    If ``diagnostics`` are given, the time taken to handle each command is recorded by
+    method name, with messages handled by the regex commands recorded as ``"regex"``.
+    """
+
+    def __init__(
+        self,
+        commands: dict[bytes, FastPathCommand],
+        diagnostics: Optional[Diagnostics] = None,
+    ) -> None:
+        super().__init__(diagnostics)
+        self._commands = commands
+
+    async def handle(
+        self, adapter: Adapter, message: bytes
+    ) -> Tuple[AsyncIterable[bytes], bool]:
+        parsed = self._parse(message.strip())
+        if parsed is None:
+            return await super().handle(adapter, message)
+
+        method, args = parsed
+        if self.diagnostics is None:
+            resp = await method(*args)
+        else:
+            with self.diagnostics.measure(method.__name__):
+                resp = await method(*args)
+        return wrap_as_async_iterable(resp), getattr(method, "__command__").interrupt
+
+    def _parse(self, message: bytes) -> Optional[Tuple[Callable, list[Any]]]:
+        args: list[Any] = []
+        indexed = message[1:3].isdigit()
+        if indexed:
+            key, value = message[:1] + message[3:4], message[4:]
+            args.append(message[1:3].decode("utf-8"))
+        elif message[1:2] == b"*":
+            key, value = message[:3], message[3:]
+        else:
+            key, value = message[:2], message[2:]
+
+        command = self._commands.get(key)
+        if command is None:
+            return None
+
+        method, parse_value, takes_index = command
+        if indexed != takes_index:
+            return None
+        if parse_value is None:
+            if value:
+                return None
+        else:
+            parsed_value = parse_value(value)
+            if parsed_value is None:
+                return None
+            args.append(parsed_value)
+
+        return method, args
+
+
+class FaultInjectingInterpreter(Interpreter):
+    """Wraps an interpreter to stall or drop replies, as an unreliable device might.
+
+    Each message is handled after a ``delay`` in seconds, which holds up every later
+    message from the same client, and its reply is dropped with probability
+    ``drop_rate``. Both can be changed while the simulation is running.
+    """
+
+    def __init__(
+        self,
+        interpreter: Interpreter,
+        delay: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.interpreter = interpreter
+        self.delay = delay
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+
+    async def handle(
+        self, adapter: Adapter, message: bytes
+    ) -> Tuple[AsyncIterable[Optional[bytes]], bool]:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        replies, interrupt = await self.interpreter.handle(adapter, message)
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            return wrap_as_async_iterable(None), interrupt
+        return replies, interrupt
+
 
 class TempControllerAdapter(ComposedAdapter):
+    """Serves the ASCII commands of the temperature controller.
+
+    Clients can monitor the temperature of channels with ``M01=1`` or ``M*=1``, after
+    which a ``T01=<value>`` line is pushed to them with the current value and then
+    whenever the value changes in a tick. Pushed lines can be told apart from replies
+    by the ``=``.
+
+    Recipes are loaded with e.g. ``P01=10:20:5,20:40:0`` for a ramp from 10 to 20, a
+    5 s dwell and then a ramp from 20 to 40, or cleared with ``P01=-``. The progress
+    of a running recipe is read with ``G01?`` for the segment and ``L01?`` for the
+    seconds left in it.
+
+    If ``fault_delay`` or ``fault_drop_rate`` are set, replies are delayed or dropped
+    by a `FaultInjectingInterpreter`, available as `faults`.
+    """
+
     device: TempControllerDevice
 
     def __init__(
         self,
         host: str = "localhost",
         port: int = 25565,
+        fast_path: bool = True,
+        diagnostics: bool = False,
+        fault_delay: float = 0.0,
+        fault_drop_rate: float = 0.0,
+        max_clients: Optional[int] = None,
     ) -> None:
+        #: The channels each client is monitoring
+        self._monitors: dict[ClientConnection, npt.NDArray[np.bool_]] = {}
+        #: The temperatures as of the last notifications
+        self._published: Optional[npt.NDArray] = None
+        #: Command latencies, by fast path method name or ``"regex"``
+        self.diagnostics = Diagnostics() if diagnostics else None
+        interpreter: Interpreter = (
+            FastPathInterpreter(self.fast_path_commands(), self.diagnostics)
+            if fast_path
+            else TimedCommandInterpreter(self.diagnostics)
+        )
+        self.faults: Optional[FaultInjectingInterpreter] = None
+        if fault_delay or fault_drop_rate:
+            self.faults = FaultInjectingInterpreter(
+                interpreter, fault_delay, fault_drop_rate
+            )
+            interpreter = self.faults
         super().__init__(
-            TcpServer(host, port, ByteFormat(b"%b\r\n")),
-            SplittingInterpreter(CommandInterpreter(), message_delimiter=b"\n"),
-            # CommandInterpreter(),
+            TempControllerServer(host, port, ByteFormat(b"%b\r\n"), max_clients),
+            SplittingInterpreter(interpreter, message_delimiter=b"\n"),
+        )
+
+    def fast_path_commands(self) -> dict[bytes, FastPathCommand]:
+        """The commands which `FastPathInterpreter` dispatches without regex."""
+        return {
+            b"T?": (self.get_temperature, None, True),
+            b"T*?": (self.get_all_temperatures, None, False),
+            b"N?": (self.get_enabled, None, True),
+            b"N*?": (self.get_all_enabled, None, False),
+            b"N=": (self.set_enabled, parse_flag, True),
+            b"N*=": (self.set_all_enabled, parse_flag, False),
+            b"S?": (self.get_start, None, True),
+            b"S*?": (self.get_all_start, None, False),
+            b"S=": (self.set_start, parse_number, True),
+            b"E?": (self.get_end, None, True),
+            b"E*?": (self.get_all_end, None, False),
+            b"E=": (self.set_end, parse_number, True),
+            b"R?": (self.get_ramp_rate, None, False),
+            b"R=": (self.set_ramp_rate, parse_number, False),
+            b"M=": (self.set_monitored, parse_flag, True),
+            b"M*=": (self.set_all_monitored, parse_flag, False),
+            b"G?": (self.get_segment, None, True),
+            b"G*?": (self.get_all_segments, None, False),
+            b"L?": (self.get_segment_remaining, None, True),
+            b"L*?": (self.get_all_segment_remaining, None, False),
+        }
+
+    def after_update(self) -> None:
+        if not self._monitors or self._published is None:
+            return
+
+        temps = self.device.get_all_temps()
+        changed = temps != self._published
+        for client, monitored in list(self._monitors.items()):
+            if client.closed:
+                del self._monitors[client]
+                continue
+            channels = np.flatnonzero(changed & monitored)
+            if channels.size:
+                client.push(self._format_notifications(channels))
+        np.copyto(self._published, temps)
+
+    def _monitor(self, channels: slice, value: int) -> None:
+        client = CURRENT_CLIENT.get()
+        monitored = self._monitors.get(client)
+        if monitored is None:
+            monitored = np.zeros(self.device.num_ramp_controllers, dtype=bool)
+            self._monitors[client] = monitored
+        monitored[channels] = bool(value)
+
+        if self._published is None:
+            self._published = self.device.get_all_temps().copy()
+        if value:
+            # Send the current values rather than waiting for them to change
+            indices = np.arange(self.device.num_ramp_controllers)[channels]
+            client.push(self._format_notifications(indices))
+
+    def _format_notifications(self, channels: npt.NDArray) -> bytes:
+        values = self.device.get_all_temps()[channels]
+        return b"\r\n".join(
+            f"T{channel + 1:02d}={value}".encode("utf-8")
+            for channel, value in zip(channels.tolist(), self._format_values(values))
         )
 
     def _validate_index(self, index: str) -> int:
@@ -124,25 +925,52 @@ class TempControllerAdapter(ComposedAdapter):
         assert int_index >= 0, "TempController Indices start at 01"
         return int_index
 
+    def _format_column(self, values: npt.NDArray) -> bytes:
+        return ",".join(self._format_values(values)).encode("utf-8")
+
+    def _format_values(self, values: npt.NDArray) -> list[str]:
+        # As protocol.format_value, rounding every value at once
+        if np.issubdtype(values.dtype, np.floating):
+            return list(map(repr, np.round(values, PRECISION).tolist()))
+        return list(map(str, values.tolist()))
+
     @RegexCommand(r"T([0-9][0-9])\?", False, "utf-8")
     async def get_temperature(self, index: str) -> bytes:
         int_index = self._validate_index(index)
-        return str(self.device.get_temps(int_index)).encode("utf-8")
+        return format_value(self.device.get_temps(int_index)).encode("utf-8")
+
+    @RegexCommand(r"T\*\?", False, "utf-8")
+    async def get_all_temperatures(self) -> bytes:
+        return self._format_column(self.device.get_all_temps())
 
     @RegexCommand(r"N([0-9][0-9])\?", False, "utf-8")
     async def get_enabled(self, index: str) -> bytes:
         int_index = self._validate_index(index)
-        return str(self.device.get_enabled(int_index)).encode("utf-8")
+        return format_value(self.device.get_enabled(int_index)).encode("utf-8")
+
+    @RegexCommand(r"N\*\?", False, "utf-8")
+    async def get_all_enabled(self) -> bytes:
+        return self._format_column(self.device.get_all_enabled())
 
     @RegexCommand(r"N([0-9][0-9])=([01])", True, "utf-8")
     async def set_enabled(self, index: str, value: int) -> None:
         int_index = self._validate_index(index)
         self.device.set_enabled(int_index, value)
 
+    @RegexCommand(r"N\*=([01])", True, "utf-8")
+    async def set_all_enabled(self, value: int) -> None:
+        self.device.set_enabled_where(
+            np.ones(self.device.num_ramp_controllers, bool), value
+        )
+
     @RegexCommand(r"S([0-9][0-9])\?", False, "utf-8")
     async def get_start(self, index: str) -> bytes:
         int_index = self._validate_index(index)
-        return str(self.device.get_start(int_index)).encode("utf-8")
+        return format_value(self.device.get_start(int_index)).encode("utf-8")
+
+    @RegexCommand(r"S\*\?", False, "utf-8")
+    async def get_all_start(self) -> bytes:
+        return self._format_column(self.device.get_all_start())
 
     @RegexCommand(r"S([0-9][0-9])=(\d+\.?\d*)", True, "utf-8")
     async def set_start(self, index: str, value: str) -> None:
@@ -152,7 +980,11 @@ class TempControllerAdapter(ComposedAdapter):
     @RegexCommand(r"E([0-9][0-9])\?", False, "utf-8")
     async def get_end(self, index: str) -> bytes:
         int_index = self._validate_index(index)
-        return str(self.device.get_end(int_index)).encode("utf-8")
+        return format_value(self.device.get_end(int_index)).encode("utf-8")
+
+    @RegexCommand(r"E\*\?", False, "utf-8")
+    async def get_all_end(self) -> bytes:
+        return self._format_column(self.device.get_all_end())
 
     @RegexCommand(r"E([0-9][0-9])=(\d+\.?\d*)", True, "utf-8")
     async def set_end(self, index: str, value: str) -> None:
@@ -161,17 +993,187 @@ class TempControllerAdapter(ComposedAdapter):
 
     @RegexCommand(r"R\?", False, "utf-8")
     async def get_ramp_rate(self) -> bytes:
-        return str(self.device.get_ramp_rate()).encode("utf-8")
+        return format_value(self.device.get_ramp_rate()).encode("utf-8")
 
     @RegexCommand(r"R=(\d+\.?\d*)", True, "utf-8")
     async def set_ramp_rate(self, value: str) -> None:
         self.device.set_ramp_rate(float(value))
 
+    @RegexCommand(r"P([0-9][0-9])\?", False, "utf-8")
+    async def get_recipe(self, index: str) -> bytes:
+        int_index = self._validate_index(index)
+        segments = [
+            f"{start:g}:{end:g}:{dwell:g}"
+            for start, end, dwell in self.device.get_recipe(int_index).tolist()
+        ]
+        return (",".join(segments) or "-").encode("utf-8")
+
+    @RegexCommand(
+        r"P([0-9][0-9])=(-|\d+:\d+:\d+\.?\d*(?:,\d+:\d+:\d+\.?\d*)*)", True, "utf-8"
+    )
+    async def set_recipe(self, index: str, value: str) -> None:
+        int_index = self._validate_index(index)
+        segments = [] if value == "-" else value.split(",")
+        self.device.set_recipe(
+            int_index, [[float(part) for part in s.split(":")] for s in segments]
+        )
+
+    @RegexCommand(r"G([0-9][0-9])\?", False, "utf-8")
+    async def get_segment(self, index: str) -> bytes:
+        int_index = self._validate_index(index)
+        return format_value(self.device.get_segment(int_index)).encode("utf-8")
+
+    @RegexCommand(r"G\*\?", False, "utf-8")
+    async def get_all_segments(self) -> bytes:
+        return self._format_column(self.device.get_all_segments())
+
+    @RegexCommand(r"L([0-9][0-9])\?", False, "utf-8")
+    async def get_segment_remaining(self, index: str) -> bytes:
+        int_index = self._validate_index(index)
+        return format_value(self.device.get_segment_remaining(int_index)).encode(
+            "utf-8"
+        )
+
+    @RegexCommand(r"L\*\?", False, "utf-8")
+    async def get_all_segment_remaining(self) -> bytes:
+        return self._format_column(self.device.get_all_segment_remaining())
+
+    @RegexCommand(r"M([0-9][0-9])=([01])", False, "utf-8")
+    async def set_monitored(self, index: str, value: int) -> None:
+        int_index = self._validate_index(index)
+        self._monitor(slice(int_index, int_index + 1), value)
+
+    @RegexCommand(r"M\*=([01])", False, "utf-8")
+    async def set_all_monitored(self, value: int) -> None:
+        self._monitor(slice(None), value)
+
     @RegexCommand(r"\w*", False, "utf-8")
     async def ignore_whitespace(self) -> None:
         pass
 
 
+#: The names diagnostics record dispatch latencies by, e.g. "get_all_temperatures"
+OPCODE_NAMES = {opcode.value: opcode.name.lower() for opcode in Opcode}
+
+#: Opcodes which change the device state, so must interrupt the simulation
+SETTERS = {
+    Opcode.SET_ENABLED,
+    Opcode.SET_ALL_ENABLED,
+    Opcode.SET_START,
+    Opcode.SET_END,
+    Opcode.SET_RAMP_RATE,
+}
+
+
+class BinaryInterpreter(Interpreter):
+    """Handles a batch of binary request frames, replying to them in one write.
+
+    If the adapter has ``diagnostics``, the time taken to dispatch each frame is
+    recorded by the lower case name of its opcode, e.g. ``"get_all_temperatures"``.
+    """
+
+    async def handle(
+        self, adapter: Adapter, message: bytes
+    ) -> Tuple[AsyncIterable[bytes], bool]:
+        assert isinstance(adapter, TempControllerBinaryAdapter)
+        diagnostics = adapter.diagnostics
+        replies = bytearray()
+        interrupt = False
+        for opcode, _, channel, value in FRAME.iter_unpack(message):
+            try:
+                if diagnostics is None:
+                    replies += adapter.dispatch(opcode, channel, value)
+                else:
+                    with diagnostics.measure(OPCODE_NAMES.get(opcode, "unknown")):
+                        replies += adapter.dispatch(opcode, channel, value)
+            except (KeyError, ValueError, IndexError):
+                replies += FRAME.pack(opcode, Status.ERROR, channel, 0.0)
+            else:
+                interrupt |= opcode in SETTERS
+        return wrap_as_async_iterable(bytes(replies)), interrupt
+
+
+class TempControllerBinaryAdapter(ComposedAdapter):
+    """Serves the binary protocol of `demo_fast_cs.protocol`."""
+
+    device: TempControllerDevice
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 25566,
+        max_clients: Optional[int] = None,
+        diagnostics: bool = False,
+    ) -> None:
+        #: Dispatch latencies, by opcode name
+        self.diagnostics = Diagnostics() if diagnostics else None
+        super().__init__(
+            BinaryFrameServer(host, port, max_clients), BinaryInterpreter()
+        )
+
+    def dispatch(self, opcode: int, channel: int, value: float) -> bytes:
+        """Apply a request to the device and return the reply to it.
+
+        Raises:
+            KeyError: If the opcode is unknown.
+            ValueError: If the channel or value is invalid for the opcode.
+        """
+        device = self.device
+        match Opcode(opcode):
+            case Opcode.GET_TEMPERATURE:
+                value = device.get_temps(self._index(channel))
+            case Opcode.GET_ENABLED:
+                value = device.get_enabled(self._index(channel))
+            case Opcode.SET_ENABLED:
+                if value not in (0, 1):
+                    raise ValueError(f"Invalid enabled value {value}")
+                device.set_enabled(self._index(channel), int(value))
+            case Opcode.SET_ALL_ENABLED:
+                if value not in (0, 1):
+                    raise ValueError(f"Invalid enabled value {value}")
+                mask = np.ones(device.num_ramp_controllers, dtype=bool)
+                device.set_enabled_where(mask, int(value))
+            case Opcode.GET_START:
+                value = device.get_start(self._index(channel))
+            case Opcode.SET_START:
+                device.set_start(self._index(channel), int(value))
+            case Opcode.GET_END:
+                value = device.get_end(self._index(channel))
+            case Opcode.SET_END:
+                device.set_end(self._index(channel), int(value))
+            case Opcode.GET_RAMP_RATE:
+                value = device.get_ramp_rate()
+            case Opcode.SET_RAMP_RATE:
+                device.set_ramp_rate(value)
+            case Opcode.GET_ALL_TEMPERATURES:
+                return self._column(opcode, device.get_all_temps())
+            case Opcode.GET_ALL_ENABLED:
+                return self._column(opcode, device.get_all_enabled())
+            case Opcode.GET_ALL_START:
+                return self._column(opcode, device.get_all_start())
+            case Opcode.GET_ALL_END:
+                return self._column(opcode, device.get_all_end())
+            case Opcode.GET_SEGMENT:
+                value = device.get_segment(self._index(channel))
+            case Opcode.GET_SEGMENT_REMAINING:
+                value = device.get_segment_remaining(self._index(channel))
+            case Opcode.GET_ALL_SEGMENTS:
+                return self._column(opcode, device.get_all_segments())
+            case Opcode.GET_ALL_SEGMENT_REMAINING:
+                return self._column(opcode, device.get_all_segment_remaining())
+        return FRAME.pack(opcode, Status.OK, channel, value)
+
+    def _index(self, channel: int) -> int:
+        if not 1 <= channel <= self.device.num_ramp_controllers:
+            raise ValueError(f"Invalid channel {channel}")
+        return channel - 1
+
+    def _column(self, opcode: int, values: npt.NDArray) -> bytes:
+        payload = values.astype(f"<{COLUMN_FORMATS[Opcode(opcode)]}", copy=False)
+        header = FRAME.pack(opcode, Status.OK, 0, len(values))
+        return header + payload.tobytes()
+
+
 @dataclass
 class TempController(ComponentConfig):
     num_ramp_controllers: int
@@ -179,14 +1181,54 @@ class TempController(ComponentConfig):
     default_end: float = 50
     host: str = "localhost"
     port: int = 25565
+    fast_path: bool = True
+    diagnostics: bool = False
+    #: If set, also serve the binary protocol on this port
+    binary_port: Optional[int] = None
+    #: How many times faster than the simulation clock channels ramp
+    time_scale: float = 1.0
+    #: Seconds between updates while ramping, or None to only update when a channel
+    #: reaches its end
+    tick_period: Optional[float] = 0.1
+    #: Advance simulation time straight to the next update rather than waiting for
+    #: it, when run with `LocalSimulation`
+    jump_to_events: bool = False
+    #: Seconds to stall before handling each ASCII message, and the fraction of
+    #: replies to drop, to test how clients cope with an unreliable device
+    fault_delay: float = 0.0
+    fault_drop_rate: float = 0.0
+    #: The most clients each adapter accepts at once, or None for no limit
+    max_clients: Optional[int] = None
 
     def __call__(self) -> Component:
+        adapters: list[Adapter] = [
+            TempControllerAdapter(
+                host=self.host,
+                port=self.port,
+                fast_path=self.fast_path,
+                diagnostics=self.diagnostics,
+                fault_delay=self.fault_delay,
+                fault_drop_rate=self.fault_drop_rate,
+                max_clients=self.max_clients,
+            )
+        ]
+        if self.binary_port is not None:
+            adapters.append(
+                TempControllerBinaryAdapter(
+                    self.host, self.binary_port, self.max_clients, self.diagnostics
+                )
+            )
+
         return DeviceSimulation(
             name=self.name,
             device=TempControllerDevice(
                 num_ramp_controllers=self.num_ramp_controllers,
                 default_start=self.default_start,
                 default_end=self.default_end,
+                time_scale=self.time_scale,
+                tick_period=(
+                    None if self.tick_period is None else int(self.tick_period * 1e9)
+                ),
             ),
-            adapters=[TempControllerAdapter(host=self.host, port=self.port)],
+            adapters=adapters,
         )
@@ -0,0 +1,191 @@
+"""Run many independent simulated temperature controllers across processes.
+
+Run with e.g.::
+
+    $ python -m demo_fast_cs.simulation.farm --devices 200 --base-port 30000
+
+Each device is a `LocalSimulation` listening on its own port, counting up from the
+base port, and devices are spread across a pool of processes which each run theirs in
+one event loop. Every simulation measures time from the same start time, so they share
+a clock. A summary of every device is served as JSON to anything that connects to the
+stats port.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+from argparse import ArgumentParser
+from asyncio.streams import StreamReader, StreamWriter
+from dataclasses import replace
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from time import time_ns
+from typing import Optional
+
+from demo_fast_cs.simulation.device import TempController
+from demo_fast_cs.simulation.runner import LocalSimulation
+
+
+class SimulatorFarm:
+    """Runs ``num_devices`` copies of a `TempController` simulation config.
+
+    The copies are named after the template with a suffix of their index, and listen
+    on the template's ports plus their index, or ports picked by the OS if those are 0.
+    """
+
+    def __init__(
+        self,
+        template: TempController,
+        num_devices: int,
+        num_processes: Optional[int] = None,
+        stats_port: int = 0,
+        stats_period: float = 1.0,
+    ) -> None:
+        self.template = template
+        self.num_devices = num_devices
+        self.num_processes = min(num_processes or os.cpu_count() or 1, num_devices)
+        self.stats_port = stats_port
+        self.stats_period = stats_period
+        #: The latest stats of each device, by name
+        self.stats: dict[str, dict] = {}
+
+    def configs(self) -> list[TempController]:
+        return [self.config(index) for index in range(self.num_devices)]
+
+    def config(self, index: int) -> TempController:
+        port, binary_port = self.template.port, self.template.binary_port
+        return replace(  # type: ignore[call-arg]
+            self.template,
+            name=f"{self.template.name}{index:03d}",
+            port=port + index if port else port,
+            binary_port=binary_port + index if binary_port else binary_port,
+        )
+
+    def summary(self) -> dict:
+        devices = sorted(self.stats.values(), key=lambda stats: stats["name"])
+        return {
+            "devices": devices,
+            "totals": {
+                "devices": len(devices),
+                "ticks": sum(device["ticks"] for device in devices),
+                "enabled": sum(device["enabled"] for device in devices),
+                "clients": sum(device["clients"] for device in devices),
+                "rejected_clients": sum(
+                    device["rejected_clients"] for device in devices
+                ),
+                "dropped_clients": sum(device["dropped_clients"] for device in devices),
+                "commands": sum(
+                    command["count"]
+                    for device in devices
+                    for command in device["commands"].values()
+                ),
+            },
+        }
+
+    async def run_forever(self) -> None:
+        """Start the worker processes and serve their stats until cancelled."""
+        context = multiprocessing.get_context("spawn")
+        stats: Queue[list[dict]] = context.Queue()
+        configs = self.configs()
+        start_time = time_ns()
+        processes: list[BaseProcess] = [
+            context.Process(
+                target=run_worker,
+                args=(configs[shard :: self.num_processes], start_time, stats),
+                kwargs={"stats_period": self.stats_period},
+                daemon=True,
+            )
+            for shard in range(self.num_processes)
+        ]
+        for process in processes:
+            process.start()
+
+        server = await asyncio.start_server(
+            self._send_stats, self.template.host, self.stats_port
+        )
+        self.stats_port = server.sockets[0].getsockname()[1]
+        try:
+            async with server:
+                while True:
+                    self._collect(stats)
+                    await asyncio.sleep(0.1)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+            stats.close()
+
+    def _collect(self, stats: Queue[list[dict]]) -> None:
+        # Polled rather than waited on in a thread, which could not be cancelled
+        while True:
+            try:
+                update = stats.get_nowait()
+            except queue.Empty:
+                return
+            self.stats.update((device["name"], device) for device in update)
+
+    async def _send_stats(self, reader: StreamReader, writer: StreamWriter) -> None:
+        writer.write(json.dumps(self.summary()).encode("utf-8") + b"\n")
+        await writer.drain()
+        writer.close()
+
+
+def run_worker(
+    configs: list[TempController],
+    start_time: int,
+    stats: Queue[list[dict]],
+    stats_period: float = 1.0,
+) -> None:
+    """Run the simulations of one process of a `SimulatorFarm`."""
+    asyncio.run(_serve(configs, start_time, stats, stats_period))
+
+
+async def _serve(
+    configs: list[TempController],
+    start_time: int,
+    stats: Queue[list[dict]],
+    stats_period: float,
+) -> None:
+    simulations = [LocalSimulation(config, start_time) for config in configs]
+    await asyncio.gather(*[simulation.start() for simulation in simulations])
+    try:
+        while True:
+            stats.put([simulation.stats() for simulation in simulations])
+            await asyncio.sleep(stats_period)
+    finally:
+        await asyncio.gather(*[simulation.stop() for simulation in simulations])
+
+
+def main(args=None) -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--processes", type=int, help="Defaults to the CPU count")
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--base-port", type=int, default=25565)
+    parser.add_argument("--binary-base-port", type=int)
+    parser.add_argument("--stats-port", type=int, default=25564)
+    parsed = parser.parse_args(args)
+
+    template = TempController(
+        name="tempcont",
+        inputs={},
+        num_ramp_controllers=parsed.channels,
+        host=parsed.host,
+        port=parsed.base_port,
+        binary_port=parsed.binary_base_port,
+    )
+    farm = SimulatorFarm(template, parsed.devices, parsed.processes, parsed.stats_port)
+    try:
+        asyncio.run(farm.run_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import asyncio
+from collections import Counter, defaultdict, deque
+from time import perf_counter_ns, time_ns
+from typing import Optional
+
+from tickit.core.components.device_simulation import DeviceSimulation
+from tickit.core.typedefs import SimTime
+
+from demo_fast_cs.diagnostics import LatencyHistogram
+from demo_fast_cs.simulation.device import (
+    TempController,
+    TempControllerBinaryAdapter,
+    TempControllerDevice,
+)
+
+
+class LocalSimulation:
+    """Runs a `TempController` component in the current event loop.
+
+    This stands in for the tickit scheduler when only a single component is needed,
+    e.g. for tests and benchmarks. The device is ticked when an adapter raises an
+    interrupt and at the times it requests, with simulation time following the wall
+    clock, and the cost of the most recent ticks is recorded in `tick_costs`.
+
+    Simulation time is measured from ``start_time``, in ns since the epoch, so that
+    simulations can share a clock. By default it is the time `start` is called. If the
+    config has ``jump_to_events`` set, time instead stands still while the device is
+    idle and jumps straight to each update it requests, once any requests already
+    received have been handled.
+    """
+
+    def __init__(
+        self, config: TempController, start_time: Optional[int] = None
+    ) -> None:
+        component = config()
+        assert isinstance(component, DeviceSimulation)
+        self.component = component
+        #: Time in ns taken by recent calls to the device's update method
+        self.tick_costs: deque[int] = deque(maxlen=100_000)
+        #: The number of times the device has been updated
+        self.ticks = 0
+        self.jump_to_events = config.jump_to_events
+
+        self._inputs = {"flux": 0.0}
+        self._interrupt = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._start_time = start_time
+        self._jumped_time = 0
+
+    @property
+    def device(self) -> TempControllerDevice:
+        return self.component.device  # type: ignore
+
+    @property
+    def port(self) -> int:
+        """The port the simulation's TCP server is listening on."""
+        return self.component.adapters[0].server.port  # type: ignore
+
+    @property
+    def binary_port(self) -> int:
+        """The port the simulation serves the binary protocol on."""
+        for adapter in self.component.adapters:
+            if isinstance(adapter, TempControllerBinaryAdapter):
+                return adapter.server.port  # type: ignore
+        raise ValueError("Simulation is not configured with a binary_port")
+
+    @property
+    def time(self) -> SimTime:
+        if self.jump_to_events:
+            return SimTime(self._jumped_time)
+        assert self._start_time is not None, "Simulation has not been started"
+        return SimTime(time_ns() - self._start_time)
+
+    def stats(self) -> dict:
+        """Summarise the activity of the simulation."""
+        costs = self.tick_costs
+        servers = [adapter.server for adapter in self.component.adapters]
+        return {
+            "name": self.component.name,
+            "port": self.port,
+            "ticks": self.ticks,
+            "tick_mean_us": sum(costs) / len(costs) / 1e3 if costs else 0.0,
+            "tick_max_us": max(costs) / 1e3 if costs else 0.0,
+            "enabled": self.device.num_enabled,
+            "clients": sum(server.num_clients for server in servers),
+            "rejected_clients": sum(server.rejected for server in servers),
+            "dropped_clients": sum(server.dropped for server in servers),
+            "connections": [
+                client for server in servers for client in server.client_stats()
+            ],
+            "commands": self.command_stats(),
+        }
+
+    def command_stats(self) -> dict[str, dict]:
+        """Summarise the latencies of each command, if the adapters record them."""
+        latencies: dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        errors: Counter[str] = Counter()
+        for adapter in self.component.adapters:
+            diagnostics = getattr(adapter, "diagnostics", None)
+            if diagnostics is None:
+                continue
+            for name, histogram in diagnostics.latencies.items():
+                latencies[name].merge(histogram)
+            errors.update(diagnostics.errors)
+        return {
+            name: {
+                "count": latencies[name].total,
+                "errors": errors[name],
+                "p50_us": latencies[name].percentile(50) * 1e6,
+                "p99_us": latencies[name].percentile(99) * 1e6,
+            }
+            for name in sorted(latencies.keys() | errors.keys())
+        }
+
+    async def start(self) -> None:
+        """Start the adapters and ticking, returning once the adapters are listening."""
+        if self._start_time is None:
+            self._start_time = time_ns()
+        self._tasks = [
+            asyncio.create_task(adapter.run_forever(self.device, self._raise_interrupt))
+            for adapter in self.component.adapters
+        ]
+        self._tasks.append(asyncio.create_task(self._tick_forever()))
+        while not all(
+            adapter.server.listening  # type: ignore[attr-defined]
+            for adapter in self.component.adapters
+        ):
+            for task in self._tasks:
+                if task.done():
+                    # An adapter failed to start, e.g. as its port is in use
+                    task.result()
+            await asyncio.sleep(0.01)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.wait(self._tasks)
+        self._tasks = []
+
+    async def run_forever(self) -> None:
+        await self.start()
+        try:
+            await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            await self.stop()
+
+    async def _raise_interrupt(self) -> None:
+        self._interrupt.set()
+
+    async def _tick_forever(self) -> None:
+        call_at = self._tick()
+        while True:
+            if self.jump_to_events and call_at is not None:
+                # Let requests which have already arrived be handled first
+                await asyncio.sleep(0)
+                if not self._interrupt.is_set():
+                    self._jumped_time = max(call_at, self._jumped_time)
+            else:
+                timeout = None if call_at is None else max(call_at - self.time, 0) / 1e9
+                try:
+                    await asyncio.wait_for(self._interrupt.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self._interrupt.clear()
+            call_at = self._tick()
+
+    def _tick(self) -> Optional[SimTime]:
+        start = perf_counter_ns()
+        update = self.device.update(self.time, self._inputs)  # type: ignore
+        self.tick_costs.append(perf_counter_ns() - start)
+        self.ticks += 1
+        for adapter in self.component.adapters:
+            adapter.after_update()
+        return update.call_at
@@ -0,0 +1,272 @@
+"""Polling of ramp attribute columns in worker processes.
+
+A `ColumnPoller` polls the column queries of ramp attributes, e.g. ``T*?``, from a pool
+of processes which each have their own connections, so that the I/O and decoding of
+thousands of channels is spread over as many cores. Each (device, column) is polled
+by one worker, which writes the decoded values into a NumPy array in shared memory.
+
+Columns are only polled when the event loop of the controllers requests them, so
+their handlers still decide what is polled and when, e.g. backing off unchanging
+attributes and shedding all but essential ones while a device is degraded. The
+workers do not record a `demo_fast_cs.capture.TrafficCapture` of their requests.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import time
+from dataclasses import dataclass
+from multiprocessing.process import BaseProcess
+from multiprocessing.shared_memory import SharedMemory
+from typing import TYPE_CHECKING, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from demo_fast_cs.connections import (
+    CONNECTION_ERRORS,
+    BinaryIPConnection,
+    IPConnectionPool,
+    PipelinedIPConnection,
+)
+from demo_fast_cs.protocol import AsciiProtocol, BinaryProtocol, BinaryProtocolError
+
+if TYPE_CHECKING:
+    from demo_fast_cs.controllers import TempControllerSettings
+
+#: How many times `ColumnPoller.column` tries to read a column between writes
+READ_ATTEMPTS = 1000
+
+#: Rows of `Layout` ``times``: when each column was last polled, requested, and failed
+#: to be polled
+POLLED, REQUESTED, FAILED = range(3)
+
+#: Errors which fail a poll of a worker, rather than ending it
+POLL_ERRORS = CONNECTION_ERRORS + (
+    asyncio.TimeoutError,
+    BinaryProtocolError,
+    ValueError,
+)
+
+
+@dataclass(frozen=True)
+class Layout:
+    """Where the columns of each device are in the shared memory of a `ColumnPoller`.
+
+    ``values`` holds a row of every channel of every device for each name, with the
+    channels of each device starting from its offset. ``generations`` holds a row of
+    every device for each name, of how many times the values have been written, and
+    ``times`` holds one for each of `POLLED`, `REQUESTED` and `FAILED`, of the
+    `time.monotonic` of each.
+    """
+
+    names: tuple[str, ...]
+    offsets: tuple[int, ...]
+    num_channels: int
+    values: str
+    generations: str
+    times: str
+
+    def arrays(
+        self, values: SharedMemory, generations: SharedMemory, times: SharedMemory
+    ) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+        num_devices = len(self.offsets) - 1
+        return (
+            np.ndarray(
+                (len(self.names), self.num_channels), np.float64, buffer=values.buf
+            ),
+            np.ndarray(
+                (len(self.names), num_devices), np.int64, buffer=generations.buf
+            ),
+            np.ndarray((3, len(self.names), num_devices), np.float64, buffer=times.buf),
+        )
+
+
+class ColumnPoller:
+    """Polls the columns ``names`` of every device from ``num_workers`` processes.
+
+    Every ``interval`` s, each worker sends the column queries which have been
+    requested by `column` of the (device, name) pairs it has been dealt, over its own
+    connections to each device, and writes the decoded replies to shared memory. Writes
+    are guarded by a sequence lock, so `column` never returns a mix of two replies,
+    without any locking between processes.
+    """
+
+    def __init__(
+        self,
+        devices: Sequence[TempControllerSettings],
+        names: Sequence[str],
+        num_workers: int,
+        interval: float = 0.01,
+    ) -> None:
+        assert num_workers > 0, "ColumnPoller needs at least one worker"
+        self.devices = list(devices)
+        self.names = tuple(names)
+        self.num_workers = num_workers
+        self.interval = interval
+        #: Seconds to wait for a requested column, which covers every retry of a query
+        self.timeout = interval + max(
+            (device.timeout or 1.0) * (device.retries + 1) for device in devices
+        )
+
+        offsets = np.cumsum([0] + [d.num_ramp_controllers for d in devices]).tolist()
+        self._offsets: tuple[int, ...] = tuple(offsets)
+        self._rows = {name: row for row, name in enumerate(self.names)}
+        self._memory: list[SharedMemory] = []
+        self._processes: list[BaseProcess] = []
+
+    def start(self) -> None:
+        """Allocate the shared memory and start the worker processes."""
+        num_devices = len(self.devices)
+        num_rows = len(self.names)
+        self._memory = [
+            SharedMemory(create=True, size=max(size, 1) * 8)
+            for size in (
+                num_rows * self._offsets[-1],
+                num_rows * num_devices,
+                3 * num_rows * num_devices,
+            )
+        ]
+        layout = Layout(self.names, self._offsets, self._offsets[-1], *self._names())
+        values, self._generations, self._times = layout.arrays(*self._memory)
+        values[:] = np.nan
+        self._generations[:] = 0
+        self._times[:] = 0.0
+        self._values = values
+
+        units = [
+            (device, name) for device in range(num_devices) for name in range(num_rows)
+        ]
+        context = multiprocessing.get_context("spawn")
+        self._processes = [
+            context.Process(
+                target=run_worker,
+                args=(self.devices, units[shard :: self.num_workers], layout),
+                kwargs={"interval": self.interval},
+                daemon=True,
+            )
+            for shard in range(min(self.num_workers, len(units)))
+        ]
+        for process in self._processes:
+            process.start()
+
+    async def column(self, device: int, name: str) -> list[float]:
+        """Request a poll of a column of a device, and return its values.
+
+        Only one request of each column should be awaited at a time.
+
+        Raises:
+            ConnectionError: If the worker failed to poll the column.
+            asyncio.TimeoutError: If the column has not been polled within `timeout`,
+                or could not be read between writes in `READ_ATTEMPTS` attempts.
+        """
+        row = self._rows[name]
+        requested = time.monotonic()
+        self._times[REQUESTED, row, device] = requested
+        deadline = requested + self.timeout
+        # Polls which started before the request may not reflect it
+        while self._times[POLLED, row, device] < requested:
+            if self._times[FAILED, row, device] >= requested:
+                raise ConnectionError(f"Column {name} of device {device} failed")
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError(
+                    f"Column {name} of device {device} was not polled"
+                )
+            await asyncio.sleep(self.interval)
+
+        start, end = self._offsets[device], self._offsets[device + 1]
+        for _ in range(READ_ATTEMPTS):
+            generation = self._generations[row, device]
+            values = self._values[row, start:end].tolist()
+            # An odd generation is being written, and a new one was written meanwhile
+            if generation % 2 == 0 and generation == self._generations[row, device]:
+                return values
+        # e.g. a worker which was terminated while writing the column
+        raise asyncio.TimeoutError(f"Column {name} of device {device} is being written")
+
+    def stop(self) -> None:
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        for memory in self._memory:
+            memory.close()
+            memory.unlink()
+        self._memory = []
+
+    def _names(self) -> list[str]:
+        return [memory.name for memory in self._memory]
+
+
+def run_worker(
+    devices: list[TempControllerSettings],
+    units: list[tuple[int, int]],
+    layout: Layout,
+    interval: float = 0.01,
+) -> None:
+    """Poll the (device, name) ``units`` of a `ColumnPoller` until terminated."""
+    asyncio.run(_poll_forever(devices, units, layout, interval))
+
+
+async def _poll_forever(
+    devices: list[TempControllerSettings],
+    units: list[tuple[int, int]],
+    layout: Layout,
+    interval: float,
+) -> None:
+    memory = [
+        SharedMemory(name) for name in (layout.values, layout.generations, layout.times)
+    ]
+    values, generations, times = layout.arrays(*memory)
+
+    connections: dict[int, IPConnectionPool] = {}
+    protocols: dict[int, AsciiProtocol | BinaryProtocol] = {}
+    for device in sorted({device for device, _ in units}):
+        settings = devices[device]
+        factory = BinaryIPConnection if settings.binary else PipelinedIPConnection
+        conn = IPConnectionPool(1, factory, settings.timeout, settings.retries)
+        try:
+            await conn.connect(settings.ip_settings)
+        except CONNECTION_ERRORS:
+            conn.reconnect()
+        connections[device] = conn
+        protocols[device] = BinaryProtocol() if settings.binary else AsciiProtocol()
+
+    async def poll(device: int, row: int) -> None:
+        started = time.monotonic()
+        protocol = protocols[device]
+        start, end = layout.offsets[device], layout.offsets[device + 1]
+        try:
+            response = await connections[device].send_query(
+                protocol.column_query(layout.names[row])
+            )
+            column = np.asarray(protocol.parse_column(response), dtype=np.float64)
+            if len(column) != end - start:
+                raise ValueError(f"Expected {end - start} values, not {len(column)}")
+        except POLL_ERRORS:
+            times[FAILED, row, device] = started
+            return
+        finally:
+            polling.discard((device, row))
+        generations[row, device] += 1
+        values[row, start:end] = column
+        generations[row, device] += 1
+        times[POLLED, row, device] = started
+
+    # The request each unit was last polled for, so that a failed poll is only
+    # retried once it is requested again
+    served = {unit: 0.0 for unit in units}
+    polling: set[tuple[int, int]] = set()
+    tasks: set[asyncio.Task[None]] = set()
+    while True:
+        for device, row in units:
+            requested = times[REQUESTED, row, device]
+            if requested > served[device, row] and (device, row) not in polling:
+                served[device, row] = requested
+                polling.add((device, row))
+                task = asyncio.create_task(poll(device, row))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        await asyncio.sleep(interval)
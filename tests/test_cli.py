@@ -1,9 +1,89 @@
 import subprocess
 import sys
+from argparse import ArgumentParser
+
+import pytest
+from fastcs.connections import IPConnectionSettings
 
 from demo_fast_cs import __version__
+from demo_fast_cs.__main__ import (
+    add_controller_arguments,
+    add_simulation_arguments,
+    controller_settings,
+    simulation_config,
+)
+from demo_fast_cs.controllers import (
+    TempController,
+    TempControllerHandler,
+    TempControllerSettings,
+    TempRampController,
+    poll_handlers,
+    set_poll_period,
+)
 
 
 def test_cli_version():
     cmd = [sys.executable, "-m", "demo_fast_cs", "--version"]
     assert subprocess.check_output(cmd).decode().strip() == __version__
+
+
+def test_controller_settings_from_arguments():
+    parser = ArgumentParser()
+    add_controller_arguments(parser)
+    parsed = parser.parse_args(
+        "--channels 64 --host 10.0.0.1 --port 4000 --connections 4 --binary".split()
+    )
+
+    settings = controller_settings(parsed)
+    assert settings.num_ramp_controllers == 64
+    assert settings.ip_settings == IPConnectionSettings("10.0.0.1", 4000)
+    assert settings.num_connections == 4
+    assert settings.binary and settings.pipelined
+    assert not (settings.push or settings.diagnostics)
+
+
+def test_simulation_config_from_arguments():
+    parser = ArgumentParser()
+    add_simulation_arguments(parser)
+    parsed = parser.parse_args("--channels 8 --binary-port 0 --tick-period 0".split())
+
+    config = simulation_config(parsed)
+    assert config.num_ramp_controllers == 8
+    assert config.binary_port == 0
+    assert config.tick_period is None
+    assert not config.jump_to_events
+
+    parsed = parser.parse_args(["--jump-to-events"])
+    assert simulation_config(parsed).jump_to_events
+
+
+def test_set_poll_period():
+    handlers = poll_handlers()
+    defaults = [handler.update_period for handler in handlers]
+    current = TempRampController.current.updater
+    recipe = TempRampController.recipe.updater
+    assert isinstance(current, TempControllerHandler)
+    assert isinstance(recipe, TempControllerHandler)
+    controller = TempController(TempControllerSettings(1, IPConnectionSettings()))
+    ramp = controller.get_sub_controllers()[0]
+    schedule = current._schedule(ramp.current)
+    schedule.polled(0.0, changed=False)
+    try:
+        set_poll_period(0.05)
+        assert current.update_period == 0.05
+        assert TempController.ramp_rate.updater.update_period == 0.05
+        # Slower handlers keep their period relative to the fastest
+        assert recipe.update_period == 0.25
+        # Schedules of attributes already polled take the new period at once
+        assert schedule.min_period == 0.05 and schedule.due(0.0)
+
+        with pytest.raises(ValueError, match="maximum period"):
+            set_poll_period(2.0)
+        with pytest.raises(ValueError, match="positive"):
+            set_poll_period(0)
+        assert current.update_period == 0.05
+    finally:
+        # Each handler has its own default, so restore them one by one
+        for handler, default in zip(handlers, defaults):
+            handler.update_period = default
+        current._schedules.pop(ramp.current)
@@ -0,0 +1,567 @@
+import asyncio
+import socket
+from typing import Any, Callable
+
+import pytest
+from fastcs.backend import _get_scan_tasks
+from fastcs.connections import DisconnectedError, IPConnectionSettings
+
+from demo_fast_cs.capture import CaptureReader, Kind, Record, Replay, TrafficCapture
+from demo_fast_cs.connections import (
+    BinaryIPConnection,
+    IPConnectionPool,
+    PipelinedIPConnection,
+    PooledConnection,
+    RejectedRequestError,
+)
+from demo_fast_cs.controllers import TempController, TempControllerSettings
+from demo_fast_cs.mapping import TempControllerMapping
+from demo_fast_cs.protocol import BinaryProtocol, BinaryProtocolError, Response
+from demo_fast_cs.simulation.device import TempController as TempControllerSim
+from demo_fast_cs.simulation.runner import LocalSimulation
+
+
+def unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until(condition: Callable[[], bool], timeout: float = 10.0) -> None:
+    """Wait for a condition, failing rather than hanging if it never holds."""
+
+    async def poll() -> None:
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def start_simulation(num_ramp_controllers: int) -> LocalSimulation:
+    config = TempControllerSim(
+        name="tempcont",
+        inputs={},
+        num_ramp_controllers=num_ramp_controllers,
+        default_start=10,
+        port=0,
+        binary_port=0,
+    )
+    simulation = LocalSimulation(config)
+    await simulation.start()
+    return simulation
+
+
+def test_pipelined_queries_are_matched_in_order():
+    async def run() -> list[str]:
+        simulation = await start_simulation(99)
+        conn = PipelinedIPConnection()
+        await conn.connect(IPConnectionSettings("127.0.0.1", simulation.port))
+        for index in range(1, 100):
+            await conn.send_command(f"S{index:02d}={index}\r\n")
+        responses = await asyncio.gather(
+            *[conn.send_query(f"S{index:02d}?\r\n") for index in range(1, 100)]
+        )
+        await conn.close()
+        await simulation.stop()
+        return responses
+
+    responses = asyncio.run(run())
+
+    assert [int(response) for response in responses] == list(range(1, 100))
+
+
+def test_rejected_commands_fail_the_connection_rather_than_misalign_replies():
+    async def run() -> tuple[bool, list[Response]]:
+        simulation = await start_simulation(2)
+        conn = PipelinedIPConnection()
+        await conn.connect(IPConnectionSettings("127.0.0.1", simulation.port))
+        # The device replies to a command it rejects, which no query is waiting for
+        await conn.send_command("S01=-5\r\n")
+        with pytest.raises(RejectedRequestError):
+            await asyncio.wait_for(conn.send_query("S02?\r\n"), 10.0)
+        connected = conn.connected
+        await conn.close()
+
+        # A member of a pool reconnects, and later replies are matched again
+        pool = IPConnectionPool(1)
+        await pool.connect(IPConnectionSettings("127.0.0.1", simulation.port))
+        member = pool.shard(0)
+        await member.send_command("S01=-5\r\n")
+        with pytest.raises(DisconnectedError):
+            await asyncio.wait_for(member.send_query("S02?\r\n"), 10.0)
+        await wait_until(lambda: member.healthy)
+        responses = [await member.send_query(f"{name}?\r\n") for name in ("S02", "R")]
+        await pool.close()
+        await simulation.stop()
+        return connected, responses
+
+    connected, responses = asyncio.run(run())
+
+    assert not connected
+    assert responses == ["10\r\n", "1\r\n"]
+
+
+def test_pool_shards_channels_and_reconnects_members():
+    async def run() -> tuple[list[Response], bool, list[bool]]:
+        simulation = await start_simulation(8)
+        pool = IPConnectionPool(4)
+        await pool.connect(IPConnectionSettings("127.0.0.1", simulation.port))
+        responses = await asyncio.gather(
+            *[
+                pool.shard(index).send_query(f"S{index + 1:02d}?\r\n")
+                for index in range(8)
+            ]
+        )
+
+        # Drop one member's socket, as if the device had hung up on it
+        member = pool.shard(1)
+        member._conn._writer.close()
+        with pytest.raises(DisconnectedError):
+            await member.send_query("R?\r\n")
+        failed = member.healthy
+        while not member.healthy:
+            await asyncio.sleep(0.01)
+        health = await pool.check_health("R?\r\n", timeout=1.0)
+
+        await pool.close()
+        await simulation.stop()
+        return responses, failed, health
+
+    responses, failed, health = asyncio.run(run())
+
+    assert [int(response) for response in responses] == [10] * 8
+    assert not failed
+    assert health == [True] * 4
+
+
+def test_binary_protocol_batches_and_errors():
+    protocol = BinaryProtocol()
+
+    async def run() -> list[Response]:
+        simulation = await start_simulation(3)
+        conn = BinaryIPConnection()
+        await conn.connect(IPConnectionSettings("127.0.0.1", simulation.binary_port))
+        await conn.send_command(protocol.command("S", 2, 20))
+        responses = await conn.send_batch(
+            [protocol.query("S", 2), protocol.column_query("S"), protocol.query("R", 0)]
+        )
+        with pytest.raises(BinaryProtocolError):
+            await conn.send_query(protocol.query("T", 4))
+
+        await conn.close()
+        await simulation.stop()
+        return responses
+
+    start, starts, ramp_rate = asyncio.run(run())
+
+    assert start == 20.0
+    assert isinstance(starts, memoryview)
+    assert starts.tolist() == [10, 20, 10]
+    assert ramp_rate == 1.0
+
+
+def test_controller_over_binary_protocol():
+    async def run() -> tuple[int, list[float]]:
+        simulation = await start_simulation(2)
+        settings = TempControllerSettings(
+            2, IPConnectionSettings("127.0.0.1", simulation.binary_port), binary=True
+        )
+        controller = TempController(settings)
+        await controller.connect()
+        ramps = controller.get_sub_controllers()
+        await ramps[1].end.sender.put(ramps[1], ramps[1].end, 30)
+        await ramps[0].enabled.sender.put(ramps[0], ramps[0].enabled, True)
+        for ramp in ramps:
+            await ramp.current.updater.update(ramp, ramp.current)
+
+        await controller.close()
+        await simulation.stop()
+        return ramps[1].end.get(), [ramp.current.get() for ramp in ramps]
+
+    end, currents = asyncio.run(run())
+
+    assert end == 30
+    assert currents == [10.0, 0.0]
+
+
+def test_controller_receives_pushed_temperatures():
+    async def run() -> tuple[bool, list[float], list[str]]:
+        simulation = await start_simulation(2)
+        settings = TempControllerSettings(
+            2, IPConnectionSettings("127.0.0.1", simulation.port), push=True
+        )
+        controller = TempController(settings)
+        await controller.connect()
+        ramp = controller.get_sub_controllers()[1]
+        pushed: list[float] = []
+
+        async def record(value: float) -> None:
+            pushed.append(value)
+
+        ramp.current.set_update_callback(record)
+        await ramp.enabled.sender.put(ramp, ramp.enabled, True)
+        while not pushed or pushed[-1] <= 10.0:
+            await asyncio.sleep(0.01)
+        subscribed = controller.subscribed()
+
+        # Pushed attributes are not polled while subscribed
+        queries: list[str] = []
+
+        async def send_query(message: str) -> str:
+            queries.append(message)
+            return ""
+
+        controller.conn.send_query = send_query  # type: ignore
+        await ramp.current.updater.update(ramp, ramp.current)
+
+        await controller.close()
+        await simulation.stop()
+        return subscribed, pushed, queries
+
+    subscribed, pushed, queries = asyncio.run(run())
+
+    assert subscribed
+    assert 10.0 in pushed
+    assert pushed[-1] > 10.0
+    assert queries == []
+
+
+def test_simulation_jumps_to_the_end_of_ramps():
+    async def run() -> str:
+        config = TempControllerSim(
+            name="tempcont",
+            inputs={},
+            num_ramp_controllers=1,
+            port=0,
+            jump_to_events=True,
+        )
+        simulation = LocalSimulation(config)
+        await simulation.start()
+        conn = PipelinedIPConnection()
+        await conn.connect(IPConnectionSettings("127.0.0.1", simulation.port))
+
+        async def wait_until_ramped() -> None:
+            while await conn.send_query("N01?\r\n") != "0\r\n":
+                await asyncio.sleep(0.01)
+
+        try:
+            await conn.send_command("N01=1\r\n")
+            # A 50 s ramp at 1 unit/s, so it only finishes in time if it jumped
+            await asyncio.wait_for(wait_until_ramped(), 10.0)
+            return await conn.send_query("T01?\r\n")
+        finally:
+            await conn.close()
+            await simulation.stop()
+
+    temperature = asyncio.run(run())
+
+    assert temperature == "50.0\r\n"
+
+
+def test_requests_sent_together_are_coalesced():
+    async def run() -> tuple[list[bytes], list[str]]:
+        simulation = await start_simulation(4)
+        conn = PipelinedIPConnection()
+        await conn.connect(IPConnectionSettings("127.0.0.1", simulation.port))
+        writes: list[bytes] = []
+        write = conn._writer.write
+
+        def record(data: bytes) -> None:
+            writes.append(data)
+            write(data)
+
+        conn._writer.write = record  # type: ignore
+        await asyncio.gather(
+            *[conn.send_command(f"S{index:02d}={index}\r\n") for index in range(1, 5)]
+        )
+        responses = await asyncio.gather(
+            *[conn.send_query(f"S{index:02d}?\r\n") for index in range(1, 5)]
+        )
+
+        await conn.close()
+        await simulation.stop()
+        return writes, responses
+
+    writes, responses = asyncio.run(run())
+
+    assert writes == [
+        b"S01=1\r\nS02=2\r\nS03=3\r\nS04=4\r\n",
+        b"S01?\r\nS02?\r\nS03?\r\nS04?\r\n",
+    ]
+    assert responses == ["1\r\n", "2\r\n", "3\r\n", "4\r\n"]
+
+
+def test_controller_loads_recipe_run_by_device():
+    async def run() -> tuple[str, list[int], Response]:
+        config = TempControllerSim(
+            name="tempcont",
+            inputs={},
+            num_ramp_controllers=2,
+            port=0,
+            jump_to_events=True,
+        )
+        simulation = LocalSimulation(config)
+        await simulation.start()
+        controller = TempController(
+            TempControllerSettings(
+                2, IPConnectionSettings("127.0.0.1", simulation.port)
+            )
+        )
+        await controller.connect()
+        ramp = controller._ramp_controllers[0]
+        await ramp.recipe.sender.put(ramp, ramp.recipe, "0:5:10,5:20:0")
+        await ramp.enabled.sender.put(ramp, ramp.enabled, True)
+
+        segments = []
+        while ramp.enabled.get():
+            for attr in (ramp.segment, ramp.enabled):
+                await attr.updater.update(ramp, attr)  # type: ignore
+            segments.append(ramp.segment.get())
+            await asyncio.sleep(0.01)
+        current = await controller.conn.send_query("T01?\r\n")
+
+        await controller.close()
+        await simulation.stop()
+        return ramp.recipe.get(), segments, current
+
+    recipe, segments, current = asyncio.run(run())
+
+    # Two ramps and a 10 s dwell run by the device alone, in simulation time
+    assert recipe == "0:5:10,5:20:0"
+    assert segments[-1] == 0
+    assert current == "20.0\r\n"
+
+
+def test_invalid_recipes_are_not_sent():
+    async def run() -> tuple[list[Any], float]:
+        simulation = await start_simulation(2)
+        controller = TempController(
+            TempControllerSettings(
+                2, IPConnectionSettings("127.0.0.1", simulation.port)
+            )
+        )
+        await controller.connect()
+        ramp = controller._ramp_controllers[0]
+        try:
+            # Which the device would reply to, taking the place of the next reply
+            with pytest.raises(ValueError, match="recipe"):
+                await ramp.recipe.sender.put(ramp, ramp.recipe, "10:20")
+            await ramp.recipe.updater.update(ramp, ramp.recipe)
+            columns = [await controller.query_column(name) for name in "SE"]
+            await controller.ramp_rate.updater.update(controller, controller.ramp_rate)
+        finally:
+            await controller.close()
+            await simulation.stop()
+        return [ramp.recipe.get(), *columns], controller.ramp_rate.get()
+
+    replies, ramp_rate = asyncio.run(run())
+
+    assert replies == ["-", ["10", "10"], ["50", "50"]]
+    assert ramp_rate == 1.0
+
+
+def test_queries_time_out_and_recover_from_dropped_replies():
+    async def run() -> tuple[int, Response]:
+        config = TempControllerSim(
+            name="tempcont",
+            inputs={},
+            num_ramp_controllers=1,
+            port=0,
+            fault_drop_rate=1,
+        )
+        simulation = LocalSimulation(config)
+        await simulation.start()
+        member = PooledConnection(
+            PipelinedIPConnection, reconnect_period=0.01, timeout=0.1, retries=2
+        )
+        await member.connect(IPConnectionSettings("127.0.0.1", simulation.port))
+        attempts = 0
+        query = member._query
+
+        async def counting_query(message, timeout: float | None) -> Response:
+            nonlocal attempts
+            attempts += 1
+            return await query(message, timeout)
+
+        member._query = counting_query  # type: ignore[method-assign]
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(member.send_query("T01?\r\n"), timeout=10.0)
+
+        faults = simulation.component.adapters[0].faults  # type: ignore
+        faults.drop_rate = 0.0
+        await wait_until(lambda: member.healthy)
+        response = await member.send_query("T01?\r\n")
+
+        await member.close()
+        await simulation.stop()
+        return attempts, response
+
+    attempts, response = asyncio.run(run())
+
+    # The first attempt and two retries, each given up on by the watchdog, then the
+    # query after recovering
+    assert attempts == 4
+    assert response == "0.0\r\n"
+
+
+def test_server_caps_clients_and_throttles_those_not_reading_replies():
+    async def run() -> tuple[Response, dict, dict]:
+        config = TempControllerSim(
+            name="tempcont", inputs={}, num_ramp_controllers=99, port=0, max_clients=2
+        )
+        simulation = LocalSimulation(config)
+        await simulation.start()
+        settings = IPConnectionSettings("127.0.0.1", simulation.port)
+
+        # Floods the server with column queries without ever reading the replies
+        _, flooder = await asyncio.open_connection(settings.ip, settings.port)
+        flooder.write(b"T*?\r\n" * 200_000)
+        conn = PipelinedIPConnection()
+        await conn.connect(settings)
+        rejected, rejected_writer = await asyncio.open_connection(
+            settings.ip, settings.port
+        )
+        assert await rejected.read() == b""
+        rejected_writer.close()
+
+        # Wait for the socket buffers to fill up with replies
+        await wait_until(lambda: simulation.stats()["connections"][0]["throttled"])
+        # Bounded generously, as the point is that it is answered at all while the
+        # flooder is still queued, not how quickly on a loaded machine
+        response = await asyncio.wait_for(conn.send_query("T01?\r\n"), 10.0)
+        stats = simulation.stats()
+
+        flooder.transport.abort()
+        flooder.close()
+        await conn.close()
+        await simulation.stop()
+        return response, stats, stats["connections"][0]
+
+    response, stats, flooder = asyncio.run(run())
+
+    assert response == "0.0\r\n"
+    assert stats["clients"] == 2 and stats["rejected_clients"] == 1
+    assert 0 < flooder["messages"] < 200_000
+    assert flooder["throttled"] > 0 and flooder["backlog"] <= 16
+
+
+def test_capture_of_controller_traffic_is_replayed(tmp_path):
+    path = str(tmp_path / "capture.bin")
+
+    async def run() -> tuple[list[Record], dict, dict]:
+        simulation = await start_simulation(2)
+        settings = TempControllerSettings(
+            2, IPConnectionSettings("127.0.0.1", simulation.port), capture=path
+        )
+        controller = TempController(settings)
+        await controller.connect()
+        ramp = controller._ramp_controllers[1]
+        await ramp.end.sender.put(ramp, ramp.end, 30)
+        await ramp.end.updater.update(ramp, ramp.end)  # type: ignore
+        await controller.close()
+
+        with CaptureReader(path) as reader:
+            records = list(reader)
+            replayed = await Replay(
+                IPConnectionSettings("127.0.0.1", simulation.port), speed=0
+            ).run(reader)
+            simulation.device.set_end(0, 40)
+            diverged = await Replay(
+                IPConnectionSettings("127.0.0.1", simulation.port), speed=0
+            ).run(reader)
+
+        await simulation.stop()
+        return records, replayed, diverged
+
+    records, replayed, diverged = asyncio.run(run())
+
+    assert [(record.kind, record.request, record.response) for record in records] == [
+        (Kind.COMMAND, "E02=30\r\n", None),
+        (Kind.QUERY, "E02?\r\n", "30\r\n"),
+        (Kind.QUERY, "E*?\r\n", "50,30\r\n"),
+    ]
+    assert records[0].sent_at <= records[1].sent_at <= records[2].sent_at
+    assert replayed["requests"] == 3 and replayed["divergent"] == 0
+    assert diverged["divergences"] == {"E*?": 1}
+    assert diverged["examples"][0]["replayed"] == repr("40,30\r\n")
+
+
+def test_capture_appends_after_a_truncated_record(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    capture = TrafficCapture(path)
+    capture.record(Kind.QUERY, capture.start_time, 0, "T01?\r\n", "1.0\r\n")
+    capture.close()
+    with open(path, "ab") as f:
+        # The start of a record cut short by a crash
+        f.write(bytes(10))
+
+    capture = TrafficCapture(path)
+    for index in range(3):
+        capture.record(Kind.COMMAND, capture.start_time, 0, f"S0{index}=1\r\n", None)
+    capture.close()
+
+    with CaptureReader(path) as reader:
+        requests = [record.request for record in reader]
+    assert requests == ["T01?\r\n", "S00=1\r\n", "S01=1\r\n", "S02=1\r\n"]
+
+
+def test_scan_tasks_keep_polling_through_an_outage():
+    async def run() -> tuple[list[bool], list[int]]:
+        port = unused_port()
+        config = TempControllerSim(
+            name="tempcont",
+            inputs={},
+            num_ramp_controllers=1,
+            default_start=10,
+            port=port,
+        )
+        simulation = LocalSimulation(config)
+        await simulation.start()
+        controller = TempController(
+            TempControllerSettings(
+                1,
+                IPConnectionSettings("127.0.0.1", port),
+                timeout=0.2,
+                retries=0,
+                failure_threshold=2,
+                recovery_period=0.2,
+            )
+        )
+        await controller.connect()
+        ramp = controller.get_sub_controllers()[0]
+        tasks = [
+            asyncio.create_task(scan())
+            for scan in _get_scan_tasks(TempControllerMapping(controller))
+        ]
+        degraded, starts = [], []
+        try:
+            await wait_until(lambda: ramp.start.get() == 10)
+            starts.append(ramp.start.get())
+
+            await simulation.stop()
+            await wait_until(lambda: controller.degraded.get())
+            degraded.append(controller.degraded.get())
+            assert not any(task.done() for task in tasks)
+
+            # The device comes back with a different start, which is polled again
+            simulation = LocalSimulation(config)
+            await simulation.start()
+            simulation.device.set_start(0, 20)
+            await wait_until(
+                lambda: ramp.start.get() == 20 and not controller.degraded.get()
+            )
+            degraded.append(controller.degraded.get())
+            starts.append(ramp.start.get())
+            assert not any(task.done() for task in tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await controller.close()
+            await simulation.stop()
+        return degraded, starts
+
+    degraded, starts = asyncio.run(run())
+
+    assert degraded == [True, False]
+    assert starts == [10, 20]
@@ -0,0 +1,346 @@
+import asyncio
+import builtins
+from typing import Any
+
+import pytest
+from fastcs.connections import DisconnectedError, IPConnectionSettings
+from fastcs.datatypes import Bool, DataType, Float, Int, String
+from fastcs.mapping import Mapping
+
+from demo_fast_cs import controllers
+from demo_fast_cs import mapping as mapping_module
+from demo_fast_cs.controllers import TempController, TempControllerSettings, decoder
+from demo_fast_cs.mapping import TempControllerMapping
+from demo_fast_cs.protocol import Response
+
+
+class FakeConnection:
+    def __init__(self, replies: dict[str, str | Exception]) -> None:
+        self.replies = replies
+        self.queries: list[str] = []
+        self.commands: list[str] = []
+
+    def shard(self, key: int) -> "FakeConnection":
+        return self
+
+    async def send_command(self, message: str) -> None:
+        self.commands.append(message)
+
+    async def send_query(self, message: str) -> str:
+        self.queries.append(message)
+        await asyncio.sleep(0)
+        reply = self.replies[message]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def make_controller(
+    num_ramp_controllers: int, conn: FakeConnection, diagnostics: bool = False
+):
+    settings = TempControllerSettings(
+        num_ramp_controllers, IPConnectionSettings(), diagnostics=diagnostics
+    )
+    controller = TempController(settings)
+    controller.conn = conn  # type: ignore
+    for ramp in controller.get_sub_controllers():
+        ramp.conn = conn  # type: ignore
+    return controller
+
+
+def test_ramp_updates_share_one_column_query():
+    conn = FakeConnection({"T*?\r\n": "1.5,2.5,3.5\r\n", "N*?\r\n": "0,1,0\r\n"})
+    controller = make_controller(3, conn)
+    ramps = controller.get_sub_controllers()
+
+    async def update_all() -> None:
+        await asyncio.gather(
+            *[rc.current.updater.update(rc, rc.current) for rc in ramps],
+            *[rc.enabled.updater.update(rc, rc.enabled) for rc in ramps],
+        )
+
+    asyncio.run(update_all())
+
+    assert conn.queries == ["T*?\r\n", "N*?\r\n"]
+    assert [rc.current.get() for rc in ramps] == [1.5, 2.5, 3.5]
+    assert [rc.enabled.get() for rc in ramps] == [False, True, False]
+
+
+def test_columns_of_the_wrong_length_are_counted_not_raised():
+    # Configured with more ramp controllers than the device has
+    conn = FakeConnection({"T*?\r\n": "1.5,2.5,3.5,4.5\r\n"})
+    controller = make_controller(8, conn, diagnostics=True)
+    assert controller.diagnostics is not None
+    ramps = controller.get_sub_controllers()
+
+    async def update_all() -> None:
+        await asyncio.gather(
+            *[rc.current.updater.update(rc, rc.current) for rc in ramps]
+        )
+
+    asyncio.run(update_all())
+
+    assert [rc.current.get() for rc in ramps] == [0.0] * 8
+    assert controller.diagnostics.errors == {"poll:T": 8}
+    assert controller.breaker.failures == 0
+
+
+def test_idle_channels_are_polled_less_often():
+    conn = FakeConnection({"T*?\r\n": "1.5,2.5\r\n", "N*?\r\n": "1,0\r\n"})
+    controller = make_controller(2, conn)
+    enabled, idle = controller.get_sub_controllers()
+
+    async def update_twice() -> None:
+        await idle.enabled.updater.update(idle, idle.enabled)
+        await enabled.enabled.updater.update(enabled, enabled.enabled)
+        for _ in range(2):
+            await idle.current.updater.update(idle, idle.current)
+            await enabled.current.updater.update(enabled, enabled.current)
+
+    asyncio.run(update_twice())
+
+    # The idle channel backs off after its first poll
+    assert conn.queries.count("T*?\r\n") == 3
+
+
+def test_put_reads_value_back_on_same_connection():
+    conn = FakeConnection({"S02?\r\n": "30\r\n"})
+    controller = make_controller(2, conn)
+    ramp = controller.get_sub_controllers()[1]
+
+    asyncio.run(ramp.start.sender.put(ramp, ramp.start, 25))
+
+    assert conn.commands == ["S02=25\r\n"]
+    assert conn.queries == ["S02?\r\n"]
+    assert ramp.start.get() == 30
+
+
+def test_controller_puts_read_back_on_the_connection_they_were_sent_on():
+    class FakePool:
+        # Requests to the pool itself go to each member in turn
+        def __init__(self, members: list[FakeConnection]) -> None:
+            self.members = members
+            self.sent = 0
+
+        def shard(self, key: int) -> FakeConnection:
+            return self.members[key % len(self.members)]
+
+        async def send_command(self, message: str) -> None:
+            await self._next().send_command(message)
+
+        async def send_query(self, message: str) -> str:
+            return await self._next().send_query(message)
+
+        def _next(self) -> FakeConnection:
+            self.sent += 1
+            return self.members[self.sent % len(self.members)]
+
+    members = [FakeConnection({"R?\r\n": "2.0\r\n"}) for _ in range(2)]
+    controller = make_controller(1, FakeConnection({}))
+    controller.conn = FakePool(members)  # type: ignore
+
+    asyncio.run(controller.ramp_rate.sender.put(controller, controller.ramp_rate, 2.0))
+
+    assert members[0].commands == ["R=2.0\r\n"]
+    assert members[0].queries == ["R?\r\n"]
+    assert members[1].commands == members[1].queries == []
+
+
+def test_recipes_are_rejected_over_the_binary_protocol():
+    conn = FakeConnection({})
+    controller = TempController(
+        TempControllerSettings(1, IPConnectionSettings(), binary=True)
+    )
+    ramp = controller.get_sub_controllers()[0]
+    ramp.conn = conn  # type: ignore
+
+    with pytest.raises(ValueError, match="ASCII"):
+        asyncio.run(ramp.recipe.sender.put(ramp, ramp.recipe, "10:20:5"))
+    assert conn.commands == []
+
+
+def test_diagnostics_record_poll_latency_and_errors():
+    conn = FakeConnection({"R?\r\n": "1.0\r\n"})
+    controller = make_controller(1, conn, diagnostics=True)
+    assert controller.diagnostics is not None
+    ramp = controller.get_sub_controllers()[0]
+
+    async def update() -> None:
+        await controller.ramp_rate.updater.update(controller, controller.ramp_rate)
+        try:
+            await ramp.start.updater.update(ramp, ramp.start)
+        except KeyError:
+            pass
+        await controller.diag_errors.updater.update(controller, controller.diag_errors)
+        await controller.diag_poll_latency_p99.updater.update(
+            controller, controller.diag_poll_latency_p99
+        )
+
+    asyncio.run(update())
+
+    assert controller.diagnostics.latencies["poll:R"].total == 1
+    assert controller.diagnostics.errors == {"poll:S": 1}
+    assert controller.diag_errors.get() == 1
+    assert controller.diag_poll_latency_p99.get() > 0
+
+
+def test_updates_are_only_published_outside_deadband():
+    conn = FakeConnection({})
+    controller = make_controller(1, conn)
+    ramp = controller.get_sub_controllers()[0]
+    published: list[float] = []
+
+    async def record(value: float) -> None:
+        published.append(value)
+
+    ramp.current.set_update_callback(record)
+
+    async def poll(*responses: str) -> None:
+        for response in responses:
+            conn.replies["T*?\r\n"] = response
+            # Poll every time rather than backing off while the value is unchanged
+            ramp.current.updater._schedule(ramp.current).reset()
+            await ramp.current.updater.update(ramp, ramp.current)
+
+    asyncio.run(poll("1.0", "1.0", "1.0004", "1.0004", "1.0006", "2.0"))
+
+    # Float(prec=3) gives a deadband of 0.0005, relative to the published value
+    assert published == [1.0, 1.0006, 2.0]
+
+
+def test_cancel_all_is_one_broadcast_command():
+    conn = FakeConnection({})
+    controller = make_controller(3, conn)
+    ramps = controller.get_sub_controllers()
+
+    async def cancel_all() -> None:
+        for ramp in ramps:
+            await ramp.enabled.set(True)
+        await controller.cancel_all()
+
+    asyncio.run(cancel_all())
+
+    assert conn.commands == ["N*=0\r\n"]
+    assert [ramp.enabled.get() for ramp in ramps] == [False] * 3
+
+
+def test_mapping_matches_fastcs_mapping():
+    settings = TempControllerSettings(2, IPConnectionSettings())
+    expected = Mapping(TempController(settings)).get_controller_mappings()
+    mappings = TempControllerMapping(TempController(settings)).get_controller_mappings()
+
+    assert len(mappings) == len(expected) == 3
+    for mapping, reference in zip(mappings, expected):
+        assert list(mapping.attributes) == list(reference.attributes)
+        assert mapping.scan_methods == reference.scan_methods
+        assert mapping.put_methods == reference.put_methods
+        assert mapping.command_methods == reference.command_methods
+        for name, attr in mapping.attributes.items():
+            assert attr is getattr(mapping.controller, name)
+            assert attr is not getattr(type(mapping.controller), name)
+
+
+@pytest.mark.parametrize("num_ramp_controllers", [4, 256, 4096])
+def test_cold_start_looks_up_members_once_per_class(
+    monkeypatch: pytest.MonkeyPatch, num_ramp_controllers: int
+):
+    settings = TempControllerSettings(num_ramp_controllers, IPConnectionSettings())
+    lookups: list[type] = []
+
+    def counting_dir(*args: Any) -> list[str]:
+        lookups.extend(map(type, args))
+        return builtins.dir(*args)
+
+    # Counted rather than timed, as searching the members of every instance is what
+    # made startup slow, at ~700 us a channel with fastcs's Mapping
+    monkeypatch.setattr(controllers, "dir", counting_dir, raising=False)
+    monkeypatch.setattr(mapping_module, "dir", counting_dir, raising=False)
+    mapping = TempControllerMapping(TempController(settings))
+
+    assert len(mapping.get_controller_mappings()) == num_ramp_controllers + 1
+    # Only the first controller of each class is searched, however many there are
+    assert len(lookups) <= 4
+
+
+def test_degraded_controller_only_polls_enabled_temperatures():
+    conn = FakeConnection(
+        {
+            "T*?\r\n": "1.5,2.5\r\n",
+            "N*?\r\n": "1,0\r\n",
+            "S*?\r\n": DisconnectedError("Device not responding"),
+        }
+    )
+    controller = make_controller(2, conn)
+    controller.breaker.failure_threshold = 2
+    enabled, idle = controller.get_sub_controllers()
+
+    async def poll() -> None:
+        for ramp in (enabled, idle):
+            await ramp.enabled.updater.update(ramp, ramp.enabled)
+        # Failures are recorded on the breaker, not raised to the scan task
+        for ramp in (enabled, idle):
+            await ramp.start.updater.update(ramp, ramp.start)
+        await controller.degraded.updater.update(controller, controller.degraded)
+
+        conn.queries.clear()
+        for name in ("start", "end", "current"):
+            for ramp in (idle, enabled):
+                attr = getattr(ramp, name)
+                await attr.updater.update(ramp, attr)
+
+    asyncio.run(poll())
+
+    assert controller.degraded.get()
+    assert conn.queries == ["T*?\r\n"]
+    # The device answered, so the breaker closes again
+    assert not controller.breaker.degraded
+
+
+def test_a_failed_column_query_is_one_failure_for_every_ramp():
+    conn = FakeConnection({"T*?\r\n": DisconnectedError("Device not responding")})
+    controller = make_controller(8, conn)
+    ramps = controller.get_sub_controllers()
+
+    async def update_all() -> None:
+        await asyncio.gather(
+            *[rc.current.updater.update(rc, rc.current) for rc in ramps]
+        )
+
+    asyncio.run(update_all())
+
+    assert conn.queries == ["T*?\r\n"]
+    assert controller.breaker.failures == 1
+    assert not controller.breaker.degraded
+
+
+@pytest.mark.parametrize(
+    "datatype, response, value",
+    [
+        (Int(), "25\r\n", 25),
+        (Int(), 25.0, 25),
+        (Float(prec=3), "10.3\r\n", 10.3),
+        (Float(prec=3), 2, 2.0),
+        (Bool(), "1\r\n", True),
+        (Bool(), 0.0, False),
+        (String(), "0:5:10\r\n", "0:5:10"),
+    ],
+)
+def test_decoders(datatype: DataType, response: Response, value: Any):
+    decoded = decoder(datatype)(response)
+    assert decoded == value and type(decoded) is type(value)
+
+
+@pytest.mark.parametrize(
+    "datatype, response",
+    [
+        (Int(), "2.5\r\n"),
+        (Int(), 2.5),
+        (Float(prec=3), "np.float64(1.5)"),
+        (Bool(), "2\r\n"),
+        (Bool(), "True"),
+        (String(), 1.0),
+    ],
+)
+def test_decoders_reject_invalid_responses(datatype: DataType, response: Response):
+    with pytest.raises(ValueError):
+        decoder(datatype)(response)
@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+from demo_fast_cs.simulation.device import TempController
+from demo_fast_cs.simulation.farm import SimulatorFarm
+
+
+def test_farm_serves_devices_and_aggregated_stats():
+    template = TempController(
+        name="tempcont", inputs={}, num_ramp_controllers=2, port=0
+    )
+    farm = SimulatorFarm(template, num_devices=4, num_processes=2, stats_period=0.1)
+
+    async def read_stats() -> dict:
+        reader, writer = await asyncio.open_connection("127.0.0.1", farm.stats_port)
+        stats = json.loads(await reader.readline())
+        writer.close()
+        await writer.wait_closed()
+        return stats
+
+    async def wait_for_devices() -> None:
+        while len(farm.stats) < 4:
+            await asyncio.sleep(0.05)
+
+    async def run() -> tuple[dict, list[bytes]]:
+        task = asyncio.create_task(farm.run_forever())
+        try:
+            # Bounded, so that a farm which never reports fails rather than hangs
+            await asyncio.wait_for(wait_for_devices(), timeout=30.0)
+
+            replies = []
+            for device in farm.stats.values():
+                reader, writer = await asyncio.open_connection(
+                    "127.0.0.1", device["port"]
+                )
+                writer.write(b"R?\r\n")
+                replies.append(await reader.readline())
+                writer.close()
+                await writer.wait_closed()
+            return await read_stats(), replies
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    stats, replies = asyncio.run(run())
+
+    assert [device["name"] for device in stats["devices"]] == [
+        f"tempcont{index:03d}" for index in range(4)
+    ]
+    assert len({device["port"] for device in stats["devices"]}) == 4
+    assert stats["totals"]["devices"] == 4
+    assert replies == [b"1\r\n"] * 4
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import socket
+
+import pytest
+from fastcs.backend import _get_scan_tasks
+from fastcs.connections import IPConnectionSettings
+
+from demo_fast_cs.controllers import TempControllerSettings
+from demo_fast_cs.group import TempControllerGroup, load_devices
+from demo_fast_cs.mapping import TempControllerMapping
+from demo_fast_cs.simulation.device import TempController as TempControllerSim
+from demo_fast_cs.simulation.runner import LocalSimulation
+
+
+def test_devices_are_loaded_with_defaults(tmp_path):
+    path = tmp_path / "devices.yaml"
+    path.write_text("""
+devices:
+  - name: tc01
+    host: 10.0.0.1
+  - name: tc02
+    port: 4000
+    num_ramp_controllers: 16
+""")
+    defaults = TempControllerSettings(4, IPConnectionSettings("localhost", 25565))
+
+    tc01, tc02 = load_devices(path, defaults)
+
+    assert tc01 == TempControllerSettings(
+        4, IPConnectionSettings("10.0.0.1", 25565), name="tc01"
+    )
+    assert tc02 == TempControllerSettings(
+        16, IPConnectionSettings("localhost", 4000), name="tc02"
+    )
+
+    path.write_text(json.dumps({"devices": [{"name": "tc01", "colour": "red"}]}))
+    with pytest.raises(ValueError, match="colour"):
+        load_devices(path, defaults)
+
+
+def unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_group_serves_each_device_under_its_name():
+    async def run() -> tuple[TempControllerGroup, list[str], int]:
+        simulation = LocalSimulation(
+            TempControllerSim(
+                name="tempcont",
+                inputs={},
+                num_ramp_controllers=2,
+                default_start=10,
+                port=0,
+            )
+        )
+        await simulation.start()
+        group = TempControllerGroup(
+            [
+                TempControllerSettings(
+                    2, IPConnectionSettings("127.0.0.1", simulation.port), name="tc01"
+                ),
+                # Nothing is listening, so this device reconnects in the background
+                TempControllerSettings(
+                    1, IPConnectionSettings("127.0.0.1", unused_port()), name="tc02"
+                ),
+            ]
+        )
+        await group.connect()
+        live = group.devices[0].get_sub_controllers()
+        await live[1].end.sender.put(live[1], live[1].end, 30)
+        await group.num_disconnected.updater.update(group, group.num_disconnected)
+
+        paths = [
+            mapping.controller.path
+            for mapping in TempControllerMapping(group).get_controller_mappings()
+        ]
+        await group.close()
+        await simulation.stop()
+        return group, paths, live[1].end.get()
+
+    group, paths, end = asyncio.run(run())
+
+    assert paths == ["", "tc01", "tc01:ramp01", "tc01:ramp02", "tc02", "tc02:ramp01"]
+    assert end == 30
+    assert group.num_disconnected.get() == 1
+
+
+def test_scan_tasks_keep_polling_live_devices_while_one_is_dead():
+    async def run() -> tuple[list[int], bool]:
+        simulation = LocalSimulation(
+            TempControllerSim(
+                name="tempcont",
+                inputs={},
+                num_ramp_controllers=1,
+                default_start=10,
+                port=0,
+            )
+        )
+        await simulation.start()
+        group = TempControllerGroup(
+            [
+                TempControllerSettings(
+                    1, IPConnectionSettings("127.0.0.1", simulation.port), name="tc01"
+                ),
+                TempControllerSettings(
+                    1,
+                    IPConnectionSettings("127.0.0.1", unused_port()),
+                    name="tc02",
+                    timeout=0.2,
+                    retries=0,
+                ),
+            ]
+        )
+        await group.connect()
+        ramp = group.devices[0].get_sub_controllers()[0]
+        tasks = [
+            asyncio.create_task(scan())
+            for scan in _get_scan_tasks(TempControllerMapping(group))
+        ]
+
+        async def wait_for_start(value: int) -> int:
+            while ramp.start.get() != value:
+                await asyncio.sleep(0.01)
+            return value
+
+        starts = []
+        try:
+            starts.append(await asyncio.wait_for(wait_for_start(10), 10.0))
+            # Polls of the dead device keep failing meanwhile
+            simulation.device.set_start(0, 20)
+            starts.append(await asyncio.wait_for(wait_for_start(20), 10.0))
+            simulation.device.set_start(0, 30)
+            starts.append(await asyncio.wait_for(wait_for_start(30), 10.0))
+            running = not any(task.done() for task in tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await group.close()
+            await simulation.stop()
+        return starts, running
+
+    starts, running = asyncio.run(run())
+
+    assert starts == [10, 20, 30]
+    assert running
@@ -0,0 +1,110 @@
+import asyncio
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from fastcs.connections import IPConnectionSettings
+
+from demo_fast_cs.controllers import TempController, TempControllerSettings
+from demo_fast_cs.history import (
+    MAX_STRING_LENGTH,
+    TemperatureHistory,
+    format_samples,
+    format_trend,
+)
+
+
+def test_history_keeps_the_last_samples_of_each_channel():
+    history = TemperatureHistory(2, capacity=4)
+    for value in range(6):
+        history.update_all([value, -value])
+        history.sample()
+
+    assert history.count == 6 and history.size == 4
+    assert history.last(0, 10).tolist() == [2, 3, 4, 5]
+    assert history.last(1, 2).tolist() == [-4, -5]
+
+
+def test_history_decimates_into_min_max_mean_bins():
+    history = TemperatureHistory(1, capacity=100)
+    for value in [np.nan, 1, 5, 3, 2, 8, 4]:
+        history.update(0, value)
+        history.sample()
+
+    # The oldest sample does not fit into 3 whole bins
+    assert history.decimate(0, 3).tolist() == [[1, 5, 3], [2, 3, 2.5], [4, 8, 6]]
+    assert history.decimate(0, 10).shape == (7, 3)
+    assert format_trend(history.decimate(0, 2), 3) == "1.0:5.0:3.0,2.0:8.0:4.667"
+
+
+@pytest.mark.filterwarnings("error")
+def test_history_ignores_channels_without_samples():
+    history = TemperatureHistory(1, capacity=4)
+    history.sample()
+
+    assert np.isnan(history.decimate(0, 1)).all()
+    assert format_samples(history.last(0, 4), 3) == "nan"
+
+
+def test_ramp_controllers_publish_their_history():
+    settings = TempControllerSettings(
+        2,
+        IPConnectionSettings(),
+        history_samples=10,
+        history_length=3,
+        history_bins=2,
+    )
+    controller = TempController(settings)
+    history = controller.temperature_history
+    assert history is not None
+    ramp = controller.get_sub_controllers()[1]
+
+    async def sample(*temperatures: float) -> None:
+        for temperature in temperatures:
+            history.update(1, temperature)
+            await controller.sample_history()
+        for attr in (ramp.history, ramp.history_trend):
+            await attr.updater.update(ramp, attr)
+
+    asyncio.run(sample(10.1, 10.2, 10.3, 10.4))
+
+    assert ramp.history.get() == "10.2,10.3,10.4"
+    assert ramp.history_trend.get() == "10.1:10.2:10.15,10.3:10.4:10.35"
+
+
+def test_history_fits_in_a_string_attribute():
+    settings = TempControllerSettings(1, IPConnectionSettings(), history_samples=1000)
+    history = TemperatureHistory(1, capacity=settings.history_samples)
+    for index in range(1000):
+        history.update(0, -100.125 - index % 2)
+        history.sample()
+
+    samples = format_samples(history.last(0, settings.history_length), 3)
+    trend = format_trend(history.decimate(0, settings.history_bins), 3)
+    assert len(samples) <= MAX_STRING_LENGTH and len(trend) <= MAX_STRING_LENGTH
+    assert samples.count(",") == settings.history_length - 1
+    assert trend.count(",") == settings.history_bins - 1
+
+    # Longer values than allowed for drop the oldest samples rather than overflow
+    wide = format_samples(np.full(100, -12345.125), 3)
+    assert len(wide) <= MAX_STRING_LENGTH and wide.endswith("-12345.125")
+
+    with pytest.raises(ValueError, match="history_length"):
+        TempControllerSettings(
+            1, IPConnectionSettings(), history_samples=10, history_length=100
+        )
+    with pytest.raises(ValueError, match="history_bins"):
+        TempControllerSettings(
+            1, IPConnectionSettings(), history_samples=10, history_bins=50
+        )
+
+
+def test_history_is_only_imported_once_kept():
+    # It imports NumPy, which the controllers otherwise start up without
+    code = "import sys, demo_fast_cs.controllers; print(sorted(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+    assert "demo_fast_cs.history" not in result.stdout
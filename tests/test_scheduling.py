@@ -0,0 +1,44 @@
+from demo_fast_cs.scheduling import CircuitBreaker, PollSchedule
+
+
+def test_poll_schedule_backs_off_until_value_changes():
+    schedule = PollSchedule(min_period=2, max_period=10)
+
+    polls = []
+    for now in range(40):
+        if schedule.due(now):
+            polls.append(now)
+            schedule.polled(now, changed=20 <= now < 25)
+
+    assert polls == [0, 4, 12, 22, 24, 26, 30, 38]
+
+
+def test_poll_schedule_reset():
+    schedule = PollSchedule(min_period=0.2, max_period=5.0)
+    schedule.polled(0.0, changed=False)
+    schedule.polled(0.4, changed=False)
+
+    schedule.reset()
+
+    assert schedule.due(0.5)
+    assert schedule.period == 0.2
+
+
+def test_circuit_breaker_sheds_load_until_recovered():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_period=5.0)
+    breaker.failed(0.0)
+    breaker.failed(1.0)
+    assert not breaker.degraded
+
+    breaker.failed(2.0)
+    assert breaker.degraded
+    assert breaker.shedding(6.9)
+
+    # Probes are let through after the recovery period, and reopen it if they fail
+    assert not breaker.shedding(7.0)
+    breaker.failed(7.0)
+    assert breaker.shedding(8.0)
+
+    breaker.succeeded()
+    assert not breaker.degraded
+    assert not breaker.shedding(8.0)
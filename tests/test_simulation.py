@@ -0,0 +1,210 @@
+import asyncio
+
+import pytest
+from tickit.core.typedefs import SimTime
+
+from demo_fast_cs.protocol import FRAME, BinaryProtocol
+from demo_fast_cs.simulation.device import TempController as TempControllerSim
+from demo_fast_cs.simulation.device import TempControllerAdapter, TempControllerDevice
+from demo_fast_cs.simulation.runner import LocalSimulation
+
+
+def make_adapter(
+    num_ramp_controllers: int = 4, fast_path: bool = True
+) -> TempControllerAdapter:
+    adapter = TempControllerAdapter(fast_path=fast_path)
+    adapter.device = TempControllerDevice(num_ramp_controllers, 10, 50)
+
+    async def raise_interrupt() -> None:
+        pass
+
+    adapter.raise_interrupt = raise_interrupt
+    return adapter
+
+
+def send(adapter: TempControllerAdapter, message: bytes) -> list[bytes]:
+    async def handle() -> list[bytes]:
+        replies = await adapter.handle_message(message)
+        return [reply async for reply in replies if reply is not None]
+
+    return asyncio.run(handle())
+
+
+def test_single_channel_query():
+    adapter = make_adapter()
+    assert send(adapter, b"S02?") == [b"10"]
+
+
+def test_column_queries():
+    adapter = make_adapter(3)
+    send(adapter, b"S02=20\r\nE03=30\r\nN02=1\r\n")
+
+    assert send(adapter, b"S*?") == [b"10,20,10"]
+    assert send(adapter, b"E*?") == [b"50,50,30"]
+    assert send(adapter, b"N*?") == [b"0,1,0"]
+    assert send(adapter, b"T*?") == [b"0.0,20.0,0.0"]
+
+
+@pytest.mark.parametrize(
+    "message",
+    [b"T02?", b"N02=1", b"N*=1", b"S02=20", b"E02=1", b"R=2", b"R?", b"E*?"]
+    + [b"T2?", b"N02=2", b"S02=.5", b"S02=1.2.3", b"R?1", b"X01?", b"T02?\r"]
+    # Missing an index, or with one the command does not take
+    + [b"R01?", b"R01=2", b"T?", b"N=1", b"M=1", b"S*01?"],
+)
+def test_fast_path_matches_regex_commands(message: bytes):
+    fast, regex = make_adapter(fast_path=True), make_adapter(fast_path=False)
+
+    assert send(fast, message) == send(regex, message)
+    assert send(fast, b"N*?\nS*?\nE*?\nR?") == send(regex, b"N*?\nS*?\nE*?\nR?")
+
+
+def test_device_ramps_enabled_channels_to_end():
+    device = TempControllerDevice(2, 10, 12)
+    device.set_enabled(0, 1)
+    inputs = {"flux": 0.0}
+
+    update = device.update(SimTime(0), inputs)  # type: ignore
+    assert device.get_temps(0) == 10.0
+    assert update.call_at == SimTime(int(1e8))
+
+    device.update(SimTime(int(1.5e9)), inputs)  # type: ignore
+    assert device.get_temps(0) == 11.5
+
+    update = device.update(SimTime(int(3e9)), inputs)  # type: ignore
+    assert list(device.get_all_temps()) == [12.0, 0.0]
+    assert list(device.get_all_enabled()) == [0, 0]
+    assert update.call_at is None
+
+
+@pytest.mark.parametrize("enabled", [[1], [0, 1, 2]])
+def test_device_only_ramps_active_channels(enabled: list[int]):
+    # Enabling most channels takes the dense path, a few the sparse one
+    device = TempControllerDevice(4, 10, 12)
+    device.set_end(3, 5)
+    for index in enabled + [3]:
+        device.set_enabled(index, 1)
+    device.set_enabled(3, 0)
+    inputs = {"flux": 0.0}
+
+    device.update(SimTime(0), inputs)  # type: ignore
+    device.update(SimTime(int(1e9)), inputs)  # type: ignore
+    assert list(device.get_all_temps()) == [
+        11.0 if index in enabled else 10.0 * (index == 3) for index in range(4)
+    ]
+
+    device.set_enabled(enabled[0], 0)
+    update = device.update(SimTime(int(5e9)), inputs)  # type: ignore
+    assert list(device.get_all_enabled()) == [0, 0, 0, 0]
+    assert update.call_at is None
+
+
+def test_device_schedules_update_when_channel_finishes():
+    device = TempControllerDevice(2, 10, 50, time_scale=10, tick_period=None)
+    device.set_end(1, 20)
+    device.set_enabled(0, 1)
+    device.set_enabled(1, 1)
+    inputs = {"flux": 0.0}
+
+    # At 10 units/s channel 1 has 10 units to go
+    update = device.update(SimTime(0), inputs)  # type: ignore
+    assert update.call_at == SimTime(int(1e9))
+
+    update = device.update(update.call_at, inputs)  # type: ignore
+    assert list(device.get_all_temps()) == [20.0, 20.0]
+    assert list(device.get_all_enabled()) == [1, 0]
+    assert update.call_at == SimTime(int(4e9))
+
+
+def test_device_runs_recipe_segments_in_turn():
+    device = TempControllerDevice(2, 10, 50, tick_period=None)
+    device.set_recipe(0, [[10, 12, 1.5], [20, 21, 0]])
+    device.set_enabled(0, 1)
+    inputs = {"flux": 0.0}
+
+    update = device.update(SimTime(0), inputs)  # type: ignore
+    assert device.get_segment(0) == 1
+    assert device.get_segment_remaining(0) == 3.5
+    assert update.call_at == SimTime(int(2e9))
+
+    # Dwell at the end of the first segment, then start the next without a tick
+    update = device.update(update.call_at, inputs)  # type: ignore
+    assert device.get_temps(0) == 12.0
+    assert update.call_at == SimTime(int(3.5e9))
+    update = device.update(update.call_at, inputs)  # type: ignore
+    assert device.get_segment(0) == 2
+    assert device.get_temps(0) == 20.0
+    assert update.call_at == SimTime(int(4.5e9))
+
+    update = device.update(update.call_at, inputs)  # type: ignore
+    assert device.get_temps(0) == 21.0
+    assert list(device.get_all_segments()) == [0, 0]
+    assert list(device.get_all_enabled()) == [0, 0]
+    assert update.call_at is None
+
+
+def test_recipe_commands():
+    adapter = make_adapter(2)
+    assert send(adapter, b"P01?") == [b"-"]
+
+    send(adapter, b"P01=10:20:5,20:40:0.5\r\nN01=1\r\nN02=1")
+    assert send(adapter, b"P01?") == [b"10:20:5,20:40:0.5"]
+    assert send(adapter, b"G*?") == [b"1,0"]
+    assert send(adapter, b"L01?") == [b"15.0"]
+
+    send(adapter, b"P01=-")
+    assert send(adapter, b"P01?") == [b"-"]
+
+
+def test_floats_are_sent_to_fixed_precision_in_minimal_width():
+    adapter = make_adapter(3)
+    adapter.device._current[:] = [0.1 + 0.2, 10.300000000000002, 1 / 3]
+    adapter.device.set_ramp_rate(0.5)
+
+    assert send(adapter, b"T*?") == [b"0.3,10.3,0.333"]
+    assert send(adapter, b"T02?") == [b"10.3"]
+    assert send(adapter, b"R?") == [b"0.5"]
+    assert send(adapter, b"S*?") == [b"10,10,10"]
+
+
+def test_command_latencies_are_recorded_for_every_interpreter():
+    async def run() -> dict:
+        simulation = LocalSimulation(
+            TempControllerSim(
+                name="tempcont",
+                inputs={},
+                num_ramp_controllers=2,
+                port=0,
+                binary_port=0,
+                fast_path=False,
+                diagnostics=True,
+            )
+        )
+        await simulation.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", simulation.port)
+        writer.write(b"S01?\r\nS*?\r\n")
+        for _ in range(2):
+            await reader.readline()
+        binary_reader, binary_writer = await asyncio.open_connection(
+            "127.0.0.1", simulation.binary_port
+        )
+        binary_writer.write(BinaryProtocol().query("S", 1) + bytes(FRAME.size))
+        await binary_reader.readexactly(2 * FRAME.size)
+        for stream in (writer, binary_writer):
+            stream.close()
+            await stream.wait_closed()
+        stats = simulation.stats()
+        await simulation.stop()
+        return stats["commands"]
+
+    commands = asyncio.run(run())
+
+    assert commands.keys() == {"regex", "get_start", "unknown"}
+    assert commands["regex"]["count"] == 2
+    assert commands["get_start"]["count"] == 1
+    assert commands["unknown"] == {
+        "count": 0,
+        "errors": 1,
+        "p50_us": 0.0,
+        "p99_us": 0.0,
+    }
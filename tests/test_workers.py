@@ -0,0 +1,102 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+from fastcs.connections import IPConnectionSettings
+
+from demo_fast_cs.controllers import (
+    REQUEST_ERRORS,
+    TempController,
+    TempControllerSettings,
+)
+from demo_fast_cs.simulation.device import TempController as TempControllerSim
+from demo_fast_cs.simulation.runner import LocalSimulation
+from demo_fast_cs.workers import POLLED, REQUESTED
+
+
+def test_ramp_attributes_are_polled_from_worker_processes():
+    async def run() -> tuple[list[int], list[float], list[list[str]], bool]:
+        simulation = LocalSimulation(
+            TempControllerSim(
+                name="tempcont",
+                inputs={},
+                num_ramp_controllers=3,
+                default_start=10,
+                port=0,
+            )
+        )
+        await simulation.start()
+        controller = TempController(
+            TempControllerSettings(
+                3, IPConnectionSettings("127.0.0.1", simulation.port), workers=2
+            )
+        )
+        await controller.connect()
+        poller = controller.poller
+        assert poller is not None
+
+        def columns(kind: int) -> list[str]:
+            times = poller._times[kind, :, 0]
+            return [name for name, time in zip(poller.names, times) if time]
+
+        # Columns are only polled once they are requested by a handler
+        await asyncio.sleep(10 * poller.interval)
+        polls = [columns(POLLED)]
+        ramps = controller.get_sub_controllers()
+        for ramp in ramps:
+            await ramp.start.updater.update(ramp, ramp.start)
+        starts = [ramp.start.get() for ramp in ramps]
+        polls.append(columns(POLLED))
+
+        # Set over the controller's own connection, and polled back by a worker
+        await ramps[1].end.sender.put(ramps[1], ramps[1].end, 30)
+        ends = list(await controller.query_column("E"))
+
+        # A column left mid-write by a worker is never read torn, nor waited on forever
+        row = poller.names.index("S")
+        poller._generations[row, 0] += 1
+        with pytest.raises(asyncio.TimeoutError, match="being written"):
+            await controller.query_column("S")
+        poller._generations[row, 0] += 1
+
+        # Columns which the workers can no longer poll fail
+        await simulation.stop()
+        with pytest.raises(REQUEST_ERRORS):
+            await controller.query_column("T")
+
+        # Which the handlers count, and shed all but essential columns for
+        for _ in range(controller.breaker.failure_threshold):
+            controller.breaker.failed(asyncio.get_running_loop().time())
+        await ramps[0].segment.updater.update(ramps[0], ramps[0].segment)
+        polls.append(columns(POLLED))
+        polls.append(columns(REQUESTED))
+        await controller.close()
+        return starts, ends, polls, controller.poller is None
+
+    starts, ends, polls, stopped = asyncio.run(run())
+
+    assert starts == [10, 10, 10]
+    assert ends[1] == 30
+    assert polls == [[], ["S"], ["E", "S"], ["T", "E", "S"]]
+    assert stopped
+
+
+def test_workers_are_only_imported_once_enabled():
+    code = "import sys, demo_fast_cs.mapping; print(sorted(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    modules = result.stdout.strip("[]\n").replace("'", "").split(", ")
+
+    assert "demo_fast_cs.workers" not in modules
+    assert "numpy" not in modules
+    assert "yaml" not in modules
+
+
+def test_workers_can_not_be_captured(tmp_path):
+    ip_settings = IPConnectionSettings("127.0.0.1", 25565)
+    with pytest.raises(ValueError, match="capture"):
+        TempControllerSettings(
+            1, ip_settings, capture=str(tmp_path / "capture"), workers=1
+        )